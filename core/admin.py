@@ -10,12 +10,16 @@ admin.site.register(PatientMedicalProfile)
 admin.site.register(DonorMedicalProfile)
 admin.site.register(Appointment)
 admin.site.register(OrganMatching)
+admin.site.register(ExchangePair)
+admin.site.register(OutboxEvent)
 admin.site.register(Surgery)
 admin.site.register(MRIReport)
 admin.site.register(PatientPriority)
 admin.site.register(Alert)
 admin.site.register(UserReport)
 admin.site.register(SurgeryReport)
+admin.site.register(Job)
+admin.site.register(HLAAllele)
 # admin.site.register(VitalSign)
 
 
@@ -0,0 +1,172 @@
+import time
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import min_weight_full_bipartite_matching
+
+from .matching import matching_setting
+from .models import OrganMatching, User
+
+
+# الـ matches المرفوضة مش بتدخل في التوزيع
+REJECTED_STATUS = 'مرفوض'
+ALLOCATION_METHODS = ('auto', 'optimal', 'greedy')
+
+
+def priority_factor(priority):
+    # مريض من غير PatientPriority ← factor = 1
+    return 1 + matching_setting('ALLOCATION_PRIORITY_WEIGHT') * np.nan_to_num(priority)
+
+
+# ==========================
+# Problem
+# ==========================
+class AllocationProblem:
+    """
+    Sparse patient × donor weight matrix for one organ type: one edge per
+    stored OrganMatching row, weighted by match_percentage × priority factor.
+    Patients and donors are indexed in id order.
+    """
+
+    def __init__(self, organ_type, patient_ids, donor_ids, rows, cols, scores, weights):
+        self.organ_type = organ_type
+        self.patient_ids = patient_ids
+        self.donor_ids = donor_ids
+        self.rows = rows
+        self.cols = cols
+        self.scores = scores
+        self.weights = weights
+
+    @property
+    def edges(self):
+        return len(self.weights)
+
+    @classmethod
+    def load(cls, organ_type):
+        edges = list(
+            OrganMatching.objects
+            .filter(organ_type=organ_type, match_percentage__isnull=False)
+            .exclude(status=REJECTED_STATUS)
+            .values_list('patient_id', 'donor_id', 'match_percentage', 'patient__priority__score')
+        )
+        patients = np.array([e[0] for e in edges], dtype=np.int64)
+        donors = np.array([e[1] for e in edges], dtype=np.int64)
+        scores = np.array([e[2] for e in edges], dtype=np.float64)
+        priority = np.array([np.nan if e[3] is None else e[3] for e in edges], dtype=np.float64)
+        patient_ids, rows = np.unique(patients, return_inverse=True)
+        donor_ids, cols = np.unique(donors, return_inverse=True)
+        return cls(organ_type, patient_ids, donor_ids, rows, cols, scores, scores * priority_factor(priority))
+
+
+# ==========================
+# Solvers
+# ==========================
+def solve_optimal(problem):
+    """
+    Maximum-weight one-to-one assignment. Every patient gets a private dummy
+    donor (weight 0), so a full matching always exists and leaving a patient
+    unassigned is allowed; weights become positive costs C - w so that the
+    sparse LAPJV solver minimises exactly -sum(w).
+    Returns the indices of the chosen edges.
+    """
+    n_patients, n_donors = len(problem.patient_ids), len(problem.donor_ids)
+    ceiling = problem.weights.max() + 1
+    dummies = np.arange(n_patients)
+    graph = csr_matrix(
+        (
+            np.concatenate([ceiling - problem.weights, np.full(n_patients, ceiling)]),
+            (np.concatenate([problem.rows, dummies]), np.concatenate([problem.cols, n_donors + dummies])),
+        ),
+        shape=(n_patients, n_donors + n_patients),
+    )
+    rows, cols = min_weight_full_bipartite_matching(graph)
+    real = cols < n_donors
+    rows, cols = rows[real], cols[real]
+
+    # (row, col) ← رقم الـ edge
+    keys = problem.rows * n_donors + problem.cols
+    order = np.argsort(keys)
+    return order[np.searchsorted(keys[order], rows * n_donors + cols)]
+
+
+def solve_greedy(problem):
+    """
+    Take edges by descending weight while both ends are free. At most half
+    the optimum, but O(E log E), for instances too large for the exact solver.
+    Ties go to the lower patient id, then the lower donor id.
+    """
+    order = np.lexsort((problem.cols, problem.rows, -problem.weights))
+    limit = min(len(problem.patient_ids), len(problem.donor_ids))
+    patient_used = np.zeros(len(problem.patient_ids), dtype=bool)
+    donor_used = np.zeros(len(problem.donor_ids), dtype=bool)
+    chosen = []
+    for edge, row, col in zip(order.tolist(), problem.rows[order].tolist(), problem.cols[order].tolist()):
+        if patient_used[row] or donor_used[col]:
+            continue
+        patient_used[row] = donor_used[col] = True
+        chosen.append(edge)
+        if len(chosen) == limit:
+            break
+    return np.asarray(chosen, dtype=np.int64)
+
+
+# ==========================
+# Allocation run
+# ==========================
+def allocate_organ(organ_type, method='auto'):
+    problem = AllocationProblem.load(organ_type)
+    if method == 'auto':
+        method = 'greedy' if problem.edges > matching_setting('ALLOCATION_GREEDY_MIN_EDGES') else 'optimal'
+
+    started = time.perf_counter()
+    if not problem.edges:
+        chosen = np.zeros(0, dtype=np.int64)
+    elif method == 'greedy':
+        chosen = solve_greedy(problem)
+    else:
+        chosen = solve_optimal(problem)
+    solve_time = time.perf_counter() - started
+
+    patient_ids = problem.patient_ids[problem.rows[chosen]].tolist()
+    donor_ids = problem.donor_ids[problem.cols[chosen]].tolist()
+    names = {
+        user_id: f"{first_name} {last_name}"
+        for user_id, first_name, last_name in
+        User.objects.filter(pk__in=patient_ids + donor_ids).values_list('id', 'first_name', 'last_name')
+    }
+    assignments = [
+        {
+            "patient_id": patient_id,
+            "patient": names.get(patient_id),
+            "donor_id": donor_id,
+            "donor": names.get(donor_id),
+            "match_percentage": score,
+            "weight": round(weight, 4),
+        }
+        for patient_id, donor_id, score, weight in zip(
+            patient_ids, donor_ids, problem.scores[chosen].tolist(), problem.weights[chosen].tolist()
+        )
+    ]
+    assignments.sort(key=lambda a: (-a['weight'], a['patient_id']))
+    return {
+        "organ_type": organ_type,
+        "method": method,
+        "patients": len(problem.patient_ids),
+        "donors": len(problem.donor_ids),
+        "edges": problem.edges,
+        "assigned": len(assignments),
+        "objective": round(float(problem.weights[chosen].sum()), 4),
+        "solve_time": round(solve_time, 6),
+        "assignments": assignments,
+    }
+
+
+def allocate(organ_types=None, method='auto'):
+    """Solve the assignment separately for each organ type that has stored matches."""
+    if method not in ALLOCATION_METHODS:
+        raise ValueError(f"Unknown allocation method: {method}")
+    if not organ_types:
+        organ_types = sorted(
+            OrganMatching.objects.values_list('organ_type', flat=True).distinct().order_by()
+        )
+    return [allocate_organ(organ_type, method) for organ_type in organ_types]
@@ -0,0 +1,258 @@
+import time
+
+import numpy as np
+from scipy.optimize import Bounds, LinearConstraint, milp
+from scipy.sparse import csr_matrix
+
+from .matching import blood_compatible, matching_setting
+from .models import ExchangePair, OrganMatching, OrganType
+
+
+EXCHANGE_METHODS = ('auto', 'optimal', 'greedy')
+
+
+# ==========================
+# Compatibility graph
+# ==========================
+class CompatibilityGraph:
+    """
+    Directed graph over exchange pairs: an edge u → v means the donor of
+    pair u can give to the patient of pair v, weighted by the stored match
+    score. Altruistic donors only have outgoing edges. Adjacency is kept as
+    CSR (outgoing) and CSC-as-CSR (incoming) with sorted neighbours.
+    `patients` numbers the patient of each node (-1 for altruistic donors),
+    so pairs registered for the same patient share a number.
+    """
+
+    def __init__(self, pair_ids, altruistic, rows, cols, weights, patients=None):
+        self.pair_ids = np.asarray(pair_ids, dtype=np.int64)
+        self.altruistic = np.asarray(altruistic, dtype=bool)
+        n = len(self.pair_ids)
+        if patients is None:
+            patients = np.arange(n)
+        self.patients = np.where(self.altruistic, -1, np.asarray(patients, dtype=np.int64))
+        self.out = csr_matrix((weights, (rows, cols)), shape=(n, n))
+        self.out.sort_indices()
+        self.incoming = self.out.T.tocsr()
+        self.incoming.sort_indices()
+
+    def __len__(self):
+        return len(self.pair_ids)
+
+    @property
+    def edges(self):
+        return self.out.nnz
+
+    def successors(self, node):
+        return self.out.indices[self.out.indptr[node]:self.out.indptr[node + 1]]
+
+    def predecessors(self, node):
+        return self.incoming.indices[self.incoming.indptr[node]:self.incoming.indptr[node + 1]]
+
+    def weight(self, u, v):
+        start = self.out.indptr[u]
+        return float(self.out.data[start + np.searchsorted(self.successors(u), v)])
+
+    @classmethod
+    def load(cls, organ_type=OrganType.KIDNEY):
+        pairs = list(
+            ExchangePair.objects.filter(organ_type=organ_type, is_active=True)
+            .order_by('id')
+            .values_list('id', 'patient_id', 'donor_id', 'patient__blood_type', 'donor__blood_type')
+        )
+        donor_nodes = {p[2]: node for node, p in enumerate(pairs)}
+        patient_nodes = {}
+        for node, p in enumerate(pairs):
+            if p[1] is not None:
+                patient_nodes.setdefault(p[1], []).append(node)
+        matches = OrganMatching.objects.filter(
+            organ_type=organ_type, patient_id__in=list(patient_nodes), donor_id__in=list(donor_nodes),
+            match_percentage__gt=matching_setting('EXCHANGE_MIN_SCORE'),
+        ).values_list('patient_id', 'donor_id', 'match_percentage')
+
+        # edge لكل match متخزن بين متبرع pair ومريض pair تانية (O(E) مش O(n²))
+        rows, cols, weights = [], [], []
+        for patient_id, donor_id, score in matches.iterator():
+            u = donor_nodes[donor_id]
+            for v in patient_nodes[patient_id]:
+                if pairs[u][1] == patient_id or not blood_compatible(pairs[u][4], pairs[v][3]):
+                    continue
+                rows.append(u)
+                cols.append(v)
+                weights.append(score)
+        patient_numbers = {patient_id: number for number, patient_id in enumerate(patient_nodes)}
+        return cls(
+            [p[0] for p in pairs], [p[1] is None for p in pairs], rows, cols, weights,
+            [patient_numbers.get(p[1], -1) for p in pairs],
+        )
+
+
+# ==========================
+# Enumeration
+# ==========================
+def find_cycles(graph, max_length=3):
+    """
+    All 2-cycles and (with max_length 3) 3-cycles, each listed once starting
+    from its lowest node. Candidates are cut with sorted-array
+    intersections (successors of v ∩ predecessors of u) instead of walking
+    every path, so the cost follows the number of edges, not n³.
+    """
+    cycles = []
+    if max_length < 2:
+        return cycles
+    for u in range(len(graph)):
+        if graph.altruistic[u]:
+            continue
+        successors = graph.successors(u)
+        successors = successors[successors > u]
+        if not len(successors):
+            continue
+        predecessors = graph.predecessors(u)
+        predecessors = predecessors[predecessors > u]
+        for v in np.intersect1d(successors, predecessors, assume_unique=True).tolist():
+            cycles.append(((u, v), graph.weight(u, v) + graph.weight(v, u)))
+        if max_length < 3:
+            continue
+        for v in successors.tolist():
+            closing = np.intersect1d(graph.successors(v), predecessors, assume_unique=True)
+            for w in closing[closing != v].tolist():
+                cycles.append(((u, v, w), graph.weight(u, v) + graph.weight(v, w) + graph.weight(w, u)))
+    return cycles
+
+
+def find_chains(graph, max_length=3):
+    """
+    Simple paths of up to `max_length` transplants starting at each
+    altruistic donor; a patient receives at most once along a chain.
+    """
+    chains = []
+
+    def extend(path, weight):
+        if len(path) > 1:
+            chains.append((tuple(path), weight))
+        if len(path) > max_length:
+            return
+        tail = path[-1]
+        receiving = graph.patients[path].tolist()
+        for v in graph.successors(tail).tolist():
+            if v not in path and graph.patients[v] not in receiving:
+                path.append(v)
+                extend(path, weight + graph.weight(tail, v))
+                path.pop()
+
+    for start in np.flatnonzero(graph.altruistic).tolist():
+        extend([start], 0.0)
+    return chains
+
+
+# ==========================
+# Selection
+# ==========================
+def structure_rows(nodes, n_nodes, patients):
+    # كل structure بتاخد الـ pairs بتاعتها + المرضى اللي بيستلموا فيها (row بعد الـ pairs لكل مريض)
+    rows = list(nodes)
+    if patients is not None:
+        rows.extend(n_nodes + int(patients[node]) for node in nodes if patients[node] >= 0)
+    return rows
+
+
+def row_count(n_nodes, patients):
+    return n_nodes + (int(patients.max()) + 1 if patients is not None and len(patients) else 0)
+
+
+def select_greedy(structures, n_nodes, patients=None):
+    # الأتقل الأول، وعند التساوي الأكتر transplants ثم الأقصر
+    order = sorted(range(len(structures)), key=lambda i: (-structures[i][1], len(structures[i][0]), i))
+    used = np.zeros(row_count(n_nodes, patients), dtype=bool)
+    chosen = []
+    for i in order:
+        rows = structure_rows(structures[i][0], n_nodes, patients)
+        if not used[rows].any():
+            used[rows] = True
+            chosen.append(i)
+    return chosen
+
+
+def select_optimal(structures, n_nodes, time_limit=None, patients=None):
+    """
+    Maximum-weight node-disjoint set of cycles/chains as a 0/1 program: one
+    variable per structure, one `≤ 1` row per pair and, with `patients`,
+    one per patient so a patient with several pairs receives only once.
+    Returns None when the solver stops without a feasible solution.
+    """
+    members = [structure_rows(nodes, n_nodes, patients) for nodes, _ in structures]
+    columns = np.repeat(np.arange(len(structures)), [len(rows) for rows in members])
+    rows = np.fromiter((row for rows in members for row in rows), dtype=np.int64, count=len(columns))
+    shape = (row_count(n_nodes, patients), len(structures))
+    membership = csr_matrix((np.ones(len(columns)), (rows, columns)), shape=shape)
+    options = {'time_limit': time_limit} if time_limit else {}
+    result = milp(
+        c=-np.array([weight for _, weight in structures]),
+        constraints=LinearConstraint(membership, 0, 1),
+        integrality=np.ones(len(structures)),
+        bounds=Bounds(0, 1),
+        options=options,
+    )
+    if result.x is None:
+        return None
+    return np.flatnonzero(result.x > 0.5).tolist()
+
+
+# ==========================
+# Exchange run
+# ==========================
+def plan_exchange(organ_type=OrganType.KIDNEY, max_cycle=3, max_chain=3, method='auto', graph=None):
+    if method not in EXCHANGE_METHODS:
+        raise ValueError(f"Unknown exchange method: {method}")
+    if graph is None:
+        graph = CompatibilityGraph.load(organ_type)
+
+    started = time.perf_counter()
+    cycles = find_cycles(graph, max_cycle)
+    chains = find_chains(graph, max_chain) if max_chain else []
+    structures = cycles + chains
+    enumeration_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    chosen = None
+    if method == 'auto' and len(structures) > matching_setting('EXCHANGE_MILP_MAX_STRUCTURES'):
+        method = 'greedy'
+    if structures and method != 'greedy':
+        chosen = select_optimal(
+            structures, len(graph), matching_setting('EXCHANGE_TIME_LIMIT'), patients=graph.patients
+        )
+        method = 'optimal' if chosen is not None else 'greedy'
+    if chosen is None:
+        chosen = select_greedy(structures, len(graph), patients=graph.patients)
+    solve_time = time.perf_counter() - started
+
+    selected = []
+    for i in chosen:
+        nodes, weight = structures[i]
+        is_chain = bool(graph.altruistic[nodes[0]])
+        steps = zip(nodes, nodes[1:]) if is_chain else zip(nodes, nodes[1:] + nodes[:1])
+        selected.append({
+            "kind": "chain" if is_chain else "cycle",
+            "pairs": graph.pair_ids[list(nodes)].tolist(),
+            "transplants": [
+                {"from_pair": int(graph.pair_ids[u]), "to_pair": int(graph.pair_ids[v]),
+                 "match_percentage": graph.weight(u, v)}
+                for u, v in steps
+            ],
+            "weight": round(weight, 4),
+        })
+    selected.sort(key=lambda s: (-s['weight'], s['pairs']))
+    return {
+        "organ_type": organ_type,
+        "method": method,
+        "pairs": len(graph),
+        "altruistic": int(graph.altruistic.sum()),
+        "edges": graph.edges,
+        "cycles": len(cycles),
+        "chains": len(chains),
+        "transplants": sum(len(s['transplants']) for s in selected),
+        "objective": round(sum(s['weight'] for s in selected), 4),
+        "enumeration_time": round(enumeration_time, 6),
+        "solve_time": round(solve_time, 6),
+        "selected": selected,
+    }
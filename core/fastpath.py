@@ -0,0 +1,116 @@
+from rest_framework import serializers
+from rest_framework.response import Response
+
+from .serializers import UserMiniSerializer
+from .streaming import CHUNK_SIZE, StreamingListMixin, stream_format, stream_response
+
+
+# SerializerMethodFields اللي الـ mapper يعرف يحسبها من الأعمدة:
+# (serializer, field) ← (الأعمدة نسبة للـ serializer, function بنفس ترتيبها)
+METHOD_FIELDS = {
+    (UserMiniSerializer, 'full_name'): (('first_name', 'last_name'), lambda first, last: f"{first} {last}"),
+}
+
+# الـ fields دي to_representation بتاعها بيرجع القيمة زي ما الـ database بترجعها
+PLAIN_FIELDS = (serializers.CharField, serializers.EmailField, serializers.IntegerField, serializers.BooleanField)
+
+VALUE, NESTED, METHOD = 'value', 'nested', 'method'
+
+
+# ==========================
+# Row mappers
+# ==========================
+class RowMapper:
+    """
+    Turn values_list() rows into the dicts `serializer` renders. The
+    serializer's readable fields are compiled once into column lookups and
+    per-field converters, so each row skips model instances, descriptor
+    access and the per-field serializer dispatch. Raises ValueError for a
+    field it can't compile (a method field not in METHOD_FIELDS, a to-many
+    relation).
+    """
+
+    def __init__(self, serializer, aliases=None):
+        self.aliases = aliases or {}
+        self.lookups = []
+        self.positions = {}
+        self.steps = self.compile(serializer, '')
+
+    def column(self, path):
+        lookup = self.aliases.get(path, path)
+        if lookup not in self.positions:
+            self.positions[lookup] = len(self.lookups)
+            self.lookups.append(lookup)
+        return self.positions[lookup]
+
+    def compile(self, serializer, prefix):
+        steps = []
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            if isinstance(field, serializers.SerializerMethodField):
+                method = METHOD_FIELDS.get((type(serializer), name))
+                if method is None:
+                    raise ValueError(f"No row mapping for {type(serializer).__name__}.{name}")
+                columns, function = method
+                steps.append((name, METHOD, (tuple(self.column(prefix + c) for c in columns), function)))
+                continue
+            path = prefix + '__'.join(field.source_attrs)
+            if isinstance(field, (serializers.ListSerializer, serializers.ManyRelatedField)):
+                raise ValueError(f"No row mapping for to-many field {type(serializer).__name__}.{name}")
+            if isinstance(field, serializers.BaseSerializer):
+                # الـ foreign key نفسه بيقول لو الـ nested هيطلع None
+                steps.append((name, NESTED, (self.column(path), self.compile(field, path + '__'))))
+                continue
+            plain = type(field) in PLAIN_FIELDS or isinstance(field, serializers.RelatedField)
+            steps.append((name, VALUE, (self.column(path), None if plain else field.to_representation)))
+        return steps
+
+    def values(self, queryset):
+        return queryset.values_list(*self.lookups)
+
+    def map(self, row):
+        return self.build(self.steps, row)
+
+    def build(self, steps, row):
+        data = {}
+        for name, kind, payload in steps:
+            if kind is VALUE:
+                position, convert = payload
+                value = row[position]
+                data[name] = value if value is None or convert is None else convert(value)
+            elif kind is NESTED:
+                position, nested = payload
+                data[name] = None if row[position] is None else self.build(nested, row)
+            else:
+                positions, function = payload
+                data[name] = function(*(row[position] for position in positions))
+        return data
+
+
+class FastListMixin(StreamingListMixin):
+    """
+    list() through values_list() and a RowMapper compiled from the viewset's
+    serializer (so ?fields= / ?expand= apply), paginated, or streamed for
+    the StreamingListMixin formats. `fast_list_aliases` maps a field path
+    to the annotation that holds it. Shapes the mapper can't compile go
+    through the serializer.
+    """
+    fast_list_aliases = {}
+
+    def list(self, request, *args, **kwargs):
+        try:
+            mapper = RowMapper(self.get_serializer(), self.fast_list_aliases)
+        except ValueError:
+            return super().list(request, *args, **kwargs)
+        rows = mapper.values(self.filter_queryset(self.get_queryset()))
+
+        fmt = stream_format(request)
+        if fmt:
+            return stream_response(
+                map(mapper.map, rows.iterator(chunk_size=CHUNK_SIZE)), fmt, filename=f"{self.basename}.csv"
+            )
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response([mapper.map(row) for row in page])
+        return Response([mapper.map(row) for row in rows])
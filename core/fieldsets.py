@@ -0,0 +1,143 @@
+from rest_framework.permissions import SAFE_METHODS
+
+
+# ==========================
+# ?fields= / ?expand=
+# ==========================
+def split_param(value):
+    if value is None:
+        return None
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+def nested_expand(expand, name):
+    # 'organ_matching_detail.patient_detail' ← 'patient_detail' للـ nested serializer
+    if expand is None:
+        return None
+    prefix = f'{name}.'
+    return [path[len(prefix):] for path in expand if path.startswith(prefix)]
+
+
+def nested_serializer(field):
+    field = getattr(field, 'child', field)
+    return field if isinstance(field, DynamicFieldsMixin) else None
+
+
+class DynamicFieldsMixin:
+    """
+    Sparse output for a ModelSerializer. `fields` keeps only the named
+    fields, and the relations in Meta.expandable_fields are left out unless
+    named in `expand` (dotted paths reach into nested serializers). With
+    neither argument the serializer renders its full shape as before.
+
+    Meta.expandable_fields maps each relation field to the select_related
+    lookups it reads, so viewsets can load exactly the requested shape.
+    """
+
+    def __init__(self, *args, fields=None, expand=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None or expand is not None:
+            self.restrict(fields, expand or [])
+
+    @classmethod
+    def expandable_fields(cls):
+        return getattr(cls.Meta, 'expandable_fields', {})
+
+    @classmethod
+    def kept_fields(cls, names, fields=None, expand=None):
+        """The names out of `names` the shape renders; no fields and no expand is the full shape."""
+        if fields is None and expand is None:
+            return list(names)
+        expanded = {path.split('.')[0] for path in expand or ()} | set(fields or ())
+        expandable = cls.expandable_fields()
+        return [
+            name for name in names
+            if (fields is None or name in expanded) and (name not in expandable or name in expanded)
+        ]
+
+    def restrict(self, fields, expand):
+        kept = set(self.kept_fields(self.fields, fields, expand))
+        for name in list(self.fields):
+            if name not in kept:
+                self.fields.pop(name)
+                continue
+            nested = nested_serializer(self.fields[name])
+            if nested is not None:
+                nested.restrict(None, nested_expand(expand, name))
+
+    @classmethod
+    def related_paths(cls, fields=None, expand=None):
+        """select_related lookups for the relations the shape renders, nested ones included."""
+        if fields is not None and expand is None:
+            expand = []
+        kept = cls.kept_fields(cls.Meta.fields, fields, expand)
+        paths = []
+        for name, lookups in cls.expandable_fields().items():
+            if name not in kept:
+                continue
+            paths += lookups
+            nested = nested_serializer(cls._declared_fields.get(name))
+            if nested is not None and lookups:
+                paths += [f'{lookups[0]}__{path}' for path in nested.related_paths(None, nested_expand(expand, name))]
+        return paths
+
+    @classmethod
+    def only_fields(cls, fields=None, expand=None):
+        """
+        Model fields for .only() when `fields` is given and every kept field
+        reads one model field (a column, or the foreign key of a relation it
+        expands); None otherwise.
+        """
+        if fields is None:
+            return None
+        model = cls.Meta.model
+        concrete = {field.name for field in model._meta.concrete_fields}
+        columns = {model._meta.pk.name}
+        for name in cls.kept_fields(cls.Meta.fields, fields, expand or []):
+            source = getattr(cls._declared_fields.get(name), 'source', None) or name
+            if source not in concrete:
+                return None
+            columns.add(source)
+        return sorted(columns)
+
+
+class DynamicFieldsViewMixin:
+    """
+    ?fields= / ?expand= on reads: handed to the serializer, and the queryset
+    selects only the relations and columns that shape renders (the full
+    shape selects every relation the serializer nests).
+    """
+
+    def requested_shape(self):
+        """(fields, expand) from the query string, or None for the full shape."""
+        request = getattr(self, 'request', None)
+        if request is None or request.method not in SAFE_METHODS:
+            return None
+        fields = split_param(request.query_params.get('fields'))
+        expand = split_param(request.query_params.get('expand'))
+        if fields is None and expand is None:
+            return None
+        return fields, expand or []
+
+    def renders_field(self, name):
+        shape = self.requested_shape()
+        return shape is None or name in self.get_serializer_class().kept_fields([name], *shape)
+
+    def get_serializer(self, *args, **kwargs):
+        shape = self.requested_shape()
+        if shape is not None:
+            kwargs.setdefault('fields', shape[0])
+            kwargs.setdefault('expand', shape[1])
+        return super().get_serializer(*args, **kwargs)
+
+    def shape_queryset(self, queryset):
+        serializer_class = self.get_serializer_class()
+        if not issubclass(serializer_class, DynamicFieldsMixin):
+            return queryset
+        fields, expand = self.requested_shape() or (None, None)
+        queryset = queryset.select_related(*serializer_class.related_paths(fields, expand))
+        only = serializer_class.only_fields(fields, expand)
+        return queryset.only(*only) if only else queryset
+
+    def get_queryset(self):
+        return self.shape_queryset(super().get_queryset())
@@ -0,0 +1,34 @@
+# Compact HLA typings: six uint16 allele codes per user in User.hla_packed (0 = not typed).
+import struct
+
+import numpy as np
+
+
+HLA_FIELDS = ('HLA_A_1', 'HLA_A_2', 'HLA_B_1', 'HLA_B_2', 'HLA_DR_1', 'HLA_DR_2')
+MAX_ALLELE_CODE = 0xFFFF
+
+PACK_FORMAT = '<6H'
+PACKED_SIZE = struct.calcsize(PACK_FORMAT)
+
+
+def normalize_allele(value):
+    if not value:
+        return None
+    value = value.strip().upper()
+    return value or None
+
+
+def pack_codes(codes):
+    return struct.pack(PACK_FORMAT, *codes)
+
+
+def unpack_codes(packed):
+    return struct.unpack(PACK_FORMAT, bytes(packed))
+
+
+def unpack_many(packed_values):
+    """Decode a sequence of packed typings into an (n, 6) uint16 array."""
+    if not packed_values:
+        return np.zeros((0, len(HLA_FIELDS)), dtype=np.uint16)
+    buffer = b''.join(bytes(value) for value in packed_values)
+    return np.frombuffer(buffer, dtype='<u2').reshape(len(packed_values), len(HLA_FIELDS)).astype(np.uint16)
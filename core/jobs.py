@@ -0,0 +1,151 @@
+import datetime
+import inspect
+import os
+import socket
+import time
+import traceback
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .allocation import allocate
+from .exchange import plan_exchange
+from .matching import MatchRun
+from .models import Job, OrganType
+from .priority import calculate_priorities
+
+
+# handler لكل نوع job: handler(job, **job.params) ← result (JSON)
+JOB_HANDLERS = {}
+
+# أقل وقت بين كل حفظ للـ progress في الداتابيز
+PROGRESS_INTERVAL = 1.0
+
+# job في حالة running من غير heartbeat من المدة دي يعتبر الـ worker بتاعه مات ويرجع للـ queue
+STALE_AFTER = datetime.timedelta(minutes=30)
+
+
+def job_handler(kind):
+    def register(func):
+        JOB_HANDLERS[kind] = func
+        return func
+    return register
+
+
+def check_params(kind, params):
+    """Raise ValueError unless `params` fit the keyword arguments of the handler for `kind`."""
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    if not isinstance(params, dict):
+        raise ValueError("params must be an object")
+    try:
+        inspect.signature(JOB_HANDLERS[kind]).bind(None, **params)
+    except TypeError as exc:
+        raise ValueError(f"Invalid params for {kind}: {exc}") from None
+
+
+def enqueue_job(kind, params=None):
+    params = params or {}
+    check_params(kind, params)
+    return Job.objects.create(kind=kind, params=params)
+
+
+def wants_background(request):
+    return request.query_params.get('background', '').lower() in ('1', 'true', 'yes')
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+# ==========================
+# Worker side
+# ==========================
+def requeue_stale_jobs(stale_after=STALE_AFTER):
+    """Put running jobs whose worker stopped sending heartbeats back in the queue."""
+    cutoff = timezone.now() - stale_after
+    # الـ jobs اللي اتعملها claim قبل heartbeat_at بتتقاس بـ started_at
+    return Job.objects.filter(
+        Q(heartbeat_at__lt=cutoff) | Q(heartbeat_at__isnull=True, started_at__lt=cutoff), status='running',
+    ).update(status='queued', worker=None, started_at=None, heartbeat_at=None)
+
+
+def claim_next_job(worker=None):
+    """Atomically move the oldest queued job to running."""
+    requeue_stale_jobs()
+    with transaction.atomic():
+        # skip_locked: كل worker بياخد job مختلف من غير ما يستنى التاني
+        job = (
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(status='queued')
+            .order_by('created_at', 'id')
+            .first()
+        )
+        if job is None:
+            return None
+        job.status = 'running'
+        job.worker = worker or worker_name()
+        job.started_at = job.heartbeat_at = timezone.now()
+        job.save(update_fields=['status', 'worker', 'started_at', 'heartbeat_at'])
+    return job
+
+
+class ProgressReporter:
+    def __init__(self, job):
+        self.job = job
+        self.last_saved = 0
+
+    def __call__(self, processed, total, rows_written=0):
+        job = self.job
+        job.processed, job.total, job.rows_written = processed, total, rows_written
+        now = time.monotonic()
+        if processed >= (total or 0) or now - self.last_saved >= PROGRESS_INTERVAL:
+            # كل حفظ للـ progress هو heartbeat كمان (requeue_stale_jobs)
+            Job.objects.filter(pk=job.pk).update(
+                processed=processed, total=total, rows_written=rows_written, heartbeat_at=timezone.now()
+            )
+            self.last_saved = now
+
+
+def run_job(job):
+    handler = JOB_HANDLERS.get(job.kind)
+    try:
+        if handler is None:
+            raise ValueError(f"Unknown job kind: {job.kind}")
+        job.result = handler(job, **job.params)
+        job.status = 'done'
+    except Exception:
+        job.status = 'failed'
+        job.error = traceback.format_exc()
+    job.finished_at = timezone.now()
+    job.save(update_fields=[
+        'status', 'result', 'error', 'processed', 'total', 'rows_written', 'finished_at'
+    ])
+    return job
+
+
+# ==========================
+# Handlers
+# ==========================
+@job_handler('auto_match')
+def auto_match_job(job, batch_size=None, k=None, workers=None):
+    run = MatchRun(batch_size=batch_size, progress=ProgressReporter(job), k=k, workers=workers)
+    for _ in run:
+        pass
+    return run.summary()
+
+
+@job_handler('calculate_priority')
+def calculate_priority_job(job):
+    return calculate_priorities(progress=ProgressReporter(job), details=False)
+
+
+@job_handler('allocate')
+def allocate_job(job, organ_types=None, method='auto'):
+    return allocate(organ_types, method)
+
+
+@job_handler('exchange')
+def exchange_job(job, organ_type=None, max_cycle=3, max_chain=3, method='auto'):
+    return plan_exchange(organ_type or OrganType.KIDNEY, max_cycle, max_chain, method)
@@ -0,0 +1,100 @@
+import datetime
+import decimal
+import io
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from core.renderers import FastJSONParser, FastJSONRenderer, orjson
+
+FIRST_NAMES = ["محمد", "أحمد", "محمود", "علي", "يوسف", "سارة", "مريم", "نور"]
+LAST_NAMES = ["حسن", "إبراهيم", "عبدالله", "السيد", "خالد", "سالم"]
+MESSAGES = [
+    "تم العثور على متبرع متوافق بنسبة عالية",
+    "تم تأكيد المطابقة وجدولة العملية",
+    "تحديث في حالة المريض: العلامات الحيوية خارج المعدل الطبيعي",
+]
+
+
+def alert_rows(count, rng):
+    now = timezone.now()
+    return [
+        {
+            "id": n, "user": n % 500,
+            "user_detail": {"id": n % 500, "full_name": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+                            "role": "patient", "national_id": f"2990101{n:07d}", "blood_type": "O+", "gender": "ذكر"},
+            "message": rng.choice(MESSAGES), "message_title": "تنبيه مطابقة", "alert_type": "معلومة",
+            "read": rng.random() < 0.5, "created_at": now - datetime.timedelta(minutes=n),
+        }
+        for n in range(count)
+    ]
+
+
+def hospital_dashboard(patients, rng):
+    # شكل HospitalFullSerializer: counts + مرضى بالـ matches والتنبيهات
+    return {
+        "id": 1, "name": "مستشفى القصر العيني", "hospital_type": "حكومي", "patients_count": patients,
+        "total_matches": patients * 5, "scheduled_surgeries_count": patients // 10,
+        "patients": [
+            {
+                "id": n, "full_name": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}", "status": "موافق عليه",
+                "birthdate": datetime.date(1980, 1, 1) + datetime.timedelta(days=n), "bmi": decimal.Decimal("24.50"),
+                "priority": {"score": rng.randint(0, 80), "level": "اولوليه متوسطة"},
+                "matches": [
+                    {"donor": d, "organ_type": "كلية", "match_percentage": rng.uniform(40, 100),
+                     "ai_result": {"rules": {"hla": -10, "abo": -5}}, "status": "قيد الانتظار"}
+                    for d in range(5)
+                ],
+                "alerts": alert_rows(3, rng),
+            }
+            for n in range(patients)
+        ],
+    }
+
+
+PAYLOADS = {
+    'alerts': lambda size, rng: alert_rows(size, rng),
+    'hospital': lambda size, rng: hospital_dashboard(size // 10 or 1, rng),
+}
+
+
+def best_time(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+
+class Command(BaseCommand):
+    help = "Benchmark FastJSONRenderer / FastJSONParser against DRF's JSON renderer and parser"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000])
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        if orjson is None:
+            self.stdout.write("orjson is not installed: FastJSONRenderer falls back to the stdlib renderer")
+        rng = random.Random(options['seed'])
+        for name, payload in PAYLOADS.items():
+            for size in options['sizes']:
+                self.bench(name, size, payload(size, rng), options['repeat'])
+
+    def bench(self, name, size, data, repeat):
+        stdlib_render, body = best_time(lambda: JSONRenderer().render(data), repeat)
+        fast_render, fast_body = best_time(lambda: FastJSONRenderer().render(data), repeat)
+        stdlib_parse, parsed = best_time(lambda: JSONParser().parse(io.BytesIO(body)), repeat)
+        fast_parse, fast_parsed = best_time(lambda: FastJSONParser().parse(io.BytesIO(body)), repeat)
+        self.stdout.write(
+            f"{name:<9} size={size:<6} bytes={len(body):<10,} "
+            f"render {stdlib_render * 1000:8.2f}ms → {fast_render * 1000:8.2f}ms (x{stdlib_render / fast_render:.1f})  "
+            f"parse {stdlib_parse * 1000:8.2f}ms → {fast_parse * 1000:8.2f}ms (x{stdlib_parse / fast_parse:.1f})  "
+            f"{'identical' if body == fast_body and parsed == fast_parsed else 'DIFFERENT'}"
+        )
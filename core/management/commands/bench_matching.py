@@ -0,0 +1,116 @@
+import datetime
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.matching import (
+    HLA_FIELDS, BlockingIndex, Cohort, HLAEncoder, iter_blocked_pair_results, iter_pair_results,
+    iter_score_blocks,
+)
+from core.models import OrganMatching, OrganType, User
+from core.scoring import DEFAULT_RULES
+
+ALLELES = {
+    'HLA_A': ["A*01", "A*02", "A*03", "A*11", "A*24", "A*26", "A*68"],
+    'HLA_B': ["B*07", "B*08", "B*35", "B*44", "B*51", "B*52"],
+    'HLA_DR': ["DR*01", "DR*03", "DR*04", "DR*07", "DR*11", "DR*15"],
+}
+ORGANS = [organ.value for organ in OrganType]
+BLOOD_TYPES = ["O+", "A+", "B+", "AB+", "O-", "A-", "B-", "AB-"]
+BLOOD_TYPE_WEIGHTS = [36, 32, 20, 5, 3, 2, 1.5, 0.5]
+
+
+def synthetic_rows(count, role, start_id, rng):
+    rows = []
+    for n in range(count):
+        hla = []
+        for field in HLA_FIELDS:
+            # حوالي 5% من الـ typings ناقصة
+            hla.append(None if rng.random() < 0.05 else rng.choice(ALLELES[field.rsplit('_', 1)[0]]))
+        bmi = None if rng.random() < 0.1 else round(rng.uniform(16, 40), 2)
+        organ = rng.choice(ORGANS)
+        blood_type = rng.choices(BLOOD_TYPES, weights=BLOOD_TYPE_WEIGHTS)[0]
+        pra = None if rng.random() < 0.2 else round(rng.uniform(0, 100), 1)
+        birthdate = datetime.date(1950, 1, 1) + datetime.timedelta(days=rng.randrange(365 * 55))
+        rows.append((
+            start_id + n, "first", f"{role}{n}", role, bmi, organ, blood_type,
+            pra, rng.random() < 0.5, rng.random() < 0.9, birthdate, *hla,
+        ))
+    return rows
+
+
+def rows_to_users(rows):
+    users = []
+    for row in rows:
+        user = User(id=row[0], first_name=row[1], last_name=row[2], role=row[3], bmi=row[4])
+        user.blood_type = row[6]
+        user.PRA, user.CMV_status, user.EBV_status, user.birthdate = row[7:11]
+        for field, value in zip(HLA_FIELDS, row[11:]):
+            setattr(user, field, value)
+        users.append(user)
+    return users
+
+
+class Command(BaseCommand):
+    help = "Benchmark the vectorized matcher against per-pair OrganMatching.calculate_match"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--patients', type=int, default=500)
+        parser.add_argument('--donors', type=int, default=500)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        patient_rows = synthetic_rows(options['patients'], 'patient', 1, rng)
+        donor_rows = synthetic_rows(options['donors'], 'donor', len(patient_rows) + 1, rng)
+        patients, donors = rows_to_users(patient_rows), rows_to_users(donor_rows)
+        pairs = len(patients) * len(donors)
+
+        started = time.perf_counter()
+        baseline = [
+            OrganMatching.calculate_match(patient, donor)
+            for patient in patients for donor in donors
+        ]
+        baseline_time = time.perf_counter() - started
+
+        started = time.perf_counter()
+        encoder = HLAEncoder()
+        patient_cohort = Cohort.from_rows(patient_rows, encoder)
+        donor_cohort = Cohort.from_rows(donor_rows, encoder)
+        for _ in iter_score_blocks(patient_cohort, donor_cohort, rules=DEFAULT_RULES):
+            pass
+        matrix_time = time.perf_counter() - started
+
+        # نفس الحساب بس مع بناء dict لكل pair زي calculate_match
+        started = time.perf_counter()
+        vectorized = [
+            result for _, _, result in iter_pair_results(patient_cohort, donor_cohort, rules=DEFAULT_RULES)
+        ]
+        vectorized_time = matrix_time + time.perf_counter() - started
+
+        mismatched = sum(
+            1 for old, new in zip(baseline, vectorized)
+            if old['match_percentage'] != new['match_percentage'] or old['ai_result'] != new['ai_result']
+        )
+        if mismatched:
+            self.stderr.write(self.style.ERROR(f"{mismatched} pairs differ from calculate_match"))
+
+        # الـ blocking بيستبعد الأزواج اللي العضو أو فصيلة الدم فيها مش متوافقين
+        started = time.perf_counter()
+        index = BlockingIndex(patient_cohort, donor_cohort)
+        blocked = sum(1 for _ in iter_blocked_pair_results(patient_cohort, donor_cohort, index))
+        blocked_time = time.perf_counter() - started
+
+        self.stdout.write(f"pairs:       {pairs}")
+        self.stdout.write(f"per-pair:    {baseline_time:.3f}s ({pairs / baseline_time:,.0f} pairs/s)")
+        self.stdout.write(f"matrix only: {matrix_time:.3f}s ({pairs / matrix_time:,.0f} pairs/s)")
+        self.stdout.write(f"with dicts:  {vectorized_time:.3f}s ({pairs / vectorized_time:,.0f} pairs/s)")
+        self.stdout.write(
+            f"blocked:     {blocked_time:.3f}s for {blocked} compatible pairs "
+            f"({pairs / max(blocked, 1):.1f}x fewer candidates)"
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"speedup:     {baseline_time / matrix_time:.1f}x scoring, "
+            f"{baseline_time / vectorized_time:.1f}x end to end"
+        ))
@@ -0,0 +1,109 @@
+import datetime
+import json
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.fastpath import RowMapper
+from core.models import Alert, Appointment, Doctor, Hospital, OrganMatching, OrganType, User
+from core.serializers import AlertSerializer, AppointmentSerializer, DoctorSerializer, OrganMatchingSerializer
+
+
+# (serializer, queryset الـ list بتاع الـ endpoint, aliases) لكل endpoint عليه FastListMixin
+ENDPOINTS = {
+    'alerts': (AlertSerializer, lambda: Alert.objects.order_by('-created_at'), {}),
+    'organ-matching': (
+        OrganMatchingSerializer,
+        lambda: OrganMatching.objects.with_user_mini().with_hla_mismatch_count(),
+        {'hla_mismatch_count': 'db_hla_mismatch_count'},
+    ),
+    'appointments': (AppointmentSerializer, lambda: Appointment.objects.all(), {}),
+    'doctors': (DoctorSerializer, lambda: Doctor.objects.all(), {}),
+}
+
+
+def synthetic_data(rows, rng):
+    """Bulk-create about `rows` rows for every benchmarked endpoint."""
+    hospitals = Hospital.objects.bulk_create([
+        Hospital(name=f"مستشفى {n}", location="القاهرة", phone="0100", working_hours="24h",
+                 email=f"bench{n}@hospital.com")
+        for n in range(10)
+    ])
+    doctors = Doctor.objects.bulk_create([
+        Doctor(name=f"د. {n}", specialty="كلى", phone="0101", hospital=rng.choice(hospitals)) for n in range(rows)
+    ])
+    users = User.objects.bulk_create([
+        User(
+            national_id=f"3{n:013d}", first_name="محمد", last_name=f"حسن {n}", role=role,
+            birthdate=datetime.date(1980, 1, 1), blood_type="O+", gender="ذكر", medical_record_number=f"B-{n}",
+            hospital=rng.choice(hospitals), password="!",
+        )
+        for n, role in enumerate(['patient', 'donor'] * max(rows // 2, 1))
+    ])
+    patients, donors = users[0::2], users[1::2]
+    Alert.objects.bulk_create([
+        Alert(user=rng.choice(users), message_title="تنبيه", message="تم تحديث حالة المطابقة", alert_type="معلومة")
+        for _ in range(rows)
+    ])
+    Appointment.objects.bulk_create([
+        Appointment(
+            patient=rng.choice(patients), doctor=rng.choice(doctors + [None]), hospital=rng.choice(hospitals),
+            appointment_date=datetime.date(2030, 1, 1), appointment_time=datetime.time(10, 30), reason="متابعة",
+        )
+        for _ in range(rows)
+    ])
+    OrganMatching.objects.bulk_create([
+        OrganMatching(patient=patient, donor=donor, organ_type=OrganType.KIDNEY,
+                      match_percentage=rng.randint(40, 100), ai_result={"rules": {"hla": -10}})
+        for patient, donor in zip(patients, donors)
+    ])
+
+
+def best_time(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+
+class Command(BaseCommand):
+    help = "Benchmark the values_list() row mappers against the DRF serializers of the fast list endpoints"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=0,
+                            help="Create this many synthetic rows per endpoint (rolled back afterwards)")
+        parser.add_argument('--limit', type=int, default=5000, help="Rows read per endpoint")
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--endpoints', nargs='+', default=list(ENDPOINTS), choices=list(ENDPOINTS))
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            if options['rows']:
+                synthetic_data(options['rows'], random.Random(options['seed']))
+            for name in options['endpoints']:
+                self.bench(name, options['limit'], options['repeat'])
+            transaction.set_rollback(True)
+
+    def bench(self, name, limit, repeat):
+        serializer_class, queryset, aliases = ENDPOINTS[name]
+        # نفس الـ select_related اللي الـ viewset بيعمله للـ full shape، عشان المقارنة تبقى على الـ CPU
+        # ترتيب بالـ pk عشان الطريقتين يقروا نفس الصفوف بنفس الترتيب
+        base = queryset().order_by('pk')
+        instances = base.select_related(*serializer_class.related_paths())[:limit]
+        mapper = RowMapper(serializer_class(), aliases)
+        rows = mapper.values(base)[:limit]
+
+        slow_time, slow = best_time(lambda: serializer_class(instances.all(), many=True).data, repeat)
+        fast_time, fast = best_time(lambda: [mapper.map(row) for row in rows.all()], repeat)
+        count = len(fast)
+        identical = json.dumps(slow, ensure_ascii=False) == json.dumps(fast, ensure_ascii=False)
+        self.stdout.write(
+            f"{name:<15} rows={count:<7} serializer {count / slow_time if slow_time else 0:>10,.0f} rows/s  "
+            f"values {count / fast_time if fast_time else 0:>10,.0f} rows/s  "
+            f"x{slow_time / fast_time if fast_time else 0:.1f}  {'identical' if identical else 'DIFFERENT'}"
+        )
@@ -0,0 +1,64 @@
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from core.management.commands.bench_matching import synthetic_rows
+from core.matching import Cohort, HLAEncoder, iter_results
+
+
+class Command(BaseCommand):
+    help = "Benchmark sharded matching across a process pool for 1..N workers"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--patients', type=int, default=20000)
+        parser.add_argument('--donors', type=int, default=5000)
+        parser.add_argument('--k', type=int, default=10)
+        parser.add_argument('--max-workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        encoder = HLAEncoder()
+        # block واحد كبير عشان نقيس الـ scorer بس من غير الـ blocking
+        patients = Cohort.from_rows(synthetic_rows(options['patients'], 'patient', 1, rng), encoder)
+        donors = Cohort.from_rows(
+            synthetic_rows(options['donors'], 'donor', options['patients'] + 1, rng), encoder
+        )
+        pairs = len(patients) * len(donors)
+        self.stdout.write(f"{pairs:,} pairs, k={options['k']}, cpus={os.cpu_count()}")
+
+        baseline = None
+        reference = None
+        workers = 1
+        while workers <= options['max_workers']:
+            executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+            try:
+                if executor:
+                    # تسخين الـ pool عشان وقت إنشاء الـ processes ميتحسبش
+                    list(executor.map(abs, range(workers)))
+                started = time.perf_counter()
+                rows = [
+                    (i, j, result['match_percentage'])
+                    for i, j, result in iter_results(
+                        patients, donors, k=options['k'], executor=executor, shards=workers
+                    )
+                ]
+                elapsed = time.perf_counter() - started
+            finally:
+                if executor:
+                    executor.shutdown()
+
+            if reference is None:
+                reference = rows
+            elif rows != reference:
+                self.stderr.write(self.style.ERROR(f"{workers} workers: results differ from 1 worker"))
+            baseline = baseline or elapsed
+            speedup = baseline / elapsed
+            self.stdout.write(
+                f"workers={workers:<3} {elapsed:.3f}s  {pairs / elapsed:,.0f} pairs/s  "
+                f"speedup {speedup:.2f}x  efficiency {100 * speedup / workers:.0f}%"
+            )
+            workers *= 2
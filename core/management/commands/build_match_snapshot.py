@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.matching import build_snapshot, matching_setting
+
+
+class Command(BaseCommand):
+    help = "Build or incrementally refresh the memory-mapped cohort snapshot used by matching runs"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', help="Snapshot file (default: ORGAN_MATCHING['SNAPSHOT_PATH'])")
+        parser.add_argument('--full', action='store_true', help="Rebuild from scratch instead of patching")
+
+    def handle(self, *args, **options):
+        path = options['path'] or matching_setting('SNAPSHOT_PATH')
+        if not path:
+            raise CommandError("No snapshot path: pass --path or set MATCH_SNAPSHOT_PATH")
+
+        started = time.perf_counter()
+        snapshot, changed = build_snapshot(path, full=options['full'])
+        elapsed = time.perf_counter() - started
+        mode = "full build" if changed is None else f"incremental, {changed} changed rows"
+        self.stdout.write(self.style.SUCCESS(
+            f"{snapshot.count} users written to {path} ({mode}) in {elapsed:.3f}s"
+        ))
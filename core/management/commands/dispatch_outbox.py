@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from core.outbox import OUTBOX_BATCH_SIZE, dispatch_batch
+
+
+class Command(BaseCommand):
+    help = "Drain the outbox table: expand pending events into Alert/AlertHospital rows in batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=OUTBOX_BATCH_SIZE)
+        parser.add_argument('--once', action='store_true', help="Exit when the outbox is empty")
+        parser.add_argument('--sleep', type=float, default=1.0, help="Seconds to wait when the outbox is empty")
+
+    def handle(self, *args, **options):
+        self.stdout.write("Outbox dispatcher started")
+        while True:
+            close_old_connections()
+            done, failed = dispatch_batch(options['batch_size'])
+            if done or failed:
+                style = self.style.ERROR if failed else self.style.SUCCESS
+                self.stdout.write(style(f"dispatched {done} events, {failed} failed"))
+            if not done:
+                if options['once']:
+                    break
+                time.sleep(options['sleep'])
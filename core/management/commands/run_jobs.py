@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from core.jobs import claim_next_job, run_job, worker_name
+
+
+class Command(BaseCommand):
+    help = "Run queued background jobs (auto_match, calculate_priority, ...) from the Job table"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Exit when the queue is empty")
+        parser.add_argument('--sleep', type=float, default=2.0, help="Seconds to wait when the queue is empty")
+        parser.add_argument('--max-jobs', type=int, default=0, help="Exit after this many jobs (0 = no limit)")
+
+    def handle(self, *args, **options):
+        name = worker_name()
+        self.stdout.write(f"Worker {name} started")
+        done = 0
+        while True:
+            close_old_connections()
+            job = claim_next_job(name)
+            if job is None:
+                if options['once']:
+                    break
+                time.sleep(options['sleep'])
+                continue
+
+            self.stdout.write(f"Running {job}")
+            run_job(job)
+            style = self.style.SUCCESS if job.status == 'done' else self.style.ERROR
+            self.stdout.write(style(f"{job} finished in {job.duration}s"))
+
+            done += 1
+            if options['max_jobs'] and done >= options['max_jobs']:
+                break
@@ -0,0 +1,127 @@
+# Pure NumPy scoring kernels used by core.matching. Nothing here, nor in
+# hla.py, scoring.py or snapshot.py, touches Django, so process-pool workers
+# (and migrations, for hla.py) can use them on plain arrays without the ORM.
+import numpy as np
+
+from .snapshot import NO_BIRTHDATE, open_snapshot
+
+
+# الـ penalties الافتراضية لـ rules الـ hla والـ bmi (core.scoring)
+MISMATCH_PENALTY = 10
+INELIGIBLE_PENALTY = 20
+
+# نفس حدود User.is_donor_medically_eligible
+BMI_MIN = 18.5
+BMI_MAX = 35
+
+# عدد المرضى اللي بيتحسبوا مع كل المتبرعين في المرة الواحدة
+SCORE_CHUNK_SIZE = 1024
+
+
+def mismatch_matrix(patient_hla, donor_hla):
+    mismatches = np.zeros((len(patient_hla), len(donor_hla)), dtype=np.uint8)
+    for column in range(patient_hla.shape[1]):
+        p = patient_hla[:, column][:, None]
+        d = donor_hla[:, column][None, :]
+        mismatches += (p != 0) & (d != 0) & (p != d)
+    return mismatches
+
+
+def donor_eligibility(bmi):
+    # BMI مش متسجل (NaN) ← مؤهل
+    return np.isnan(bmi) | ((bmi >= BMI_MIN) & (bmi <= BMI_MAX))
+
+
+def select_top_k(mismatches, scores, contributions, donor_ids, k):
+    """
+    Best K donors of every row, best first, as (indices, mismatches, scores,
+    contributions) arrays of shape (rows, K[, rules]). Ties go to the lower
+    donor id.
+    """
+    count = len(donor_ids)
+    # مفتاح واحد بيجمع الـ score والـ tie-break: score أعلى ثم id أصغر
+    id_rank = np.argsort(np.argsort(donor_ids))
+    keys = scores.astype(np.int64) * count + (count - 1 - id_rank)[None, :]
+    top = np.argpartition(-keys, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(keys, top, axis=1), axis=1)
+    top = np.take_along_axis(top, order, axis=1)
+    return (
+        top,
+        np.take_along_axis(mismatches, top, axis=1),
+        np.take_along_axis(scores, top, axis=1),
+        np.take_along_axis(contributions, top[:, :, None], axis=1),
+    )
+
+
+def take_rows(columns, start, stop):
+    return {name: values[start:stop] for name, values in columns.items()}
+
+
+def score_shard(patient_columns, donor_columns, donor_ids, rules, k=None, chunk_size=SCORE_CHUNK_SIZE):
+    """
+    Score one shard of patients against a donor snapshot with a compiled
+    rule set (core.scoring.RuleSet).
+
+    Returns (top, mismatches, scores, contributions). Without `k`, top is
+    None and the matrices cover every donor; with `k` all arrays are
+    (rows, K[, rules]). This is the process-pool entry point, so every
+    argument is a plain picklable array, dict of arrays or rule set.
+    """
+    if k:
+        k = min(k, len(donor_ids))
+    parts = []
+    rows = len(patient_columns['hla'])
+    for start in range(0, rows, chunk_size):
+        mismatches, scores, contributions = rules.evaluate(
+            take_rows(patient_columns, start, start + chunk_size), donor_columns
+        )
+        if k:
+            parts.append(select_top_k(mismatches, scores, contributions, donor_ids, k))
+        else:
+            parts.append((None, mismatches, scores, contributions))
+    if not parts:
+        width = k or len(donor_ids)
+        empty = np.zeros((0, width), dtype=np.int64)
+        return (
+            (empty if k else None), empty.astype(np.uint8), empty.astype(np.int16),
+            np.zeros((0, width, len(rules)), dtype=np.int8),
+        )
+    top = np.concatenate([p[0] for p in parts]) if k else None
+    return (top, *(np.concatenate([p[i] for p in parts]) for i in (1, 2, 3)))
+
+
+def ages_at(birth_days, as_of_day):
+    # تاريخ الميلاد في الـ snapshot أيام من 1970؛ NO_BIRTHDATE ← NaN
+    ages = (as_of_day - birth_days.astype(np.float64)) / 365.25
+    return np.where(birth_days == NO_BIRTHDATE, np.nan, ages)
+
+
+def snapshot_columns(records, columns, as_of_day):
+    """The rule-set `columns` of snapshot records, shaped like Cohort.columns."""
+    values = {'hla': np.ascontiguousarray(records['hla'])}
+    for name in columns:
+        if name == 'eligible':
+            values[name] = donor_eligibility(records['bmi'].astype(np.float64)) | (records['role'] == 0)
+        elif name == 'age':
+            values[name] = ages_at(records['birth'], as_of_day)
+        elif name == 'pra':
+            values[name] = records['pra'].astype(np.float64)
+        elif name != 'hla':
+            values[name] = np.asarray(records[name])
+    return values
+
+
+def score_snapshot_shard(path, patient_rows, donor_rows, rules, as_of_day, k=None, chunk_size=SCORE_CHUNK_SIZE):
+    """
+    Same as score_shard, but reads the rule-set columns of the given rows
+    from the memory-mapped cohort snapshot at `path` instead of receiving
+    them pickled from the parent process. Indexing by row copies just
+    those records; the file pages themselves are shared.
+    """
+    records = open_snapshot(path).records
+    donors = records[donor_rows]
+    return score_shard(
+        snapshot_columns(records[patient_rows], rules.columns, as_of_day),
+        snapshot_columns(donors, rules.columns, as_of_day),
+        donors['id'], rules, k, chunk_size,
+    )
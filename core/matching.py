@@ -0,0 +1,916 @@
+import datetime
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from itertools import repeat
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Count, Max, Q
+from django.utils import timezone
+
+from .match_kernels import (
+    BMI_MAX, BMI_MIN, SCORE_CHUNK_SIZE,
+    ages_at, donor_eligibility, score_shard, score_snapshot_shard,
+)
+from .hla import HLA_FIELDS, normalize_allele, pack_codes, unpack_codes, unpack_many
+from .models import HLAAllele, OrganMatching, OrganType, User
+from .notifications import MatchNotifier
+from .scoring import DEFAULT_RULES, compile_rules
+from .snapshot import (
+    NO_BIRTHDATE, ROLES, SNAPSHOT_DTYPE, UNKNOWN, merge_records, open_snapshot, pin_snapshot, write_snapshot,
+)
+
+DEFAULT_MATCH_STATUS = 'في الانتظار'
+APPROVED_STATUS = 'approved'
+# عدد الـ ids في كل IN (...) لما بنمسح الـ matches اللي خرجت من الـ top-K
+PRUNE_CHUNK_SIZE = 900
+
+DEFAULT_SETTINGS = {
+    'BATCH_SIZE': 500,
+    'BLOCKING_CACHE_TIMEOUT': 60 * 60,
+    'INCREMENTAL_REMATCH': True,
+    # عدد الـ processes اللي بتتقسم عليها المرضى (1 = نفس الـ process)
+    'WORKERS': 1,
+    # الـ blocks الأصغر من كده مش بتستاهل تتبعت للـ process pool
+    'PARALLEL_MIN_PAIRS': 200_000,
+    # ملف الـ cohort snapshot (None = القراءة من الداتابيز مباشرة)
+    'SNAPSHOT_PATH': None,
+    # allocation: weight = match_percentage × (1 + ALLOCATION_PRIORITY_WEIGHT × priority score)
+    'ALLOCATION_PRIORITY_WEIGHT': 0.01,
+    # فوق العدد ده من الـ edges في العضو الواحد بنستخدم الـ greedy بدل الـ solver الكامل
+    'ALLOCATION_GREEDY_MIN_EDGES': 5_000_000,
+    # paired exchange: أقل match_percentage يعتبر edge في الـ compatibility graph
+    'EXCHANGE_MIN_SCORE': 0,
+    # فوق العدد ده من الـ cycles/chains بنختار بالـ greedy بدل الـ MILP
+    'EXCHANGE_MILP_MAX_STRUCTURES': 200_000,
+    'EXCHANGE_TIME_LIMIT': 30,
+    # الـ scoring rules لكل عضو (core/scoring.py)؛ 'default' لأي عضو مش متحدد.
+    # كل rule يا اسم يا (اسم, {params}) زي ('pra', {'threshold': 90})
+    'SCORING_RULES': {'default': DEFAULT_RULES},
+}
+
+# فصيلة المتبرع ← فصائل المرضى اللي ممكن تستقبل منه
+ABO_RECIPIENTS = {
+    'O': ('O', 'A', 'B', 'AB'),
+    'A': ('A', 'AB'),
+    'B': ('B', 'AB'),
+    'AB': ('AB',),
+}
+BLOOD_TYPES = tuple(value for value, _ in User.BLOOD_TYPE_CHOICES)
+ORGAN_TYPES = tuple(OrganType.values)
+SNAPSHOT_STATUSES = (APPROVED_STATUS, 'pending', *(value for value, _ in User.STATUS_CHOICES))
+
+ORGAN_FIELDS = {
+    'patient': 'patient_profile__organ_needed',
+    'donor': 'donor_profile__organ_available',
+}
+COUNTERPART_ROLE = {'patient': 'donor', 'donor': 'patient'}
+
+
+def matching_setting(name):
+    return getattr(settings, 'ORGAN_MATCHING', {}).get(name, DEFAULT_SETTINGS[name])
+
+
+def worker_count(requested=None):
+    """`requested` processes (the WORKERS setting when omitted), between 1 and the CPU count."""
+    # الـ workers جايين من الـ query string / الـ job params ← مينفعش يفتحوا processes أكتر من الـ CPUs
+    return max(1, min(requested or matching_setting('WORKERS'), os.cpu_count() or 1))
+
+
+def rule_set_for(organ=None):
+    """Compile the scoring rule set configured for `organ` (or the default one)."""
+    rules = matching_setting('SCORING_RULES')
+    return compile_rules(rules.get(organ, rules.get('default', DEFAULT_RULES)))
+
+
+class RuleSets(dict):
+    # كل rule set بيتعمله compile مرة واحدة في الـ run
+    def __missing__(self, organ):
+        self[organ] = rule_set_for(organ)
+        return self[organ]
+
+
+# ==========================
+# HLA encoding
+# ==========================
+class HLAEncoder:
+    """
+    Turns the HLA part of cohort rows into an (n, 6) uint16 code array.
+    Packed typings (User.hla_packed) are decoded as they are; raw typing
+    strings are looked up in the HLAAllele dictionary, loaded lazily from
+    `dictionary`, and unknown alleles get provisional codes for this run
+    only. Code 0 means "not typed", so it never counts as a mismatch.
+    """
+
+    def __init__(self, dictionary=None):
+        self.dictionary = dictionary
+        self.codes = None
+
+    def encode(self, value):
+        name = normalize_allele(value)
+        if name is None:
+            return 0
+        if self.codes is None:
+            self.codes = dict(self.dictionary() if self.dictionary else {})
+            self.next_code = max(self.codes.values(), default=0) + 1
+        code = self.codes.get(name)
+        if code is None:
+            code = self.codes[name] = self.next_code
+            self.next_code += 1
+        return code
+
+    def encode_rows(self, rows):
+        codes = np.zeros((len(rows), len(HLA_FIELDS)), dtype=np.uint16)
+        for index, row in enumerate(rows):
+            if isinstance(row, (bytes, bytearray, memoryview)):
+                codes[index] = unpack_codes(row)
+            else:
+                codes[index] = [self.encode(value) for value in row]
+        return codes
+
+
+# ==========================
+# Cohort
+# ==========================
+class Cohort:
+    """
+    Column-oriented snapshot of the patients or donors taking part in a run.
+    PRA, CMV/EBV and age are only read by the scoring rules that ask for
+    them; missing values are NaN (PRA, age) or False (CMV, EBV).
+    """
+
+    def __init__(self, ids, labels, organs, blood_types, hla, bmi, eligible,
+                 pra=None, cmv=None, ebv=None, age=None, rows=None, snapshot=None):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.labels = list(labels)
+        self.organs = list(organs)
+        self.blood_types = list(blood_types)
+        self.hla = hla
+        self.bmi = np.asarray(bmi, dtype=np.float64)
+        self.eligible = np.asarray(eligible, dtype=bool)
+        count = len(self.ids)
+        self.blood_codes = np.array([code_of(BLOOD_TYPES, t) for t in self.blood_types], dtype=np.uint8)
+        self.pra = np.full(count, np.nan) if pra is None else np.asarray(pra, dtype=np.float64)
+        self.cmv = np.zeros(count, dtype=bool) if cmv is None else np.asarray(cmv, dtype=bool)
+        self.ebv = np.zeros(count, dtype=bool) if ebv is None else np.asarray(ebv, dtype=bool)
+        self.age = np.full(count, np.nan) if age is None else np.asarray(age, dtype=np.float64)
+        # مكان كل صف في ملف الـ snapshot لو الـ cohort متحمل منه: (path, watermark)
+        self.rows = rows
+        self.snapshot = snapshot
+
+    def __len__(self):
+        return len(self.ids)
+
+    @staticmethod
+    def is_eligible(role, bmi):
+        # نفس منطق User.is_donor_medically_eligible
+        if role != 'donor' or bmi is None:
+            return True
+        return BMI_MIN <= bmi <= BMI_MAX
+
+    @classmethod
+    def from_rows(cls, rows, encoder):
+        """
+        Build a cohort from tuples of
+        (id, first_name, last_name, role, bmi, organ, blood_type, PRA, CMV_status,
+         EBV_status, birthdate, *HLA_FIELDS) or the same with hla_packed last.
+        """
+        ids, labels, organs, blood_types, bmi, eligible, hla_rows = [], [], [], [], [], [], []
+        pra, cmv, ebv, birth_days = [], [], [], []
+        for row in rows:
+            user_id, first_name, last_name, role, user_bmi, organ, blood_type = row[:7]
+            user_pra, user_cmv, user_ebv, birthdate = row[7:COHORT_HLA_POSITION]
+            ids.append(user_id)
+            labels.append(f"{first_name} {last_name} ({role})")
+            organs.append(organ or 'N/A')
+            blood_types.append(blood_type)
+            bmi.append(np.nan if user_bmi is None else user_bmi)
+            eligible.append(cls.is_eligible(role, user_bmi))
+            pra.append(np.nan if user_pra is None else user_pra)
+            cmv.append(bool(user_cmv))
+            ebv.append(bool(user_ebv))
+            birth_days.append(to_days(birthdate))
+            hla = row[COHORT_HLA_POSITION:]
+            hla_rows.append(hla[0] if len(hla) == 1 else hla)
+        return cls(
+            ids, labels, organs, blood_types, encoder.encode_rows(hla_rows), bmi, eligible,
+            pra=pra, cmv=cmv, ebv=ebv, age=ages_at(np.array(birth_days, dtype=np.int32), today_days()),
+        )
+
+    @classmethod
+    def from_users(cls, users, encoder):
+        organ_attr = {'patient': ('patient_profile', 'organ_needed'),
+                      'donor': ('donor_profile', 'organ_available')}
+        rows = []
+        for user in users:
+            organ = None
+            profile_attr, field = organ_attr.get(user.role, (None, None))
+            if profile_attr:
+                organ = getattr(getattr(user, profile_attr, None), field, None)
+            rows.append((
+                user.id, user.first_name, user.last_name, user.role, user.bmi, organ, user.blood_type,
+                getattr(user, 'PRA', None), getattr(user, 'CMV_status', False),
+                getattr(user, 'EBV_status', False), getattr(user, 'birthdate', None),
+                *((user.hla_packed,) if user.hla_packed else
+                  (getattr(user, field, None) for field in HLA_FIELDS)),
+            ))
+        return cls.from_rows(rows, encoder)
+
+    @classmethod
+    def load(cls, role, encoder, status=APPROVED_STATUS, **filters):
+        organ_field = ORGAN_FIELDS[role]
+        rows = list(User.objects.filter(role=role, status=status, **filters).order_by('id').values_list(
+            'id', 'first_name', 'last_name', 'role', 'bmi', organ_field, 'blood_type',
+            'PRA', 'CMV_status', 'EBV_status', 'birthdate', 'hla_packed'
+        ))
+        return cls.from_rows(with_hla_typings(rows, COHORT_HLA_POSITION), encoder)
+
+    @classmethod
+    def from_snapshot(cls, snapshot, role, status=APPROVED_STATUS):
+        """
+        Select the approved patients or donors of a cohort snapshot file.
+        The selected records are copied out of the memmap; `rows` keeps
+        their positions so pool workers can re-read them from the file.
+        """
+        records = snapshot.records
+        rows = np.flatnonzero(
+            (records['role'] == ROLES.index(role)) & (records['status'] == code_of(SNAPSHOT_STATUSES, status))
+        )
+        selected = records[rows]
+        ids = selected['id']
+        # الأسماء مش في الـ snapshot، بنحتاجها بس للـ response
+        names = {
+            user_id: f"{first_name} {last_name} ({role})"
+            for user_id, first_name, last_name in
+            User.objects.filter(role=role, status=status).values_list('id', 'first_name', 'last_name')
+        }
+        bmi = selected['bmi'].astype(np.float64)
+        eligible = donor_eligibility(bmi) if role == 'donor' else np.ones(len(rows), dtype=bool)
+        return cls(
+            ids,
+            [names.get(user_id, f"#{user_id} ({role})") for user_id in ids.tolist()],
+            [decode(ORGAN_TYPES, code, 'N/A') for code in selected['organ'].tolist()],
+            [decode(BLOOD_TYPES, code) for code in selected['blood_type'].tolist()],
+            np.ascontiguousarray(selected['hla']),
+            bmi,
+            eligible,
+            pra=selected['pra'].astype(np.float64),
+            cmv=selected['cmv'],
+            ebv=selected['ebv'],
+            age=ages_at(selected['birth'], today_days()),
+            rows=rows,
+            snapshot=(snapshot.path, snapshot.watermark),
+        )
+
+    def subset(self, indices):
+        return Cohort(
+            self.ids[indices],
+            [self.labels[i] for i in indices],
+            [self.organs[i] for i in indices],
+            [self.blood_types[i] for i in indices],
+            self.hla[indices],
+            self.bmi[indices],
+            self.eligible[indices],
+            pra=self.pra[indices],
+            cmv=self.cmv[indices],
+            ebv=self.ebv[indices],
+            age=self.age[indices],
+            rows=None if self.rows is None else self.rows[indices],
+            snapshot=self.snapshot,
+        )
+
+    def columns(self, names):
+        """The arrays a rule set reads (see core.scoring.COLUMNS); HLA is always included."""
+        values = {
+            'hla': self.hla, 'eligible': self.eligible, 'blood_type': self.blood_codes,
+            'pra': self.pra, 'cmv': self.cmv, 'ebv': self.ebv, 'age': self.age,
+        }
+        return {name: values[name] for name in ('hla', *names)}
+
+    def bmi_value(self, index):
+        value = self.bmi[index]
+        return None if np.isnan(value) else float(value)
+
+
+# مكان الـ hla_packed (أو أول HLA field) في صفوف Cohort.from_rows
+COHORT_HLA_POSITION = 11
+
+
+def with_hla_typings(rows, position):
+    """
+    Replace a missing hla_packed at `position` with the six typing strings.
+    Users updated through queryset.update() may not have been packed yet.
+    """
+    missing = [row[0] for row in rows if row[position] is None]
+    if not missing:
+        return rows
+    typings = {
+        row[0]: row[1:]
+        for row in User.objects.filter(pk__in=missing).values_list('id', *HLA_FIELDS)
+    }
+    return [
+        row if row[position] is not None else row[:position] + typings[row[0]] + row[position + 1:]
+        for row in rows
+    ]
+
+
+def load_cohorts(read_only=False):
+    """
+    Patients and donors of a run. With `read_only` the snapshot is used only
+    while it is current: rebuilding it can register new HLA alleles.
+    """
+    path = matching_setting('SNAPSHOT_PATH')
+    if path:
+        if read_only:
+            snapshot = open_snapshot(path)
+            snapshot = snapshot if snapshot is not None and not snapshot_is_stale(snapshot) else None
+        else:
+            snapshot = refresh_snapshot(path)[0]
+        if snapshot is not None:
+            return Cohort.from_snapshot(snapshot, 'patient'), Cohort.from_snapshot(snapshot, 'donor')
+    encoder = HLAEncoder(HLAAllele.code_map)
+    return Cohort.load('patient', encoder), Cohort.load('donor', encoder)
+
+
+# ==========================
+# Cohort snapshot file
+# ==========================
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def code_of(values, value):
+    return values.index(value) if value in values else UNKNOWN
+
+
+def decode(values, code, default=None):
+    return values[code] if code < len(values) else default
+
+
+def to_days(value):
+    if value is None:
+        return NO_BIRTHDATE
+    return (value - EPOCH.date()).days
+
+
+def today_days():
+    return to_days(timezone.localdate())
+
+
+def to_micros(value):
+    if value is None:
+        return 0
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value)
+    return (value - EPOCH) // datetime.timedelta(microseconds=1)
+
+
+def from_micros(micros):
+    value = EPOCH + datetime.timedelta(microseconds=micros)
+    return value if settings.USE_TZ else timezone.make_naive(value)
+
+
+def cohort_state():
+    return User.objects.aggregate(last_update=Max('updated_at'), users=Count('id'))
+
+
+def snapshot_records(queryset):
+    """Encode the patients and donors of `queryset` as SNAPSHOT_DTYPE records sorted by id."""
+    rows = []
+    for role in ROLES:
+        rows += with_hla_typings(list(queryset.filter(role=role).values_list(
+            'id', 'role', 'status', 'blood_type', ORGAN_FIELDS[role],
+            'bmi', 'PRA', 'CMV_status', 'EBV_status', 'birthdate', 'hla_packed',
+        )), 10)
+    records = np.zeros(len(rows), dtype=SNAPSHOT_DTYPE)
+    if not rows:
+        return records
+    records['id'] = [row[0] for row in rows]
+    records['role'] = [ROLES.index(row[1]) for row in rows]
+    records['status'] = [code_of(SNAPSHOT_STATUSES, row[2]) for row in rows]
+    records['blood_type'] = [code_of(BLOOD_TYPES, row[3]) for row in rows]
+    records['organ'] = [code_of(ORGAN_TYPES, row[4]) for row in rows]
+    records['bmi'] = [np.nan if row[5] is None else row[5] for row in rows]
+    records['pra'] = [np.nan if row[6] is None else row[6] for row in rows]
+    records['cmv'] = [bool(row[7]) for row in rows]
+    records['ebv'] = [bool(row[8]) for row in rows]
+    records['birth'] = [to_days(row[9]) for row in rows]
+    # الـ snapshot بيعيش أكتر من run ← الـ alleles الجديدة لازم تتسجل في القاموس
+    records['hla'] = unpack_many([
+        row[10] if len(row) == 11 else pack_codes([HLAAllele.code_for(value) for value in row[10:]])
+        for row in rows
+    ])
+    return records[np.argsort(records['id'], kind='stable')]
+
+
+def build_snapshot(path=None, full=False):
+    """
+    Write the cohort snapshot to `path`. Unless `full`, an existing snapshot
+    is patched with the users whose updated_at reached its watermark and
+    stripped of deleted users. Returns (snapshot, changed_rows), with
+    changed_rows None for a full build.
+    """
+    path = path or matching_setting('SNAPSHOT_PATH')
+    # الحالة قبل القراءة: أي تعديل بعدها هيتقرا تاني في الـ rebuild الجاي
+    state = cohort_state()
+    current = None if full else open_snapshot(path)
+    users = User.objects.filter(role__in=ROLES)
+    if current is None:
+        records, changed = snapshot_records(users), None
+    else:
+        # >= عشان الـ rows اللي اتعدلت في نفس الـ microsecond بتاع الـ watermark
+        delta = snapshot_records(users.filter(updated_at__gte=from_micros(current.watermark)))
+        live_ids = np.fromiter(users.values_list('id', flat=True), dtype=np.int64)
+        records, changed = merge_records(current.records, delta, live_ids), len(delta)
+    write_snapshot(path, records, to_micros(state['last_update']), state['users'])
+    return open_snapshot(path), changed
+
+
+def snapshot_is_stale(snapshot, state=None):
+    state = state or cohort_state()
+    return (
+        snapshot.watermark != to_micros(state['last_update'])
+        or snapshot.source_count != state['users']
+    )
+
+
+def refresh_snapshot(path=None):
+    """Open the snapshot, rebuilding it incrementally first if the users moved past it."""
+    path = path or matching_setting('SNAPSHOT_PATH')
+    snapshot = open_snapshot(path)
+    if snapshot is not None and not snapshot_is_stale(snapshot):
+        return snapshot, 0
+    return build_snapshot(path)
+
+
+# ==========================
+# Compatibility blocking
+# ==========================
+def blood_compatible(donor_type, patient_type):
+    if donor_type not in BLOOD_TYPES or patient_type not in BLOOD_TYPES:
+        return False
+    donor_abo, donor_rh = donor_type[:-1], donor_type[-1]
+    patient_abo, patient_rh = patient_type[:-1], patient_type[-1]
+    # متبرع Rh- يناسب الكل، ومتبرع Rh+ يناسب Rh+ بس
+    return patient_abo in ABO_RECIPIENTS[donor_abo] and (donor_rh == '-' or patient_rh == '+')
+
+
+def compatible_blood_types(blood_type, role):
+    """Blood types of the counterparts that a patient/donor can be matched with."""
+    if role == 'donor':
+        return [t for t in BLOOD_TYPES if blood_compatible(blood_type, t)]
+    return [t for t in BLOOD_TYPES if blood_compatible(t, blood_type)]
+
+
+def group_indices(cohort):
+    groups = {}
+    for index, key in enumerate(zip(cohort.organs, cohort.blood_types)):
+        groups.setdefault(key, []).append(index)
+    return {key: np.asarray(indices, dtype=np.int64) for key, indices in groups.items()}
+
+
+class BlockingIndex:
+    """
+    Partitions both cohorts by organ and blood type so that only
+    organ-matching, ABO/Rh-compatible pairs reach the scorer. Each block is
+    (organ, patient_blood_type, patient_indices, donor_indices).
+    """
+
+    def __init__(self, patients, donors):
+        patient_groups = group_indices(patients)
+        donor_groups = group_indices(donors)
+        self.blocks = []
+        for (organ, patient_type), patient_indices in sorted(patient_groups.items()):
+            if organ == 'N/A':
+                continue
+            donor_indices = [
+                indices for (donor_organ, donor_type), indices in sorted(donor_groups.items())
+                if donor_organ == organ and blood_compatible(donor_type, patient_type)
+            ]
+            if donor_indices:
+                self.blocks.append(
+                    (organ, patient_type, patient_indices, np.concatenate(donor_indices))
+                )
+
+    def __iter__(self):
+        return iter(self.blocks)
+
+    @property
+    def pair_count(self):
+        return sum(len(p) * len(d) for _, _, p, d in self.blocks)
+
+
+def cohort_fingerprint():
+    # أي تعديل على user (فصيلة، حالة، profile...) بيحرك updated_at
+    state = cohort_state()
+    last_update = state['last_update'].isoformat() if state['last_update'] else ''
+    return f"{last_update}:{state['users']}"
+
+
+def load_blocked_cohorts(read_only=False):
+    """
+    Return (patients, donors, blocking_index), reusing the partitions from the
+    previous run while no user or profile has changed since.
+    """
+    key = f"matching:blocks:{cohort_fingerprint()}"
+    cached = cache.get(key)
+    if cached is None:
+        patients, donors = load_cohorts(read_only)
+        cached = (patients, donors, BlockingIndex(patients, donors))
+        cache.set(key, cached, matching_setting('BLOCKING_CACHE_TIMEOUT'))
+    return cached
+
+
+def iter_blocked_pair_results(patients, donors, index):
+    """Same as iter_pair_results, restricted to the compatible blocks."""
+    rule_sets = RuleSets()
+    for organ, _, patient_indices, donor_indices in index:
+        block_patients = patients.subset(patient_indices)
+        block_donors = donors.subset(donor_indices)
+        for i, j, result in iter_results(block_patients, block_donors, rules=rule_sets[organ]):
+            yield int(patient_indices[i]), int(donor_indices[j]), result
+
+
+# ==========================
+# Vectorized scoring
+# ==========================
+def iter_score_blocks(patients, donors, rules=None, chunk_size=SCORE_CHUNK_SIZE):
+    """Yield (first_patient_index, mismatches, scores, contributions) for blocks of patients."""
+    rules = compile_rules(rules or rule_set_for())
+    patient_columns = patients.columns(rules.columns)
+    donor_columns = donors.columns(rules.columns)
+    for start in range(0, len(patients), chunk_size):
+        chunk = {name: values[start:start + chunk_size] for name, values in patient_columns.items()}
+        yield (start, *rules.evaluate(chunk, donor_columns))
+
+
+def pair_result(count, score, bmi, eligible, rules=None):
+    return {
+        "hla_mismatch_count": count,
+        "match_percentage": score,
+        "ai_result": {
+            "hla_mismatches": count,
+            "bmi": bmi,
+            "eligible": eligible,
+            # نقط كل rule غيرت الـ score (بالسالب)
+            "rules": rules or {},
+        },
+    }
+
+
+def donor_ai_values(donors):
+    return [(donors.bmi_value(j), bool(donors.eligible[j])) for j in range(len(donors))]
+
+
+def iter_results(patients, donors, k=None, executor=None, shards=1, chunk_size=SCORE_CHUNK_SIZE,
+                 snapshot_path=None, rules=None):
+    """
+    Yield (patient_index, donor_index, result) where result has the same
+    shape as OrganMatching.calculate_match, scored with the compiled
+    `rules` (the default rule set when omitted).
+
+    With `k` only the K best donors of each patient are produced, best
+    first, and each score block is reduced to that selection right away so
+    memory stays proportional to P*K. With an `executor`, the patients are
+    split into `shards` that are scored in worker processes against a
+    picklable donor snapshot; results come back in shard order, so the
+    output is identical to the single-process run. When both cohorts come
+    from the cohort snapshot and `snapshot_path` is given, workers receive
+    only row numbers and read the HLA codes from the memory-mapped file.
+    """
+    if not len(patients) or not len(donors) or (k is not None and k <= 0):
+        return
+    rules = compile_rules(rules or rule_set_for())
+    donor_ai = donor_ai_values(donors)
+    patient_columns = patients.columns(rules.columns)
+    donor_columns = donors.columns(rules.columns)
+    bounds = [b for b in np.array_split(np.arange(len(patients)), max(shards, 1)) if len(b)]
+
+    def shard_columns(indices):
+        return {name: values[indices] for name, values in patient_columns.items()}
+
+    if executor is None:
+        outputs = (
+            score_shard(shard_columns(b), donor_columns, donors.ids, rules, k, chunk_size) for b in bounds
+        )
+    elif snapshot_path and patients.rows is not None and donors.rows is not None:
+        outputs = executor.map(
+            score_snapshot_shard,
+            repeat(snapshot_path, len(bounds)),
+            [patients.rows[b] for b in bounds],
+            repeat(donors.rows, len(bounds)),
+            repeat(rules, len(bounds)),
+            repeat(today_days(), len(bounds)),
+            repeat(k, len(bounds)),
+            repeat(chunk_size, len(bounds)),
+        )
+    else:
+        outputs = executor.map(
+            score_shard,
+            [shard_columns(b) for b in bounds],
+            repeat(donor_columns, len(bounds)),
+            repeat(donors.ids, len(bounds)),
+            repeat(rules, len(bounds)),
+            repeat(k, len(bounds)),
+            repeat(chunk_size, len(bounds)),
+        )
+
+    for shard, (top, mismatches, scores, contributions) in zip(bounds, outputs):
+        first = int(shard[0])
+        mismatches, scores, contributions = mismatches.tolist(), scores.tolist(), contributions.tolist()
+        if top is None:
+            for offset, (mismatch_row, score_row, rule_row) in enumerate(zip(mismatches, scores, contributions)):
+                for j, (count, score, points) in enumerate(zip(mismatch_row, score_row, rule_row)):
+                    yield first + offset, j, pair_result(count, score, *donor_ai[j], rules.describe(points))
+        else:
+            for offset, row in enumerate(top.tolist()):
+                for j, count, score, points in zip(row, mismatches[offset], scores[offset], contributions[offset]):
+                    yield first + offset, j, pair_result(count, score, *donor_ai[j], rules.describe(points))
+
+
+def iter_pair_results(patients, donors, chunk_size=SCORE_CHUNK_SIZE, rules=None):
+    return iter_results(patients, donors, chunk_size=chunk_size, rules=rules)
+
+
+def score_pair(patient, donor, organ=None):
+    """
+    Score one patient/donor pair with the rule set of `organ` (the patient's
+    organ when omitted). The default rule set goes through the per-pair
+    OrganMatching.calculate_match; other rule sets through the engine.
+    """
+    if organ is not None and rule_set_for(organ) == compile_rules(DEFAULT_RULES):
+        return OrganMatching.calculate_match(patient, donor)
+    # القاموس بيلزم بس لو طرف packed والتاني typing strings
+    mixed = bool(getattr(patient, 'hla_packed', None)) != bool(getattr(donor, 'hla_packed', None))
+    encoder = HLAEncoder(HLAAllele.code_map if mixed else None)
+    patients = Cohort.from_users([patient], encoder)
+    donors = Cohort.from_users([donor], encoder)
+    if organ is None:
+        organ = patients.organs[0]
+    rules = rule_set_for(organ if organ != 'N/A' else None)
+    return next(iter_results(patients, donors, rules=rules))[2]
+
+
+# ==========================
+# Bulk persistence
+# ==========================
+class MatchWriter:
+    """
+    Buffers match results and upserts them with one bulk_create per batch,
+    keyed on the (patient, donor, organ_type) unique constraint. Each batch
+    is first compared with the stored rows: unchanged rows are skipped, and
+    only new rows or real score changes are reported through `on_batch`
+    (bulk_create does not send post_save). `status` is only set on insert,
+    so a rescore never resets a match that was already reviewed.
+    """
+
+    UPDATE_FIELDS = ['match_percentage', 'ai_result']
+
+    def __init__(self, batch_size=None, on_batch=None):
+        self.batch_size = batch_size or matching_setting('BATCH_SIZE')
+        self.on_batch = on_batch
+        self.pending = []
+        self.written = 0
+        self.skipped = 0
+        self.batches = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
+
+    def add(self, patient_id, donor_id, organ_type, result, status=DEFAULT_MATCH_STATUS):
+        self.pending.append(OrganMatching(
+            patient_id=patient_id,
+            donor_id=donor_id,
+            organ_type=organ_type,
+            match_percentage=result['match_percentage'],
+            ai_result=result['ai_result'],
+            status=status,
+        ))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    @staticmethod
+    def stored_values(batch):
+        # query واحدة للـ batch كله؛ الـ __in بيجيب زيادة شوية بس الـ dict بيفلتر
+        rows = OrganMatching.objects.filter(
+            patient_id__in={m.patient_id for m in batch},
+            donor_id__in={m.donor_id for m in batch},
+            organ_type__in={m.organ_type for m in batch},
+        ).values_list('patient_id', 'donor_id', 'organ_type', 'match_percentage', 'ai_result')
+        return {row[:3]: row[3:] for row in rows}
+
+    def flush(self):
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, []
+        options = {}
+        # MySQL بيستخدم ON DUPLICATE KEY ومش بيقبل unique_fields
+        if connection.features.supports_update_conflicts_with_target:
+            options['unique_fields'] = ['patient', 'donor', 'organ_type']
+        with transaction.atomic():
+            stored = self.stored_values(batch)
+            changed, notify = [], []
+            for match in batch:
+                values = (match.match_percentage, match.ai_result)
+                current = stored.get((match.patient_id, match.donor_id, match.organ_type))
+                if current == values:
+                    continue
+                changed.append(match)
+                # تغيير في الـ ai_result بس بيتكتب من غير alerts
+                if current is None or current[0] != values[0]:
+                    notify.append(match)
+            if changed:
+                OrganMatching.objects.bulk_create(
+                    changed, update_conflicts=True, update_fields=self.UPDATE_FIELDS, **options
+                )
+            if self.on_batch and notify:
+                self.on_batch(notify)
+        self.skipped += len(batch) - len(changed)
+        self.written += len(changed)
+        self.batches += bool(changed)
+
+
+# ==========================
+# Full matching run
+# ==========================
+class MatchRun:
+    """
+    One auto_match run: blocked cohorts, vectorized scoring and batched
+    upserts. Iterating yields one summary row per stored pair; `progress`
+    is called after each block with (scored_pairs, total_pairs, rows_written).
+    With `k`, only the K best donors of each patient are kept and stored,
+    and the patient's other untouched matches for that organ are deleted.
+    With more than one worker, large blocks are sharded by patient across
+    a process pool; when the cohorts come from the snapshot file, the
+    workers map that file instead of receiving pickled arrays. With
+    `notify`, the changed matches of the whole run are announced once per
+    user and hospital when the run ends.
+    """
+
+    def __init__(self, batch_size=None, notify=True, progress=None, k=None, workers=None):
+        self.batch_size = batch_size
+        self.k = k
+        self.workers = worker_count(workers)
+        self.notifier = MatchNotifier() if notify else None
+        self.progress = progress
+        self.scored = 0
+        self.pairs = 0
+        self.written = 0
+        self.skipped = 0
+        self.pruned = 0
+        self.batches = 0
+
+    def __iter__(self):
+        patients, donors, index = load_blocked_cohorts()
+        total = index.pair_count
+        executor = ProcessPoolExecutor(max_workers=self.workers) if self.workers > 1 else None
+        pinned = pin_snapshot(*patients.snapshot) if executor and patients.snapshot else nullcontext()
+        try:
+            with pinned as snapshot_path:
+                yield from self.run_blocks(patients, donors, index, total, executor, snapshot_path)
+        finally:
+            if executor:
+                executor.shutdown(cancel_futures=True)
+
+    def run_blocks(self, patients, donors, index, total, executor, snapshot_path=None):
+        min_pairs = matching_setting('PARALLEL_MIN_PAIRS')
+        rule_sets = RuleSets()
+        with MatchWriter(batch_size=self.batch_size, on_batch=self.notifier) as writer:
+            for organ, _, patient_indices, donor_indices in index:
+                block_patients = patients.subset(patient_indices)
+                block_donors = donors.subset(donor_indices)
+                parallel = executor is not None and len(patient_indices) * len(donor_indices) >= min_pairs
+                results = iter_results(
+                    block_patients, block_donors, k=self.k,
+                    executor=executor if parallel else None,
+                    shards=self.workers if parallel else 1,
+                    snapshot_path=snapshot_path,
+                    rules=rule_sets[organ],
+                )
+                kept = set()
+                for i, j, result in results:
+                    organ_type = block_patients.organs[i]
+                    pair = (int(block_patients.ids[i]), int(block_donors.ids[j]))
+                    writer.add(*pair, organ_type, result)
+                    if self.k:
+                        kept.add(pair)
+                    self.pairs += 1
+                    yield {
+                        "patient": block_patients.labels[i],
+                        "donor": block_donors.labels[j],
+                        "organ_type": organ_type,
+                        "match_percentage": result['match_percentage']
+                    }
+                if self.k:
+                    self.pruned += self.prune_block(organ, block_patients.ids.tolist(), kept)
+                self.scored += len(patient_indices) * len(donor_indices)
+                if self.progress:
+                    self.progress(self.scored, total, writer.written)
+        self.written, self.skipped, self.batches = writer.written, writer.skipped, writer.batches
+        if self.notifier:
+            self.notifier.flush()
+        if self.progress:
+            self.progress(self.scored, total, self.written)
+
+    def prune_block(self, organ, patient_ids, kept):
+        # top-K: الـ matches القديمة لنفس المرضى اللي خرجت من الـ K بتتمسح
+        # (اللي اتراجعت أو عليها عملية بتفضل زي rematch_user)
+        stale = []
+        for start in range(0, len(patient_ids), PRUNE_CHUNK_SIZE):
+            rows = OrganMatching.objects.filter(
+                patient_id__in=patient_ids[start:start + PRUNE_CHUNK_SIZE], organ_type=organ,
+                status=DEFAULT_MATCH_STATUS, surgery__isnull=True,
+            ).values_list('id', 'patient_id', 'donor_id')
+            stale += [pk for pk, patient_id, donor_id in rows.iterator() if (patient_id, donor_id) not in kept]
+        for start in range(0, len(stale), PRUNE_CHUNK_SIZE):
+            OrganMatching.objects.filter(pk__in=stale[start:start + PRUNE_CHUNK_SIZE]).delete()
+        return len(stale)
+
+    def summary(self):
+        return {
+            "scored_pairs": self.scored, "pairs": self.pairs, "rows_written": self.written,
+            "rows_skipped": self.skipped, "rows_pruned": self.pruned, "batches": self.batches,
+            "k": self.k, "workers": self.workers,
+        }
+
+
+# ==========================
+# Incremental rematch
+# ==========================
+def rematch_user(user_id, on_batch=None):
+    """
+    Rescore one patient (a row of the match matrix) or one donor (a column)
+    against its organ- and blood-compatible counterparts and upsert only
+    those OrganMatching rows. Returns the number of rows written.
+
+    Untouched matches (still in DEFAULT_MATCH_STATUS) that the user no
+    longer qualifies for, because they left 'approved', changed organ or
+    blood type, are deleted; reviewed matches are kept.
+    """
+    user = User.objects.filter(pk=user_id).values('role', 'status').first()
+    if not user or user['role'] not in COUNTERPART_ROLE or user['status'] != APPROVED_STATUS:
+        prune_matches(user_id)
+        return 0
+
+    encoder = HLAEncoder(HLAAllele.code_map)
+    single = Cohort.load(user['role'], encoder, pk=user_id)
+    organ, blood_type = single.organs[0], single.blood_types[0]
+    if organ == 'N/A':
+        prune_matches(user_id)
+        return 0
+
+    counterpart_role = COUNTERPART_ROLE[user['role']]
+    counterpart_filters = {
+        'blood_type__in': compatible_blood_types(blood_type, user['role']),
+        ORGAN_FIELDS[counterpart_role]: organ,
+    }
+    counterparts = Cohort.load(counterpart_role, encoder, **counterpart_filters)
+    if user['role'] == 'patient':
+        patients, donors = single, counterparts
+    else:
+        patients, donors = counterparts, single
+
+    with transaction.atomic():
+        prune_matches(user_id, organ, User.objects.filter(
+            role=counterpart_role, status=APPROVED_STATUS, **counterpart_filters
+        ).values('pk'))
+        with MatchWriter(on_batch=on_batch) as writer:
+            for i, j, result in iter_pair_results(patients, donors, rules=rule_set_for(organ)):
+                writer.add(int(patients.ids[i]), int(donors.ids[j]), patients.organs[i], result)
+    return writer.written
+
+
+def prune_matches(user_id, organ=None, counterparts=None):
+    """
+    Delete the DEFAULT_MATCH_STATUS matches of `user_id` except those for
+    `organ` against `counterparts` (a User pk queryset). Without `organ`
+    every untouched match of the user goes. Matches with a surgery are
+    never deleted. Returns the deleted count.
+    """
+    stale = OrganMatching.objects.filter(
+        Q(patient_id=user_id) | Q(donor_id=user_id), status=DEFAULT_MATCH_STATUS, surgery__isnull=True,
+    )
+    if organ is not None:
+        # الـ user في طرف والـ counterparts في الطرف التاني فالـ OR مبيلمسش الـ user نفسه
+        stale = stale.exclude(Q(organ_type=organ) & (Q(patient_id__in=counterparts) | Q(donor_id__in=counterparts)))
+    return stale.delete()[0]
+
+
+def schedule_rematch(user_id):
+    if not matching_setting('INCREMENTAL_REMATCH'):
+        return
+    # robust: الـ save اتعمله commit خلاص، فخطأ في الـ rematch بيتسجل في الـ log بدل ما يرجع 500
+    transaction.on_commit(lambda: notify_rematch(user_id), robust=True)
+
+
+def notify_rematch(user_id):
+    notifier = MatchNotifier()
+    written = rematch_user(user_id, on_batch=notifier)
+    notifier.flush()
+    return written
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.8 on 2026-10-17 15:57
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def remove_duplicate_matches(apps, schema_editor):
+    # نسيب match واحد لكل (patient, donor, organ_type) قبل إضافة الـ constraint،
+    # والأولوية للـ match اللي عليه عملية جراحية
+    OrganMatching = apps.get_model('core', 'OrganMatching')
+    duplicates = (
+        OrganMatching.objects.values('patient_id', 'donor_id', 'organ_type')
+        .annotate(rows=Count('id'))
+        .filter(rows__gt=1)
+    )
+    to_delete, conflicts = [], []
+    for group in duplicates:
+        matches = list(
+            OrganMatching.objects.filter(
+                patient_id=group['patient_id'],
+                donor_id=group['donor_id'],
+                organ_type=group['organ_type'],
+            ).order_by('id')
+        )
+        with_surgery = [m.id for m in matches if hasattr(m, 'surgery')]
+        # Surgery.organ_matching OneToOne: عمليتين مينفعش يتنقلوا على نفس الـ match
+        if len(with_surgery) > 1:
+            conflicts.append(with_surgery)
+            continue
+        keep = with_surgery[0] if with_surgery else matches[0].id
+        to_delete += [m.id for m in matches if m.id != keep]
+    if conflicts:
+        raise RuntimeError(
+            "Duplicate OrganMatching rows each have a surgery; merge or delete those surgeries "
+            "before migrating. Conflicting match ids: "
+            + "; ".join(", ".join(map(str, ids)) for ids in conflicts)
+        )
+    OrganMatching.objects.filter(id__in=to_delete).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_matches, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='organmatching',
+            constraint=models.UniqueConstraint(fields=('patient', 'donor', 'organ_type'), name='unique_match_per_organ'),
+        ),
+    ]
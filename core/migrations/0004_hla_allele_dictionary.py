@@ -0,0 +1,46 @@
+# Generated by Django 5.2.8 on 2026-10-17 16:03
+
+from django.db import migrations, models
+
+from core.hla import HLA_FIELDS, normalize_allele, pack_codes
+
+
+def backfill_hla_packed(apps, schema_editor):
+    User = apps.get_model('core', 'User')
+    HLAAllele = apps.get_model('core', 'HLAAllele')
+
+    names = set()
+    rows = list(User.objects.values_list('id', *HLA_FIELDS))
+    for row in rows:
+        names.update(filter(None, map(normalize_allele, row[1:])))
+    HLAAllele.objects.bulk_create([HLAAllele(name=name) for name in sorted(names)])
+    codes = dict(HLAAllele.objects.values_list('name', 'pk'))
+
+    users = [
+        User(pk=row[0], hla_packed=pack_codes([codes.get(normalize_allele(v), 0) for v in row[1:]]))
+        for row in rows
+    ]
+    User.objects.bulk_update(users, ['hla_packed'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HLAAllele',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=10, unique=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='hla_packed',
+            field=models.BinaryField(blank=True, max_length=12, null=True),
+        ),
+        migrations.RunPython(backfill_hla_packed, migrations.RunPython.noop),
+    ]
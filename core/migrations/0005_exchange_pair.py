@@ -0,0 +1,29 @@
+# Generated by Django 5.2.8 on 2026-10-17 16:09
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_hla_allele_dictionary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExchangePair',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('organ_type', models.CharField(choices=[('كلية', 'كلية'), ('كبد', 'كبد'), ('قلب', 'قلب'), ('رئة', 'رئة'), ('بنكرياس', 'بنكرياس')], default='كلية', max_length=20)),
+                ('is_active', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('donor', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='exchange_pair', to=settings.AUTH_USER_MODEL)),
+                ('patient', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='exchange_pairs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+    ]
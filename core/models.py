@@ -1,10 +1,17 @@
-from django.db import models
+import copy
+from functools import reduce
+import operator
+from django.db import models, transaction
+from django.db.models import Case, Count, F, IntegerField, OuterRef, Q, Subquery, When
+from django.db.models.functions import Coalesce, Trim, Upper
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin, BaseUserManager
 from django.contrib.auth.hashers import make_password, check_password
 from django.core.exceptions import ValidationError
 from django.utils import timezone
 import datetime
 from django.urls import reverse
+from .hla import HLA_FIELDS, MAX_ALLELE_CODE, normalize_allele, pack_codes, unpack_codes
+from .match_kernels import INELIGIBLE_PENALTY, MISMATCH_PENALTY
 from django.utils import timezone
 from django.core.exceptions import ValidationError
 import datetime
@@ -76,6 +83,8 @@ class User(AbstractBaseUser, PermissionsMixin):
     HLA_B_2 = models.CharField(max_length=10, blank=True, null=True)
     HLA_DR_1 = models.CharField(max_length=10, blank=True, null=True)
     HLA_DR_2 = models.CharField(max_length=10, blank=True, null=True)
+    # نفس الـ HLA fields كـ 6 أكواد uint16 من HLAAllele (بتتحدث في save)
+    hla_packed = models.BinaryField(max_length=12, null=True, blank=True, editable=False)
 
     PRA = models.FloatField(null=True, blank=True)
     CMV_status = models.BooleanField(default=False)  
@@ -104,15 +113,59 @@ class User(AbstractBaseUser, PermissionsMixin):
     USERNAME_FIELD = 'national_id'
     REQUIRED_FIELDS = ['first_name', 'last_name']
 
+    # الحقول اللي أي تغيير فيها محتاج إعادة حساب الـ matches
+    MATCHING_FIELDS = (
+        'HLA_A_1', 'HLA_A_2', 'HLA_B_1', 'HLA_B_2', 'HLA_DR_1', 'HLA_DR_2',
+        'PRA', 'CMV_status', 'EBV_status', 'birthdate',
+        'height_cm', 'weight_kg', 'bmi', 'status', 'blood_type',
+    )
+
     objects = CustomUserManager()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._matching_state = instance.matching_state()
+        return instance
+
+    def matching_state(self):
+        # الحقول الـ deferred مش موجودة في __dict__ فمبتتقارنش
+        return {f: self.__dict__[f] for f in self.MATCHING_FIELDS if f in self.__dict__}
+
+    def changed_matching_fields(self):
+        original = getattr(self, '_matching_state', None)
+        current = self.matching_state()
+        if original is None:
+            return set(current)
+        return {f for f, value in current.items() if f in original and original[f] != value}
+
     def save(self, *args, **kwargs):
         if self.height_cm and self.height_cm > 0 and self.weight_kg:
             height_m = self.height_cm / 100
             self.bmi = round(self.weight_kg / (height_m ** 2), 2)
         else:
             self.bmi = None
+        changed = self.changed_matching_fields()
+        missing_packed = 'hla_packed' in self.__dict__ and self.hla_packed is None
+        if changed.intersection(HLA_FIELDS) or missing_packed:
+            self.hla_packed = HLAAllele.pack_user(self)
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None and set(update_fields).intersection(HLA_FIELDS):
+                kwargs['update_fields'] = set(update_fields) | {'hla_packed'}
         super().save(*args, **kwargs)
+        self._matching_state = self.matching_state()
 
+        # إعادة حساب الـ row/column بتاع الـ user ده بس بدل auto_match كامل
+        if changed and self.role in ('patient', 'donor'):
+            from .matching import schedule_rematch
+            schedule_rematch(self.pk)
+
+
+    @property
+    def hla_codes(self):
+        if self.hla_packed:
+            return unpack_codes(self.hla_packed)
+        return None
 
     def is_donor_medically_eligible(self):
         if self.role != 'donor' or self.bmi is None:
@@ -123,6 +176,57 @@ class User(AbstractBaseUser, PermissionsMixin):
         return f"{self.first_name} {self.last_name} ({self.role})"
 
 
+class HLAAllele(models.Model):
+    """Allele dictionary: the primary key is the compact code stored in User.hla_packed."""
+    name = models.CharField(max_length=10, unique=True)
+
+    # name ← code لكل process؛ بيتملى بس بالـ rows اللي اتعملها commit
+    _codes = {}
+
+    def __str__(self):
+        return self.name
+
+    @classmethod
+    def code_for(cls, value):
+        name = normalize_allele(value)
+        if name is None:
+            return 0
+        code = cls._codes.get(name)
+        if code is None:
+            allele, _ = cls.objects.get_or_create(name=name)
+            code = allele.pk
+            if code > MAX_ALLELE_CODE:
+                raise ValueError(f"HLA allele dictionary is full ({name})")
+            # الـ row ممكن يكون اتعمل في transaction لسه مفتوحة وتترجع ← الـ cache بعد الـ commit بس
+            transaction.on_commit(lambda: cls._codes.setdefault(name, code))
+        return code
+
+    @classmethod
+    def code_map(cls):
+        codes = dict(cls.objects.values_list('name', 'pk'))
+        transaction.on_commit(lambda: cls._codes.update(codes))
+        return codes
+
+    @classmethod
+    def pack_user(cls, user):
+        return pack_codes([cls.code_for(getattr(user, field)) for field in HLA_FIELDS])
+
+
+def hla_comparison_keys(patient, donor):
+    """
+    The six HLA keys to compare for a pair: allele codes when both sides
+    have a packed typing, otherwise the normalized typing strings.
+    """
+    patient_codes = getattr(patient, 'hla_codes', None)
+    donor_codes = getattr(donor, 'hla_codes', None)
+    if patient_codes and donor_codes:
+        return patient_codes, donor_codes
+    return (
+        [normalize_allele(getattr(patient, field, None)) for field in HLA_FIELDS],
+        [normalize_allele(getattr(donor, field, None)) for field in HLA_FIELDS],
+    )
+
+
 class OrganType(models.TextChoices):
     KIDNEY = 'كلية', 'كلية'
     LIVER = 'كبد', 'كبد'
@@ -132,6 +236,43 @@ class OrganType(models.TextChoices):
 
 
 # Hospital & Doctor
+# عدد العمليات في الـ dashboard حسب الحالة: (اسم الـ annotation, status)
+SURGERY_STATUS_COUNTS = (
+    ('scheduled_surgeries_count', 'مجدولة'),
+    ('ongoing_surgeries_count', 'جاريه'),
+    ('completed_surgeries_count', 'مكتملة'),
+    ('under_review_surgeries_count', 'تحت المتابعة'),
+)
+HOSPITAL_COUNTS = (
+    'patients_count', 'donors_count', 'total_matches', 'total_surgeries', *(name for name, _ in SURGERY_STATUS_COUNTS),
+)
+
+
+def count_subquery(queryset, field):
+    # count مرتبط بالـ hospital كـ subquery، عشان الـ joins متضربش في بعض
+    counts = queryset.filter(**{field: OuterRef('pk')}).order_by().values(field).annotate(count=Count('pk'))
+    return Coalesce(Subquery(counts.values('count')), 0)
+
+
+class HospitalQuerySet(models.QuerySet):
+    def with_dashboard_counts(self):
+        """
+        Annotate every HOSPITAL_COUNTS value in the hospital query itself:
+        surgeries by status as conditional counts over one join, users and
+        matches as correlated subqueries.
+        """
+        return self.annotate(
+            patients_count=count_subquery(User.objects.filter(role='patient'), 'hospital'),
+            donors_count=count_subquery(User.objects.filter(role='donor'), 'hospital'),
+            total_matches=count_subquery(OrganMatching.objects.all(), 'patient__hospital'),
+            total_surgeries=Count('surgery', distinct=True),
+            **{
+                name: Count('surgery', filter=Q(surgery__status=status), distinct=True)
+                for name, status in SURGERY_STATUS_COUNTS
+            },
+        )
+
+
 class Hospital(models.Model):
     HOSPITAL_TYPE_CHOICES = (
         ('حكومي', 'حكومي'),
@@ -147,6 +288,9 @@ class Hospital(models.Model):
     working_hours = models.CharField(max_length=100, blank=False, null=False)
     hospital_type = models.CharField(max_length=10, choices=HOSPITAL_TYPE_CHOICES, default='حكومي')
     password = models.CharField(max_length=128 , default="enter your password") 
+
+    objects = HospitalQuerySet.as_manager()
+
     def set_password(self, raw_password):
         self.password = make_password(raw_password)
         self.save(update_fields=['password'])
@@ -192,6 +336,14 @@ class UserChronicDisease(models.Model):
 
 
 # Patient & Donor Profiles
+def touch_user(user_id):
+    # تعديل الـ profile بيحرك updated_at بتاع الـ user (الـ matching cache معتمد عليه)
+    # وبيعيد حساب الـ matches بتاعته: العضو المطلوب / المتاح جاي من الـ profile
+    User.objects.filter(pk=user_id).update(updated_at=timezone.now())
+    from .matching import schedule_rematch
+    schedule_rematch(user_id)
+
+
 class PatientMedicalProfile(models.Model):
     patient = models.OneToOneField(
         User,
@@ -203,6 +355,14 @@ class PatientMedicalProfile(models.Model):
         choices=OrganType.choices,default="Kindy"
     )
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        touch_user(self.patient_id)
+
+    def delete(self, *args, **kwargs):
+        touch_user(self.patient_id)
+        return super().delete(*args, **kwargs)
+
     def __str__(self):
         return f"{self.patient} needs {self.organ_needed}"
 
@@ -220,6 +380,14 @@ class DonorMedicalProfile(models.Model):
         default="Kindy"
     )
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        touch_user(self.donor_id)
+
+    def delete(self, *args, **kwargs):
+        touch_user(self.donor_id)
+        return super().delete(*args, **kwargs)
+
     def __str__(self):
         return f"{self.donor} donates {self.organ_available}"
 
@@ -273,6 +441,37 @@ class Appointment(models.Model):
         return f"{self.patient} - {self.appointment_date}"
 
 # Organ & AI Matching
+USER_MINI_FIELDS = ('id', 'first_name', 'last_name', 'role', 'national_id', 'blood_type', 'gender')
+
+
+class OrganMatchingQuerySet(models.QuerySet):
+    def with_hla_mismatch_count(self):
+        """
+        Annotate `db_hla_mismatch_count` with the same rule as the
+        `hla_mismatch_count` property (both sides typed and different after
+        trim/upper), computed in SQL instead of loading both users' HLA.
+        """
+        aliases, cases = {}, []
+        for field in HLA_FIELDS:
+            patient_key, donor_key = f'_patient_{field.lower()}', f'_donor_{field.lower()}'
+            aliases[patient_key] = Upper(Trim(f'patient__{field}'))
+            aliases[donor_key] = Upper(Trim(f'donor__{field}'))
+            mismatch = (
+                Q(**{f'{patient_key}__gt': ''}) & Q(**{f'{donor_key}__gt': ''})
+                & ~Q(**{patient_key: F(donor_key)})
+            )
+            cases.append(Case(When(mismatch, then=1), default=0, output_field=IntegerField()))
+        return self.alias(**aliases).annotate(db_hla_mismatch_count=reduce(operator.add, cases))
+
+    def with_user_mini(self):
+        # بس أعمدة UserMiniSerializer من الـ patient والـ donor (من غير password والـ HLA)
+        return self.select_related('patient', 'donor').only(
+            *(field.name for field in self.model._meta.concrete_fields),
+            *(f'patient__{field}' for field in USER_MINI_FIELDS),
+            *(f'donor__{field}' for field in USER_MINI_FIELDS),
+        )
+
+
 class OrganMatching(models.Model):
     STATUS_CHOICES = (
         ('قيد الانتظار', 'قيد الانتظار'),
@@ -287,17 +486,79 @@ class OrganMatching(models.Model):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = OrganMatchingQuerySet.as_manager()
+
     class Meta:
         ordering = ['-match_percentage']
+        constraints = [
+            # مطلوب للـ bulk upsert في auto_match
+            models.UniqueConstraint(
+                fields=['patient', 'donor', 'organ_type'],
+                name='unique_match_per_organ',
+            ),
+        ]
+
+
+
+    # الحقول اللي بتتتبع (name ← attname)؛ لو متغيرش أي واحد منهم مفيش save ولا signals
+    TRACKED_FIELDS = {
+        'patient': 'patient_id', 'donor': 'donor_id', 'organ_type': 'organ_type',
+        'match_percentage': 'match_percentage', 'ai_result': 'ai_result', 'status': 'status',
+    }
+    # التغييرات اللي تستاهل alerts
+    NOTIFY_FIELDS = ('match_percentage', 'status')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._tracked_state = instance.tracked_state()
+        return instance
+
+    def tracked_state(self):
+        # الحقول الـ deferred مش موجودة في __dict__ فمبتتقارنش؛
+        # الـ ai_result (JSON) بيتنسخ عشان التعديل in-place على الـ dict يبان كتغيير
+        return {
+            name: copy.deepcopy(self.__dict__[attname])
+            for name, attname in self.TRACKED_FIELDS.items() if attname in self.__dict__
+        }
 
+    def changed_fields(self):
+        original = getattr(self, '_tracked_state', None)
+        current = self.tracked_state()
+        if original is None:
+            return set(current)
+        return {f for f, value in current.items() if f in original and original[f] != value}
 
+    def save(self, *args, **kwargs):
+        """
+        A row loaded from the database is only written when a tracked field
+        changed, and then only the changed fields. `_changed_fields` tells
+        the post_save receivers what actually moved; they run in the same
+        transaction as the write.
+        """
+        self._changed_fields = self.changed_fields()
+        loaded = not self._state.adding and hasattr(self, '_tracked_state')
+        if loaded and not kwargs.get('force_insert'):
+            update_fields = kwargs.get('update_fields')
+            if update_fields is None:
+                update_fields = self._changed_fields
+            else:
+                # الحقول اللي مش بتتتبع بتتكتب زي ما اتطلبت
+                update_fields = {
+                    f for f in update_fields if f not in self.TRACKED_FIELDS or f in self._changed_fields
+                }
+            if not update_fields:
+                return
+            kwargs['update_fields'] = update_fields
+        # الـ post_save receivers (publish على الـ outbox) بيشتغلوا جوه نفس الـ transaction:
+        # لو الـ publish فشل، تغيير الـ status بيترجع معاه
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+        self._tracked_state = self.tracked_state()
 
-    def update_match(self):
-        result = self.calculate_match(self.patient, self.donor)
-        self.match_percentage = result['match_percentage']
-        self.ai_result = result['ai_result']
-        self.status = 'pending'
-        self.save()
+    @property
+    def needs_notification(self):
+        return bool(set(self.NOTIFY_FIELDS).intersection(getattr(self, '_changed_fields', self.NOTIFY_FIELDS)))
 
     def __str__(self):
         return f"{self.patient} ↔ {self.donor} ({self.match_percentage}%)"
@@ -306,11 +567,12 @@ class OrganMatching(models.Model):
 
     @property
     def hla_mismatch_count(self):
+        # من الـ annotation لو موجود (with_hla_mismatch_count)، وإلا بنحسب من الـ users
+        annotated = getattr(self, 'db_hla_mismatch_count', None)
+        if annotated is not None:
+            return annotated
         mismatches = 0
-        hla_fields = ['HLA_A_1','HLA_A_2','HLA_B_1','HLA_B_2','HLA_DR_1','HLA_DR_2']
-        for field in hla_fields:
-            patient_val = getattr(self.patient, field, None)
-            donor_val = getattr(self.donor, field, None)
+        for patient_val, donor_val in zip(*hla_comparison_keys(self.patient, self.donor)):
             if patient_val and donor_val and patient_val != donor_val:
                 mismatches += 1
         return mismatches
@@ -318,36 +580,71 @@ class OrganMatching(models.Model):
 
     @staticmethod
     def calculate_match(patient, donor):
+        """
+        Per-pair score with the default rule set (hla + bmi): the reference
+        the vectorized engine is checked against. Organs configured with
+        other SCORING_RULES are scored by matching.score_pair.
+        """
         mismatches = 0
-        hla_fields = ['HLA_A_1','HLA_A_2','HLA_B_1','HLA_B_2','HLA_DR_1','HLA_DR_2']
-        for field in hla_fields:
-            patient_val = getattr(patient, field, None)
-            donor_val = getattr(donor, field, None)
+        for patient_val, donor_val in zip(*hla_comparison_keys(patient, donor)):
             if patient_val and donor_val and patient_val != donor_val:
                 mismatches += 1
 
-        score = max(0, 100 - mismatches * 10)
-
-        if hasattr(donor, 'is_donor_medically_eligible') and not donor.is_donor_medically_eligible():
-            score -= 20
-            score = max(score, 0)
+        rules = {}
+        if mismatches:
+            rules['hla'] = -MISMATCH_PENALTY * mismatches
+        eligible = getattr(donor, 'is_donor_medically_eligible', lambda: False)()
+        if hasattr(donor, 'is_donor_medically_eligible') and not eligible:
+            rules['bmi'] = -INELIGIBLE_PENALTY
+        score = max(0, 100 + sum(rules.values()))
         return {
             "hla_mismatch_count": mismatches,
             "match_percentage": score,
             "ai_result": {
                 "hla_mismatches": mismatches,
                 "bmi": getattr(donor, 'bmi', None),
-                "eligible": getattr(donor, 'is_donor_medically_eligible', lambda: False)()
+                "eligible": eligible,
+                "rules": rules,
             }
         }
 
     def update_match(self):
-        result = self.calculate_match(self.patient, self.donor)
+        from .matching import score_pair
+        result = score_pair(self.patient, self.donor, self.organ_type)
         self.match_percentage = result['match_percentage']
         self.ai_result = result['ai_result']
         self.status = 'pending'  
         self.save()
 
+
+# Paired exchange
+class ExchangePair(models.Model):
+    """
+    A patient registered together with a willing but incompatible donor.
+    A pair without a patient is an altruistic (non-directed) donor that can
+    start an exchange chain.
+    """
+    patient = models.ForeignKey(
+        User, on_delete=models.CASCADE, null=True, blank=True, related_name='exchange_pairs'
+    )
+    donor = models.OneToOneField(User, on_delete=models.CASCADE, related_name='exchange_pair')
+    organ_type = models.CharField(max_length=20, choices=OrganType.choices, default=OrganType.KIDNEY)
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
+
+    @property
+    def is_altruistic(self):
+        return self.patient_id is None
+
+    def __str__(self):
+        if self.is_altruistic:
+            return f"{self.donor} (altruistic, {self.organ_type})"
+        return f"{self.patient} + {self.donor} ({self.organ_type})"
+
+
 # Surgery
 class Surgery(models.Model):
     SURGERY_STATUS = [
@@ -529,6 +826,52 @@ class SurgeryReport(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
 
 
+# Background Jobs
+class Job(models.Model):
+    STATUS_CHOICES = (
+        ('queued', 'queued'),
+        ('running', 'running'),
+        ('done', 'done'),
+        ('failed', 'failed'),
+    )
+
+    kind = models.CharField(max_length=50)
+    params = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued', db_index=True)
+
+    processed = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(null=True, blank=True)
+    rows_written = models.PositiveIntegerField(default=0)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(null=True, blank=True)
+    worker = models.CharField(max_length=100, null=True, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    # آخر مرة الـ worker بلغ إنه شغال (claim أو progress)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    @property
+    def progress(self):
+        if not self.total:
+            return 100.0 if self.status == 'done' else 0.0
+        return round(100 * self.processed / self.total, 1)
+
+    @property
+    def duration(self):
+        if not self.started_at:
+            return None
+        end = self.finished_at or timezone.now()
+        return round((end - self.started_at).total_seconds(), 3)
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk} ({self.status})"
+
+
 
 
 
@@ -553,4 +896,32 @@ class SurgeryReport(models.Model):
 
 
 #     def __str__(self):
-#         return f"Vitals for {self.surgery_report.surgery.surgery_number} @ {self.recorded_at}"
\ No newline at end of file
+#         return f"Vitals for {self.surgery_report.surgery.surgery_number} @ {self.recorded_at}"
+
+# Transactional outbox
+class OutboxEvent(models.Model):
+    """
+    A domain event appended in the same transaction as the change that
+    caused it; `manage.py dispatch_outbox` expands it into alerts later.
+    """
+    STATUS_CHOICES = (
+        ('pending', 'pending'),
+        ('done', 'done'),
+        ('failed', 'failed'),
+    )
+
+    kind = models.CharField(max_length=50)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(null=True, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [models.Index(fields=['status', 'id'], name='outbox_status_id_idx')]
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk} ({self.status})"
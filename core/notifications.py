@@ -0,0 +1,72 @@
+from collections import Counter
+
+from .models import Alert, AlertHospital, User
+
+
+# ==========================
+# Bulk alert inserts
+# ==========================
+# كل الـ alerts بتتكتب bulk من مكانين بس: الـ outbox dispatcher والـ MatchNotifier
+def bulk_insert_alerts(alerts):
+    """Insert a mix of Alert and AlertHospital rows with one bulk_create per model."""
+    for model in (Alert, AlertHospital):
+        rows = [alert for alert in alerts if isinstance(alert, model)]
+        if rows:
+            model.objects.bulk_create(rows)
+
+
+# ==========================
+# Match notifications
+# ==========================
+class MatchNotifier:
+    """
+    Collects upserted match batches (pass it as a MatchWriter `on_batch`)
+    and emits the alerts once with flush(): a single Alert per patient and
+    donor and a single AlertHospital per patient hospital for the whole
+    run, written with two bulk inserts.
+    """
+
+    def __init__(self):
+        self.patient_counts = Counter()
+        self.donor_counts = Counter()
+        self.hospital_counts = Counter()
+
+    def __call__(self, matches):
+        self.add(matches)
+
+    def add(self, matches):
+        if not matches:
+            return
+        self.patient_counts.update((m.patient_id, m.organ_type) for m in matches)
+        self.donor_counts.update((m.donor_id, m.organ_type) for m in matches)
+        # الـ hospital بيتجاب مع كل batch عشان الـ __in ميكبرش بحجم الـ run
+        patient_hospitals = dict(
+            User.objects.filter(id__in={m.patient_id for m in matches}, hospital__isnull=False)
+            .values_list('id', 'hospital_id')
+        )
+        self.hospital_counts.update(
+            patient_hospitals[m.patient_id] for m in matches if m.patient_id in patient_hospitals
+        )
+
+    def flush(self):
+        counts = list(self.patient_counts.items()) + list(self.donor_counts.items())
+        Alert.objects.bulk_create([
+            Alert(
+                user_id=user_id,
+                message_title="تحديث المطابقات",
+                message=f"تم تعديل {count} Match للعضو: {organ_type}",
+                alert_type='معلومة',
+            )
+            for (user_id, organ_type), count in counts
+        ])
+        AlertHospital.objects.bulk_create([
+            AlertHospital(
+                hospital_id=hospital_id,
+                message_title="تحديث المطابقات",
+                message=f"تم تعديل {count} Match لمرضى المستشفى",
+                alert_type='معلومة',
+            )
+            for hospital_id, count in self.hospital_counts.items()
+        ])
+        self.patient_counts, self.donor_counts, self.hospital_counts = Counter(), Counter(), Counter()
+
@@ -0,0 +1,165 @@
+import traceback
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Alert, AlertHospital, OutboxEvent
+from .notifications import bulk_insert_alerts
+
+
+# handler لكل نوع event: handler(payload) ← list من Alert / AlertHospital
+EVENT_HANDLERS = {}
+
+OUTBOX_BATCH_SIZE = 500
+# بعد العدد ده من المحاولات الفاشلة الـ event بيتعلم failed ومبيترجعلوش
+MAX_ATTEMPTS = 5
+
+
+def event_handler(kind):
+    def register(func):
+        EVENT_HANDLERS[kind] = func
+        return func
+    return register
+
+
+def publish(kind, **payload):
+    """
+    Append a domain event to the outbox. It is written with the caller's
+    transaction, so it only exists if the change that caused it commits.
+    """
+    if kind not in EVENT_HANDLERS:
+        raise ValueError(f"Unknown outbox event: {kind}")
+    return OutboxEvent.objects.create(kind=kind, payload=payload)
+
+
+def full_name(user):
+    return f"{user.first_name} {user.last_name}"
+
+
+# ==========================
+# Event handlers
+# ==========================
+# (رسالة المريض, رسالة المتبرع, رسالة المستشفى, alert_type)
+MATCH_EVENTS = {
+    'match_confirmed': (
+        "تم تأكيد حالتك بعد الحصول على Match للعضو: {organ_type}",
+        "تم تأكيد عملية التبرع للعضو: {organ_type}",
+        "تم تأكيد Match للعضو {organ_type} بين المريض {patient_name} والمتبرع {donor_name}",
+        'medical',
+    ),
+    'match_cancelled': (
+        "تم إلغاء Match للعضو: {organ_type}",
+        "تم إلغاء Match للعضو: {organ_type}",
+        "تم إلغاء Match للعضو {organ_type} بين المريض {patient_name} والمتبرع {donor_name}",
+        'warning',
+    ),
+    'match_updated': (
+        "تم تعديل Match للعضو: {organ_type}",
+        "تم تعديل Match للعضو: {organ_type}",
+        "تم تعديل Match للعضو {organ_type} بين المريض {patient_name} والمتبرع {donor_name}",
+        'info',
+    ),
+}
+
+
+def match_alerts(kind, payload):
+    patient_text, donor_text, hospital_text, alert_type = MATCH_EVENTS[kind]
+    alerts = [
+        Alert(user_id=payload['patient_id'], message=patient_text.format(**payload), alert_type=alert_type),
+        Alert(user_id=payload['donor_id'], message=donor_text.format(**payload), alert_type=alert_type),
+    ]
+    if payload.get('hospital_id'):
+        alerts.append(AlertHospital(
+            hospital_id=payload['hospital_id'], message=hospital_text.format(**payload), alert_type='hospital'
+        ))
+    return alerts
+
+
+for _kind in MATCH_EVENTS:
+    event_handler(_kind)(lambda payload, kind=_kind: match_alerts(kind, payload))
+
+
+@event_handler('surgery_report_added')
+def surgery_report_alerts(payload):
+    alerts = [Alert(
+        user_id=payload['patient_id'],
+        message=f"تم إضافة تقرير العملية الجراحية الخاصة بك: {payload['surgery_number']}",
+        alert_type='medical',
+    )]
+    if payload.get('hospital_id'):
+        alerts.append(AlertHospital(
+            hospital_id=payload['hospital_id'],
+            message=f"تم إضافة تقرير عملية {payload['surgery_number']}.",
+            alert_type='hospital',
+        ))
+    return alerts
+
+
+@event_handler('vital_sign_breach')
+def vital_sign_alerts(payload):
+    return [Alert(
+        user_id=payload['patient_id'],
+        message="تحذير بعد العملية: " + "، ".join(payload['alerts']),
+        alert_type="critical" if payload.get('critical') else "medical",
+    )]
+
+
+# ==========================
+# Dispatcher
+# ==========================
+def record_failure(event):
+    event.error = traceback.format_exc()
+    event.status = 'failed' if event.attempts >= MAX_ATTEMPTS else 'pending'
+
+
+def dispatch_batch(batch_size=OUTBOX_BATCH_SIZE):
+    """
+    Claim up to `batch_size` pending events, expand them into alerts and
+    insert those with one bulk_create per model, marking the events done
+    in the same transaction. If the batch insert fails, each event's alerts
+    are retried in their own savepoint, so only the failing event uses up
+    an attempt. Returns (done, failed) counts.
+    """
+    with transaction.atomic():
+        # skip_locked: أكتر من dispatcher يقدروا يشتغلوا على الجدول في نفس الوقت
+        events = list(
+            OutboxEvent.objects.select_for_update(skip_locked=True)
+            .filter(status='pending')
+            .order_by('id')[:batch_size]
+        )
+        if not events:
+            return 0, 0
+        expanded, failed = [], 0
+        for event in events:
+            event.attempts += 1
+            try:
+                handler = EVENT_HANDLERS.get(event.kind)
+                if handler is None:
+                    raise ValueError(f"Unknown outbox event: {event.kind}")
+                expanded.append((event, handler(event.payload)))
+            except Exception:
+                record_failure(event)
+                failed += 1
+
+        try:
+            with transaction.atomic():
+                bulk_insert_alerts([alert for _, alerts in expanded for alert in alerts])
+        except Exception:
+            # event واحد بايظ مش لازم يرجع الـ batch كله: كل event في savepoint لوحده
+            inserted = []
+            for event, alerts in expanded:
+                try:
+                    with transaction.atomic():
+                        bulk_insert_alerts(alerts)
+                except Exception:
+                    record_failure(event)
+                    failed += 1
+                else:
+                    inserted.append((event, alerts))
+            expanded = inserted
+
+        now = timezone.now()
+        for event, _ in expanded:
+            event.status, event.error, event.processed_at = 'done', None, now
+        OutboxEvent.objects.bulk_update(events, ['status', 'attempts', 'error', 'processed_at'])
+    return len(expanded), failed
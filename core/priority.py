@@ -0,0 +1,124 @@
+import time
+
+from django.db import transaction
+from django.db.models import Case, Count, F, Q, Value, When
+from django.utils import timezone
+
+from .models import PatientPriority, User
+
+
+# عدد الـ rows في كل bulk_update / bulk_create
+PRIORITY_BATCH_SIZE = 1000
+
+# نقط كل مرض مزمن، ونقط وجود عضو مطلوب في الـ profile
+DISEASE_POINTS = 10
+ORGAN_NEEDED_POINTS = 20
+
+# (أقل score, level) من الأعلى للأقل
+PRIORITY_LEVELS = ((50, 'critical'), (30, 'high'), (10, 'medium'))
+# حدود الـ level بعد زيادات المتابعة (vital signs)
+VITAL_SIGN_LEVELS = ((70, 'critical'), (40, 'high'), (20, 'medium'))
+# حدود الـ level بعد إضافة تقرير عملية
+SURGERY_REPORT_LEVELS = ((80, 'critical'), (50, 'high'), (20, 'medium'))
+
+
+# ==========================
+# Patient Priority
+# ==========================
+def priority_level(score):
+    for threshold, level in PRIORITY_LEVELS:
+        if score >= threshold:
+            return level
+    return 'low'
+
+
+def adjust_priority(patient, delta, levels=PRIORITY_LEVELS):
+    """
+    Add `delta` to a patient's priority score and derive its level in one
+    UPDATE, so concurrent increments never overwrite each other. The row
+    is created first if missing. Returns the new (score, level).
+    """
+    patient_id = getattr(patient, 'pk', patient)
+    PatientPriority.objects.get_or_create(patient_id=patient_id, defaults={'score': 0, 'level': 'low'})
+    # الـ level قبل الـ score ومقارن بالقيمة القديمة + delta: MySQL بيقيم الـ SET
+    # بالترتيب وبالقيم الجديدة، والباقي بالقيم القديمة، فالنتيجة واحدة في الاتنين
+    PatientPriority.objects.filter(patient_id=patient_id).update(
+        level=Case(
+            *(When(score__gte=threshold - delta, then=Value(level)) for threshold, level in levels),
+            default=Value('low'),
+        ),
+        score=F('score') + delta,
+        updated_at=timezone.now(),
+    )
+    return PatientPriority.objects.filter(patient_id=patient_id).values_list('score', 'level').get()
+
+
+def annotate_priorities(patients):
+    """
+    Annotate `new_score` and `new_level` on a patient queryset with one
+    aggregated query: chronic disease count and whether the profile names
+    a needed organ.
+    """
+    organ_needed = Q(patient_profile__organ_needed__isnull=False) & ~Q(patient_profile__organ_needed='')
+    score = (
+        Count('chronic_diseases', distinct=True) * DISEASE_POINTS
+        + Case(When(organ_needed, then=Value(ORGAN_NEEDED_POINTS)), default=Value(0))
+    )
+    return patients.annotate(new_score=score).annotate(new_level=Case(
+        *(When(new_score__gte=threshold, then=Value(level)) for threshold, level in PRIORITY_LEVELS),
+        default=Value('low'),
+    ))
+
+
+def calculate_priorities(patients=None, progress=None, batch_size=PRIORITY_BATCH_SIZE, details=True):
+    """
+    Recompute score and level for every patient (or the `patients`
+    queryset) set-wise and write only the rows that changed, with chunked
+    bulk_create / bulk_update. `progress` is called with
+    (processed, total, rows_written) after each chunk. Returns counts and
+    elapsed time, plus the per-patient results when `details`.
+    """
+    started = time.perf_counter()
+    if patients is None:
+        patients = User.objects.filter(role='patient')
+    rows = list(annotate_priorities(patients).order_by('id').values_list(
+        'id', 'first_name', 'last_name', 'role',
+        'priority__id', 'priority__score', 'priority__level', 'new_score', 'new_level',
+    ))
+    total = len(rows)
+    now = timezone.now()
+
+    created, updated, results = [], [], []
+    for user_id, first_name, last_name, role, priority_id, old_score, old_level, score, level in rows:
+        if priority_id is None:
+            created.append(PatientPriority(patient_id=user_id, score=score, level=level))
+        elif old_score != score or old_level != level:
+            updated.append(PatientPriority(id=priority_id, score=score, level=level, updated_at=now))
+        if details:
+            results.append({"patient": f"{first_name} {last_name} ({role})", "score": score, "level": level})
+
+    written = 0
+    with transaction.atomic():
+        for model_rows, write in (
+            (created, lambda chunk: PatientPriority.objects.bulk_create(chunk)),
+            (updated, lambda chunk: PatientPriority.objects.bulk_update(chunk, ['score', 'level', 'updated_at'])),
+        ):
+            for start in range(0, len(model_rows), batch_size):
+                chunk = model_rows[start:start + batch_size]
+                write(chunk)
+                written += len(chunk)
+                if progress:
+                    progress(total, total, written)
+    if progress:
+        progress(total, total, written)
+
+    summary = {
+        "patients": total,
+        "created": len(created),
+        "updated": len(updated),
+        "unchanged": total - len(created) - len(updated),
+        "elapsed": round(time.perf_counter() - started, 6),
+    }
+    if details:
+        summary["results"] = results
+    return summary
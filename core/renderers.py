@@ -0,0 +1,69 @@
+import codecs
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # من غير orjson ← الـ stdlib json بتاع DRF
+    orjson = None
+
+
+# التواريخ بتتحول بالـ encoder بتاع DRF ('Z' بدل +00:00) عشان الـ output ميتغيرش
+ORJSON_OPTIONS = (orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME) if orjson else 0
+
+_encoder = JSONEncoder()
+
+
+def dumps(data):
+    """
+    UTF-8 JSON bytes for `data` with orjson (Arabic text stays as is,
+    compact separators). Anything orjson doesn't know (dates, Decimals,
+    lazy strings, querysets...) goes through DRF's JSONEncoder.default.
+    """
+    return orjson.dumps(data, default=_encoder.default, option=ORJSON_OPTIONS)
+
+
+# ==========================
+# Renderer / parser
+# ==========================
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer on orjson. Indented output (?indent / Accept params, the
+    browsable API) and payloads orjson rejects (e.g. ints over 64 bits)
+    fall back to the stdlib renderer, as does a missing orjson.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if orjson is None or self.get_indent(accepted_media_type or '', renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = dumps(data)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # زي DRF: U+2028/U+2029 escaped عشان الـ JSON يفضل JavaScript صالح
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
+
+
+class FastJSONParser(JSONParser):
+    """JSONParser on orjson; NaN / Infinity are rejected like DRF's strict mode."""
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if orjson is None:
+            return super().parse(stream, media_type, parser_context)
+        encoding = (parser_context or {}).get('encoding', settings.DEFAULT_CHARSET)
+        body = stream.read()
+        if codecs.lookup(encoding).name != 'utf-8':
+            body = body.decode(encoding).encode('utf-8')
+        try:
+            return orjson.loads(body)
+        except orjson.JSONDecodeError as exc:
+            raise ParseError(f'JSON parse error - {exc}')
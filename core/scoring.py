@@ -0,0 +1,149 @@
+# Match-scoring rules, compiled into one rule set per organ and scored per (patients × donors) chunk.
+import numpy as np
+
+from .match_kernels import INELIGIBLE_PENALTY, MISMATCH_PENALTY, mismatch_matrix
+
+
+BASE_SCORE = 100
+
+# أعمدة الـ cohort اللي ممكن rule تطلبها (نفس الأسامي في Cohort.columns)
+COLUMNS = ('hla', 'eligible', 'blood_type', 'pra', 'cmv', 'ebv', 'age')
+
+RULES = {}
+
+
+class Rule:
+    def __init__(self, name, columns, function, defaults):
+        self.name = name
+        self.columns = tuple(columns)
+        self.function = function
+        self.defaults = defaults
+
+
+def register_rule(name, columns=(), **defaults):
+    """
+    Register `function(patients, donors, mismatches, **params)` as scoring
+    rule `name`. `patients` and `donors` are dicts holding the requested
+    `columns` for the chunk; the function returns points (usually ≤ 0)
+    broadcastable to (len(patients), len(donors)). Keyword defaults are the
+    rule's parameters and can be overridden per rule set.
+    """
+    unknown = set(columns) - set(COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown scoring columns for {name}: {', '.join(sorted(unknown))}")
+
+    def decorator(function):
+        RULES[name] = Rule(name, columns, function, defaults)
+        return function
+    return decorator
+
+
+# ==========================
+# Built-in rules
+# ==========================
+@register_rule('hla', penalty=MISMATCH_PENALTY)
+def hla_rule(patients, donors, mismatches, penalty):
+    return -penalty * mismatches.astype(np.int16)
+
+
+@register_rule('bmi', columns=('eligible',), penalty=INELIGIBLE_PENALTY)
+def bmi_rule(patients, donors, mismatches, penalty):
+    return np.where(donors['eligible'], 0, -penalty)[None, :]
+
+
+@register_rule('abo', columns=('blood_type',), penalty=5)
+def abo_rule(patients, donors, mismatches, penalty):
+    # الـ blocking بيشيل غير المتوافقين، فالفرق هنا متوافق بس مش identical
+    return np.where(patients['blood_type'][:, None] == donors['blood_type'][None, :], 0, -penalty)
+
+
+@register_rule('pra', columns=('pra',), threshold=80, penalty=10)
+def pra_rule(patients, donors, mismatches, threshold, penalty):
+    # مريض highly sensitized ← احتمال crossmatch موجب أعلى
+    return np.where(patients['pra'] >= threshold, -penalty, 0)[:, None]
+
+
+@register_rule('cmv', columns=('cmv',), penalty=5)
+def cmv_rule(patients, donors, mismatches, penalty):
+    # متبرع positive لمريض negative
+    return np.where(~patients['cmv'][:, None] & donors['cmv'][None, :], -penalty, 0)
+
+
+@register_rule('ebv', columns=('ebv',), penalty=5)
+def ebv_rule(patients, donors, mismatches, penalty):
+    return np.where(~patients['ebv'][:, None] & donors['ebv'][None, :], -penalty, 0)
+
+
+@register_rule('age', columns=('age',), tolerance=15, per_year=1, max_penalty=15)
+def age_rule(patients, donors, mismatches, tolerance, per_year, max_penalty):
+    gap = np.abs(patients['age'][:, None] - donors['age'][None, :]) - tolerance
+    # سن مش معروف (NaN) ← من غير خصم
+    gap = np.nan_to_num(np.maximum(gap, 0), nan=0.0)
+    return -np.minimum(np.floor(gap * per_year), max_penalty)
+
+
+# ==========================
+# Compiled rule sets
+# ==========================
+def parse_rule_spec(entry):
+    if isinstance(entry, str):
+        return entry, {}
+    name, params = entry
+    return name, dict(params)
+
+
+class RuleSet:
+    """
+    A compiled list of rules: parameters resolved and checked, and the
+    union of the columns they read. Only names and parameters are stored,
+    so a rule set pickles cheaply to pool workers.
+    """
+
+    def __init__(self, spec):
+        self.entries = []
+        for entry in spec:
+            name, params = parse_rule_spec(entry)
+            if name not in RULES:
+                raise ValueError(f"Unknown scoring rule: {name}")
+            unknown = set(params) - set(RULES[name].defaults)
+            if unknown:
+                raise ValueError(f"Unknown parameters for rule {name}: {', '.join(sorted(unknown))}")
+            self.entries.append((name, {**RULES[name].defaults, **params}))
+        self.names = tuple(name for name, _ in self.entries)
+        self.columns = tuple(c for c in COLUMNS if any(c in RULES[name].columns for name in self.names))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __eq__(self, other):
+        return isinstance(other, RuleSet) and self.entries == other.entries
+
+    def evaluate(self, patients, donors):
+        """
+        Score a chunk: returns (mismatches, scores, contributions) where
+        contributions is (rows, donors, rules) int8, one layer per rule in
+        order, and scores are BASE_SCORE plus their sum, clipped to 0..100.
+        """
+        mismatches = mismatch_matrix(patients['hla'], donors['hla'])
+        shape = mismatches.shape
+        contributions = np.empty(shape + (len(self.entries),), dtype=np.int8)
+        total = np.full(shape, BASE_SCORE, dtype=np.int16)
+        for layer, (name, params) in enumerate(self.entries):
+            points = np.broadcast_to(
+                np.clip(RULES[name].function(patients, donors, mismatches, **params), -BASE_SCORE, BASE_SCORE),
+                shape,
+            ).astype(np.int16)
+            contributions[:, :, layer] = points
+            total += points
+        return mismatches, np.clip(total, 0, BASE_SCORE), contributions
+
+    def describe(self, contributions):
+        # في الـ ai_result بنسجل الـ rules اللي غيرت الـ score بس
+        return {name: value for name, value in zip(self.names, contributions) if value}
+
+
+def compile_rules(spec):
+    return spec if isinstance(spec, RuleSet) else RuleSet(spec)
+
+
+DEFAULT_RULES = ('hla', 'bmi')
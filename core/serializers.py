@@ -1,5 +1,7 @@
 from rest_framework import serializers
 from .models import *
+from django.db.models import Prefetch
+from .fieldsets import DynamicFieldsMixin
 from django.contrib.auth import authenticate
 from django.utils import timezone
 import datetime
@@ -99,7 +101,7 @@ class HospitalRegisterSerializer(serializers.ModelSerializer):
 # ==========================
 # User Serializer
 # ==========================
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     full_name = serializers.SerializerMethodField(read_only=True)
     surgeries = serializers.SerializerMethodField()
     organ_needed = serializers.SerializerMethodField()
@@ -134,7 +136,71 @@ class UserSerializer(serializers.ModelSerializer):
             "appointments","mri_reports","surgery_reports","priority","alerts",'user_reports'
         ]
         read_only_fields = ['bmi', 'created_at' , 'updated_at']
+        # الـ relations التقيلة بتظهر في الـ ?fields= / ?expand= بس لو اتطلبت
+        expandable_fields = {
+            name: () for name in (
+                'surgeries', 'chronic_diseases', 'hospital_detail', 'supervisor_doctors_detail', 'appointments',
+                'mri_reports', 'surgery_reports', 'priority', 'alerts', 'user_reports',
+            )
+        }
+
+
+    # العمليات بتتقرا من الـ matches: الـ surgery والـ report بتاعها والطرف التاني في نفس الـ query
+    SURGERY_RELATED = ('patient', 'donor', 'surgery__doctor__hospital', 'surgery__hospital', 'surgery__report')
 
+    @classmethod
+    def surgery_matches(cls):
+        return OrganMatching.objects.filter(surgery__isnull=False).select_related(*cls.SURGERY_RELATED)
+
+    @classmethod
+    def field_loading(cls):
+        # field ← (select_related, prefetch_related) اللي الـ get_* بتاعه بيقرا منهم
+        patient_surgeries = Prefetch(
+            'patient_matches', queryset=cls.surgery_matches(), to_attr='surgery_matches_as_patient'
+        )
+        return {
+            'organ_needed': (('patient_profile',), ()),
+            'organ_available': (('donor_profile',), ()),
+            'chronic_diseases': (('patient_profile', 'donor_profile'), (
+                Prefetch('chronic_diseases', queryset=UserChronicDisease.objects.select_related('disease')),
+            )),
+            'hospital_detail': (('hospital', 'patient_profile', 'donor_profile'), ()),
+            'supervisor_doctors_detail': (('supervisor_doctor__hospital',), ()),
+            'priority': (('priority',), ()),
+            'user_reports': ((), ('user_reports',)),
+            'mri_reports': ((), ('mri_reports',)),
+            'alerts': ((), ('alerts',)),
+            'appointments': ((), (
+                Prefetch('appointments', queryset=Appointment.objects.select_related('doctor__hospital', 'hospital')),
+            )),
+            'surgery_reports': ((), (patient_surgeries,)),
+            'surgeries': ((), (patient_surgeries, Prefetch(
+                'donor_matches', queryset=cls.surgery_matches(), to_attr='surgery_matches_as_donor'
+            ))),
+        }
+
+    @classmethod
+    def setup_eager_loading(cls, queryset, fields=None, expand=None):
+        """
+        Apply the select_related / Prefetch set the method fields of the
+        requested shape read from, so serializing a page costs a fixed
+        number of queries.
+        """
+        select, prefetch = set(), {}
+        loading = cls.field_loading()
+        for name in cls.kept_fields(cls.Meta.fields, fields, expand):
+            related, lookups = loading.get(name, ((), ()))
+            select.update(related)
+            for lookup in lookups:
+                prefetch.setdefault(getattr(lookup, 'prefetch_to', lookup), lookup)
+        return queryset.select_related(*sorted(select)).prefetch_related(*prefetch.values())
+
+    def _surgery_matches(self, obj, side):
+        # من غير prefetch (create / update مثلاً) ← نفس الشكل بـ query واحدة
+        matches = getattr(obj, f'surgery_matches_as_{side}', None)
+        if matches is None:
+            matches = self.surgery_matches().filter(**{side: obj})
+        return matches
 
     def get_full_name(self, obj):
         return f"{obj.first_name} {obj.last_name}"
@@ -148,24 +214,18 @@ class UserSerializer(serializers.ModelSerializer):
         return None
 
     def get_chronic_diseases(self, obj):
-        if obj.role == 'patient' and hasattr(obj, 'patient_profile'):
-            return [
-                {"name": uc.disease.name, "severity": uc.severity} 
-                for uc in obj.chronic_diseases.all()
-            ]
-        elif obj.role == 'donor' and hasattr(obj, 'donor_profile'):
+        if (obj.role == 'patient' and hasattr(obj, 'patient_profile')) or \
+                (obj.role == 'donor' and hasattr(obj, 'donor_profile')):
             return [
-                {"name": uc.disease.name, "severity": uc.severity} 
+                {"name": uc.disease.name, "severity": uc.severity}
                 for uc in obj.chronic_diseases.all()
             ]
         return []
 
     def get_hospital_detail(self, obj):
         if hasattr(obj, 'patient_profile') and obj.role == 'patient' and obj.hospital:
-            from .serializers import HospitalSerializer
             return HospitalSerializer(obj.hospital).data
         elif hasattr(obj, 'donor_profile') and obj.role == 'donor' and obj.hospital:
-            from .serializers import HospitalSerializer
             return HospitalSerializer(obj.hospital).data
         return None
 
@@ -173,7 +233,6 @@ class UserSerializer(serializers.ModelSerializer):
     # access from User مباشرة
         if obj.role == 'patient':
             if obj.supervisor_doctor:
-                from .serializers import DoctorSerializer
                 return DoctorSerializer(obj.supervisor_doctor).data
             
             return None
@@ -186,68 +245,46 @@ class UserSerializer(serializers.ModelSerializer):
         if obj.role == 'donor' and hasattr(obj, 'donor_profile'):
             return obj.donor_profile.organ_available
         return None
+
+    # الـ .all() بيقرا من الـ prefetch cache لو موجود
     def get_user_reports(self, obj):
-        from .serializers import UserReportSerializer
-        qs = UserReport.objects.filter(patient=obj)
-        return UserReportSerializer(qs, many=True).data
+        return UserReportSerializer(obj.user_reports.all(), many=True).data
     
     def get_appointments(self, obj):
-        from .serializers import AppointmentSerializer
-        qs = Appointment.objects.filter(patient=obj).select_related('doctor', 'hospital')
-        return AppointmentSerializer(qs, many=True).data
+        return AppointmentSerializer(obj.appointments.all(), many=True).data
 
 
     def get_mri_reports(self, obj):
-        from .serializers import MRIReportSerializer
-        qs = MRIReport.objects.filter(patient=obj)
-        return MRIReportSerializer(qs, many=True).data
+        return MRIReportSerializer(obj.mri_reports.all(), many=True).data
 
 
     def get_surgery_reports(self, obj):
-        from .serializers import SurgeryReportSerializer
-        qs = SurgeryReport.objects.filter(surgery__organ_matching__patient=obj)\
-                                .select_related('surgery', 'surgery__doctor', 'surgery__hospital')
-        return SurgeryReportSerializer(qs, many=True).data
+        reports = [
+            match.surgery.report for match in self._surgery_matches(obj, 'patient')
+            if hasattr(match.surgery, 'report')
+        ]
+        reports.sort(key=lambda report: report.id)
+        return SurgeryReportSerializer(reports, many=True).data
 
 
     def get_priority(self, obj):
-        from .serializers import PatientPrioritySerializer
         try:
-            priority = PatientPriority.objects.select_related('patient').get(patient=obj)
-            return PatientPrioritySerializer(priority).data
+            return PatientPrioritySerializer(obj.priority).data
         except PatientPriority.DoesNotExist:
             return None
 
 
     def get_alerts(self, obj):
-        from .serializers import AlertSerializer
-        qs = Alert.objects.filter(user=obj)
-        return AlertSerializer(qs, many=True).data
+        return AlertSerializer(obj.alerts.all(), many=True).data
         
     def get_surgeries(self, obj):
-        from .serializers import SurgerySerializer
-
-        if obj.role == 'patient':
-            qs = Surgery.objects.filter(
-                organ_matching__patient=obj
-            ).select_related(
-                'doctor', 'hospital', 'organ_matching'
-            ).order_by('-scheduled_date')  # آخر عملية
-
-        elif obj.role == 'donor':
-            qs = Surgery.objects.filter(
-                organ_matching__donor=obj
-            ).select_related(
-                'doctor', 'hospital', 'organ_matching'
-            ).order_by('-scheduled_date')  # آخر عملية
-
-        else:
+        if obj.role not in ('patient', 'donor'):
             return None
 
-    # ترجع العملية الأولى فقط بدل كل العمليات
-        latest_surgery = qs.first()
-        if latest_surgery:
-            return SurgerySerializer(latest_surgery).data
+    # ترجع العملية الأولى فقط بدل كل العمليات (آخر عملية)
+        surgeries = [match.surgery for match in self._surgery_matches(obj, obj.role)]
+        if surgeries:
+            return SurgerySerializer(max(surgeries, key=lambda surgery: surgery.scheduled_date)).data
         return None
 
 # ==========================
@@ -316,7 +353,7 @@ class HospitalUserMiniSerializer(serializers.ModelSerializer):
 #         return obj.users.filter(role='donor').count()
 
 
-class HospitalFullSerializer(serializers.ModelSerializer):
+class HospitalFullSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     patients = serializers.SerializerMethodField()
     donors = serializers.SerializerMethodField()
     patients_count = serializers.SerializerMethodField()
@@ -343,102 +380,122 @@ class HospitalFullSerializer(serializers.ModelSerializer):
             'ongoing_surgeries_count', 'completed_surgeries_count', 'under_review_surgeries_count', 'alerts_hospitals',
             'matches' ,'surgeries'
         ]
+        expandable_fields = {
+            name: () for name in ('patients', 'donors', 'alerts_hospitals', 'matches', 'surgeries')
+        }
+
+    @classmethod
+    def setup_eager_loading(cls, queryset, fields=None, expand=None):
+        """
+        Counts as annotations of the hospital query, and the nested users,
+        matches, surgeries and alerts of the requested shape prefetched once
+        for the whole page.
+        """
+        kept = set(cls.kept_fields(cls.Meta.fields, fields, expand))
+        prefetch = []
+        if kept & {'patients', 'donors', 'matches'}:
+            users = UserSerializer.setup_eager_loading(User.objects.all()).prefetch_related(
+                Prefetch('patient_matches', queryset=OrganMatching.objects.select_related('patient', 'donor'),
+                         to_attr='all_patient_matches'),
+                Prefetch('donor_matches', queryset=OrganMatching.objects.select_related('patient', 'donor'),
+                         to_attr='all_donor_matches'),
+            )
+            prefetch.append(Prefetch('users', queryset=users, to_attr='hospital_users'))
+        if 'surgeries' in kept:
+            surgeries = Surgery.objects.select_related(
+                'organ_matching__patient', 'organ_matching__donor', 'doctor__hospital', 'hospital'
+            )
+            prefetch.append(Prefetch('surgery_set', queryset=surgeries, to_attr='hospital_surgeries'))
+        if 'alerts_hospitals' in kept:
+            prefetch.append(Prefetch('alerthospital_set', queryset=AlertHospital.objects.select_related('hospital'),
+                                     to_attr='hospital_alerts'))
+        return queryset.with_dashboard_counts().prefetch_related(*prefetch)
+
+    def _prefetched(self, obj, attr):
+        # object من غير setup_eager_loading (create / update) ← نحمله مرة واحدة بنفس الشكل
+        if not hasattr(obj, attr):
+            loaded = self.setup_eager_loading(Hospital.objects.filter(pk=obj.pk)).get()
+            for name in (*HOSPITAL_COUNTS, 'hospital_users', 'hospital_surgeries', 'hospital_alerts'):
+                setattr(obj, name, getattr(loaded, name))
+        return getattr(obj, attr)
+
+    def _users(self, obj, role):
+        return [user for user in self._prefetched(obj, 'hospital_users') if user.role == role]
 
     # get كل الـ matches لكل المرضى والمانحين في المستشفى
 
     def get_matches(self, obj):
-        matches = OrganMatching.objects.filter(
-            patient__hospital=obj
-        )
+        matches = [match for user in self._prefetched(obj, 'hospital_users') for match in user.all_patient_matches]
+        # match_percentage ممكن يبقى NULL ← آخر الليستة زي ORDER BY ... DESC
+        matches.sort(key=lambda match: (match.match_percentage is None, -(match.match_percentage or 0)))
         return OrganMatchingSerializer(matches, many=True).data
     
     # get كل الـ surgeries لكل المرضى والمانحين في المستشفى
     def get_surgeries(self, obj):
-        surgeries = Surgery.objects.filter(
-            hospital=obj
-        )
-        return SurgerySerializer(surgeries, many=True).data
+        return SurgerySerializer(self._prefetched(obj, 'hospital_surgeries'), many=True).data
     
     # all surgeries for all patients and donors in the hospital
     def get_total_surgeries(self, obj):
-        return Surgery.objects.filter(
-            hospital=obj
-        ).count()
+        return self._prefetched(obj, 'total_surgeries')
 
 
     def get_alerts_hospitals(self, obj):
-        alerts = AlertHospital.objects.filter(hospital=obj)
-        return AlertHospitalSerializer(alerts, many=True).data
+        return AlertHospitalSerializer(self._prefetched(obj, 'hospital_alerts'), many=True).data
 
     def get_patients(self, obj):
-        qs = obj.users.filter(role='patient')
         data = []
-        for patient in qs:
-            patient_data = UserSerializer(patient).data  # كل بيانات المريض
+        for patient in self._users(obj, 'patient'):
+            patient_data = UserSerializer(patient).data  # كل بيانات المريض (فيها الأولوية والتنبيهات)
             # كل العمليات الجراحية للمريض
-            surgeries = Surgery.objects.filter(organ_matching__patient=patient)
+            surgeries = sorted(
+                (match.surgery for match in patient.surgery_matches_as_patient), key=lambda surgery: surgery.id
+            )
             patient_data['surgeries'] = SurgerySerializer(surgeries, many=True).data
             # كل المطابقات (match)
-            matches = OrganMatching.objects.filter(patient=patient)
-            patient_data['matches'] = OrganMatchingSerializer(matches, many=True).data
-            # أولوية المريض
-            try:
-                priority = PatientPriority.objects.get(patient=patient)
-                patient_data['priority'] = PatientPrioritySerializer(priority).data
-            except PatientPriority.DoesNotExist:
-                patient_data['priority'] = None
-            # التنبيهات
-            alerts = Alert.objects.filter(user=patient)
-            patient_data['alerts'] = AlertSerializer(alerts, many=True).data
+            patient_data['matches'] = OrganMatchingSerializer(patient.all_patient_matches, many=True).data
             data.append(patient_data)
         return data
 
     def get_donors(self, obj):
-        qs = obj.users.filter(role='donor')
         data = []
-        for donor in qs:
-            donor_data = UserSerializer(donor).data  # كل بيانات المتبرع
+        for donor in self._users(obj, 'donor'):
+            donor_data = UserSerializer(donor).data  # كل بيانات المتبرع (فيها التنبيهات)
             # كل المطابقات (match)
-            matches = OrganMatching.objects.filter(donor=donor)
-            donor_data['matches'] = OrganMatchingSerializer(matches, many=True).data
-            # التنبيهات
-            alerts = Alert.objects.filter(user=donor)
-            donor_data['alerts'] = AlertSerializer(alerts, many=True).data
+            donor_data['matches'] = OrganMatchingSerializer(donor.all_donor_matches, many=True).data
             data.append(donor_data)
         return data
 
     def get_patients_count(self, obj):
-        return obj.users.filter(role='patient').count()
+        return self._prefetched(obj, 'patients_count')
 
     def get_donors_count(self, obj):
-        return obj.users.filter(role='donor').count()
+        return self._prefetched(obj, 'donors_count')
     def get_total_matches(self, obj):
         # عدد كل الـ matches لجميع المرضى والمانحين في المستشفى
-        return OrganMatching.objects.filter(
-            patient__hospital=obj
-        ).count()
+        return self._prefetched(obj, 'total_matches')
 
     def get_scheduled_surgeries_count(self, obj):
-        return Surgery.objects.filter(hospital=obj, status='مجدولة').count()
+        return self._prefetched(obj, 'scheduled_surgeries_count')
 
     def get_ongoing_surgeries_count(self, obj):
-        return Surgery.objects.filter(hospital=obj, status='جاريه').count()
+        return self._prefetched(obj, 'ongoing_surgeries_count')
 
     def get_completed_surgeries_count(self, obj):
-        return Surgery.objects.filter(hospital=obj, status='مكتملة').count()
+        return self._prefetched(obj, 'completed_surgeries_count')
 
     def get_under_review_surgeries_count(self, obj):
-        return Surgery.objects.filter(hospital=obj, status='تحت المتابعة').count()
+        return self._prefetched(obj, 'under_review_surgeries_count')
 
 
 
 
-class DoctorSerializer(serializers.ModelSerializer):
+class DoctorSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     hospital_detail = HospitalSerializer(source='hospital', read_only=True)
 
     class Meta:
         model = Doctor
         fields = ['id', 'name', 'specialty', 'phone', 'hospital', 'hospital_detail']
+        expandable_fields = {'hospital_detail': ('hospital',)}
     def validate_hospital(self, value):
         if not Hospital.objects.filter(id=value.id).exists():
             raise serializers.ValidationError("المستشفى دي غير موجودة")
@@ -454,13 +511,14 @@ class ChronicDiseaseSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
-class UserChronicDiseaseSerializer(serializers.ModelSerializer):
+class UserChronicDiseaseSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     disease_detail = ChronicDiseaseSerializer(source='disease', read_only=True)
     user_detail = UserMiniSerializer(source='user', read_only=True)
 
     class Meta:
         model = UserChronicDisease
         fields = ['id', 'user', 'user_detail', 'disease', 'disease_detail', 'severity']
+        expandable_fields = {'disease_detail': ('disease',), 'user_detail': ('user',)}
 
 
 # ==========================
@@ -538,7 +596,7 @@ class DonorMedicalProfileSerializer(serializers.ModelSerializer):
 
 # Appointment
 
-class AppointmentSerializer(serializers.ModelSerializer):
+class AppointmentSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     patient_detail = UserMiniSerializer(source='patient', read_only=True)
     doctor_detail = DoctorSerializer(source='doctor', read_only=True)
     hospital_detail = HospitalSerializer(source='hospital', read_only=True)
@@ -549,6 +607,9 @@ class AppointmentSerializer(serializers.ModelSerializer):
             'id', 'patient', 'patient_detail', 'doctor', 'doctor_detail',
             'hospital', 'hospital_detail', 'appointment_date', 'reason', 'status', 'created_at', 'appointment_time'
         ]
+        expandable_fields = {
+            'patient_detail': ('patient',), 'doctor_detail': ('doctor',), 'hospital_detail': ('hospital',),
+        }
     def get_patient_detail(self, obj):
         return {"id": obj.patient.id, "full_name": f"{obj.patient.first_name} {obj.patient.last_name}"}
 
@@ -602,7 +663,7 @@ class AppointmentSerializer(serializers.ModelSerializer):
 # ==========================
 # Organ & Matching
 # ==========================
-class OrganMatchingSerializer(serializers.ModelSerializer):
+class OrganMatchingSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     patient_detail = UserMiniSerializer(source='patient', read_only=True)
     donor_detail = UserMiniSerializer(source='donor', read_only=True)
     hla_mismatch_count = serializers.IntegerField(read_only=True)
@@ -615,16 +676,32 @@ class OrganMatchingSerializer(serializers.ModelSerializer):
             'ai_result', 'status', 'created_at'
         ]
         read_only_fields = ['hla_mismatch_count', 'match_percentage', 'ai_result', 'created_at']
+        expandable_fields = {'patient_detail': ('patient',), 'donor_detail': ('donor',)}
     def get_patient_detail(self, obj):
          return {"id": obj.patient.id, "full_name": f"{obj.patient.first_name} {obj.patient.last_name}"}
 
     def get_donor_detail(self, obj):
         return {"id": obj.donor.id, "full_name": f"{obj.donor.first_name} {obj.donor.last_name}"}
 
+
+class ExchangePairSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    patient_detail = UserMiniSerializer(source='patient', read_only=True)
+    donor_detail = UserMiniSerializer(source='donor', read_only=True)
+    is_altruistic = serializers.BooleanField(read_only=True)
+
+    class Meta:
+        model = ExchangePair
+        fields = [
+            'id', 'patient', 'patient_detail', 'donor', 'donor_detail',
+            'organ_type', 'is_altruistic', 'is_active', 'created_at'
+        ]
+        read_only_fields = ['created_at']
+        expandable_fields = {'patient_detail': ('patient',), 'donor_detail': ('donor',)}
+
 # ==========================
 # Surgery
 # ==========================
-class SurgerySerializer(serializers.ModelSerializer):
+class SurgerySerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     organ_matching_detail = OrganMatchingSerializer(source='organ_matching', read_only=True)
     doctor_detail = DoctorSerializer(source='doctor', read_only=True)
     hospital_detail = HospitalSerializer(source='hospital', read_only=True)
@@ -639,30 +716,35 @@ class SurgerySerializer(serializers.ModelSerializer):
             'operation_room','surgery_name','department',
             
         ]
+        expandable_fields = {
+            'organ_matching_detail': ('organ_matching',), 'doctor_detail': ('doctor',), 'hospital_detail': ('hospital',),
+        }
 
 
 # ==========================
 # MRI Reports
 # ==========================
-class MRIReportSerializer(serializers.ModelSerializer):
+class MRIReportSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     patient_detail = UserMiniSerializer(source='patient', read_only=True)
 
     class Meta:
         model = MRIReport
         fields = ['id', 'patient', 'patient_detail', 'before_scan', 'after_scan',
                   'ai_result', 'mismatch_alert', 'created_at']
+        expandable_fields = {'patient_detail': ('patient',)}
 
 
 # ==========================
 # Patient Priority
 # ==========================
-class PatientPrioritySerializer(serializers.ModelSerializer):
+class PatientPrioritySerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     patient_detail = serializers.SerializerMethodField()
     
 
     class Meta:
         model = PatientPriority
         fields = ['id', 'patient', 'patient_detail', 'score', 'level', 'updated_at']
+        expandable_fields = {'patient_detail': ('patient',)}
 
     def get_patient_detail(self, obj):
         return {"id": obj.patient.id, "full_name": f"{obj.patient.first_name} {obj.patient.last_name}"}
@@ -671,12 +753,13 @@ class PatientPrioritySerializer(serializers.ModelSerializer):
 # ==========================
 # Alerts
 # ==========================
-class AlertSerializer(serializers.ModelSerializer):
+class AlertSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     user_detail = UserMiniSerializer(source='user', read_only=True)
 
     class Meta:
         model = Alert
         fields = ['id', 'user', 'user_detail', 'message','message_title', 'alert_type', 'read', 'created_at' ,]
+        expandable_fields = {'user_detail': ('user',)}
 
     def get_user_detail(self, obj):
         return {"id": obj.user.id, "full_name": f"{obj.user.first_name} {obj.user.last_name}"}
@@ -694,7 +777,7 @@ class AlertHospitalSerializer(serializers.ModelSerializer):
 
 
 
-class UserReportSerializer(serializers.ModelSerializer):
+class UserReportSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     patient_detail = serializers.SerializerMethodField()
 
     class Meta:
@@ -703,6 +786,7 @@ class UserReportSerializer(serializers.ModelSerializer):
             'id', 'patient', 'patient_detail', 'report_type',
             'report_file', 'description', 'created_at' ,'state'
         ]
+        expandable_fields = {'patient_detail': ('patient',)}
 
     def get_patient_detail(self, obj):
         if obj.patient:
@@ -806,6 +890,41 @@ class SurgeryReportSerializer(serializers.ModelSerializer):
 
 
 
+# ==========================
+# Background Jobs
+# ==========================
+class JobSerializer(serializers.ModelSerializer):
+    progress = serializers.FloatField(read_only=True)
+    duration = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = Job
+        fields = [
+            'id', 'kind', 'params', 'status', 'progress', 'processed', 'total',
+            'rows_written', 'result', 'error', 'duration',
+            'created_at', 'started_at', 'finished_at',
+        ]
+        read_only_fields = [
+            'status', 'processed', 'total', 'rows_written', 'result', 'error',
+            'created_at', 'started_at', 'finished_at',
+        ]
+
+    def validate_kind(self, value):
+        from .jobs import JOB_HANDLERS
+        if value not in JOB_HANDLERS:
+            raise serializers.ValidationError(f"Unknown job kind: {value}")
+        return value
+
+    def validate(self, attrs):
+        # الـ params لازم تتطابق مع الـ handler دلوقتي، مش لما الـ worker يشغله ويفشل
+        from .jobs import check_params
+        try:
+            check_params(attrs['kind'], attrs.get('params') or {})
+        except ValueError as exc:
+            raise serializers.ValidationError({'params': str(exc)})
+        return attrs
+
+
 # serializers.py
 
 
@@ -3,34 +3,17 @@ from django.db.models.signals import post_save, pre_save, m2m_changed
 from django.dispatch import receiver
 from .models import (
     User, PatientMedicalProfile, DonorMedicalProfile,
-    PatientPriority, VitalSign, Alert, OrganMatching
+    VitalSign, OrganMatching
 )
+from .outbox import full_name, publish
+from .priority import VITAL_SIGN_LEVELS, adjust_priority, calculate_priorities
 
 # ==========================
 # 1️⃣ Patient Priority Helper
 # ==========================
 def calculate_patient_priority(patient):
-    score = 0
-    if patient.chronic_diseases.exists():
-        score += patient.chronic_diseases.count() * 10
-    if hasattr(patient, 'patient_profile') and patient.patient_profile.organ_needed:
-        score += 20
-
-    level = 'low'
-    if score >= 50:
-        level = 'critical'
-    elif score >= 30:
-        level = 'high'
-    elif score >= 10:
-        level = 'medium'
-
-    priority, created = PatientPriority.objects.get_or_create(
-        patient=patient, defaults={"score": score, "level": level}
-    )
-    if not created:
-        priority.score = score
-        priority.level = level
-        priority.save()
+    # نفس الحساب الـ set-based بتاع calculate_priorities على patient واحد
+    calculate_priorities(User.objects.filter(pk=patient.pk), details=False)
 
 
 # ==========================
@@ -80,40 +63,30 @@ def vital_sign_alert_and_priority(sender, instance, created, **kwargs):
         alerts.append("ارتفاع ضغط الدم")
         score_delta += 10
 
+    # الـ Alert نفسه بيتعمل من الـ outbox (manage.py dispatch_outbox)؛ الـ receiver ده بيشتغل
+    # بعد ما الـ VitalSign اتعمله commit، فاللي بيعمل الـ VitalSign لازم يعمله جوه transaction.atomic
     if alerts:
-        Alert.objects.create(
-            user=patient,
-            message="تحذير بعد العملية: " + "، ".join(alerts),
-            alert_type="critical" if critical else "medical"
-        )
-
-    # تحديث Patient Priority
-    priority, _ = PatientPriority.objects.get_or_create(
-        patient=patient, defaults={"score": 0, "level": "low"}
-    )
-    priority.score += score_delta
-    if priority.score >= 70:
-        priority.level = "critical"
-    elif priority.score >= 40:
-        priority.level = "high"
-    elif priority.score >= 20:
-        priority.level = "medium"
-    else:
-        priority.level = "low"
-    priority.save()
+        publish('vital_sign_breach', patient_id=patient.pk, alerts=alerts, critical=critical)
+
+    # تحديث Patient Priority (UPDATE واحد بـ F() ← مفيش زيادات بتضيع مع التزامن)
+    adjust_priority(patient, score_delta, VITAL_SIGN_LEVELS)
 
 
 # ==========================
 # 3️⃣ Smart OrganMatching Signal
 # ==========================
 @receiver(post_save, sender=OrganMatching)
-def smart_match_status_handler(sender, instance, **kwargs):
+def smart_match_status_handler(sender, instance, created=False, **kwargs):
     """
     إدارة ذكية لكل تغييرات الـ Match:
     - التأكيد → تحديث حالات + Alerts
     - الإلغاء → إعادة الحالة + Alerts
     - تعديل → تحديث Alerts
     """
+    # مفيش تغيير حقيقي في الـ status أو الـ score ← مفيش profiles ولا alerts
+    if not created and not instance.needs_notification:
+        return
+
     patient = instance.patient
     donor = instance.donor
     hospital = getattr(patient, 'hospital', None)
@@ -125,25 +98,16 @@ def smart_match_status_handler(sender, instance, **kwargs):
     if instance.status == 'match_confirmed':
         patient_status = 'تأكيد'
         donor_status = 'محجوز'
-        patient_alert = f"تم تأكيد حالتك بعد الحصول على Match للعضو: {instance.organ_type}"
-        donor_alert = f"تم تأكيد عملية التبرع للعضو: {instance.organ_type}"
-        hospital_alert = f"تم تأكيد Match للعضو {instance.organ_type} بين المريض {patient.first_name} {patient.last_name} والمتبرع {donor.first_name} {donor.last_name}"
-        alert_type = 'medical'
+        event = 'match_confirmed'
 
     elif instance.status == 'match_cancelled':
         patient_status = 'قيد الانتظار'
         donor_status = 'قيد الانتظار'
-        patient_alert = f"تم إلغاء Match للعضو: {instance.organ_type}"
-        donor_alert = f"تم إلغاء Match للعضو: {instance.organ_type}"
-        hospital_alert = f"تم إلغاء Match للعضو {instance.organ_type} بين المريض {patient.first_name} {patient.last_name} والمتبرع {donor.first_name} {donor.last_name}"
-        alert_type = 'warning'
+        event = 'match_cancelled'
 
     else:
         # أي حالة أخرى → تحديث Alerts فقط
-        patient_alert = f"تم تعديل Match للعضو: {instance.organ_type}"
-        donor_alert = f"تم تعديل Match للعضو: {instance.organ_type}"
-        hospital_alert = f"تم تعديل Match للعضو {instance.organ_type} بين المريض {patient.first_name} {patient.last_name} والمتبرع {donor.first_name} {donor.last_name}"
-        alert_type = 'info'
+        event = 'match_updated'
 
     # تحديث المريض
     try:
@@ -161,8 +125,14 @@ def smart_match_status_handler(sender, instance, **kwargs):
     except DonorMedicalProfile.DoesNotExist:
         pass
 
-    # إرسال Alerts
-    Alert.objects.create(user=patient, message=patient_alert, alert_type=alert_type)
-    Alert.objects.create(user=donor, message=donor_alert, alert_type=alert_type)
-    if hospital:
-        Alert.objects.create(hospital=hospital, message=hospital_alert, alert_type='hospital')
+    # الـ Alerts بتتعمل من الـ outbox (manage.py dispatch_outbox)؛ OrganMatching.save بيفتح
+    # transaction.atomic فالـ event بيتكتب مع تغيير الـ status أو بيترجعوا مع بعض
+    publish(
+        event,
+        patient_id=patient.pk,
+        donor_id=donor.pk,
+        hospital_id=hospital.pk if hospital else None,
+        organ_type=instance.organ_type,
+        patient_name=full_name(patient),
+        donor_name=full_name(donor),
+    )
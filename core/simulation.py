@@ -0,0 +1,199 @@
+import datetime
+import time
+
+import numpy as np
+
+from .match_kernels import ages_at
+from .matching import (
+    BLOOD_TYPES, HLA_FIELDS, BlockingIndex, HLAEncoder, code_of, iter_results, load_blocked_cohorts,
+    matching_setting, today_days, to_days,
+)
+from .models import HLAAllele, OrganMatching
+from .scoring import DEFAULT_RULES, compile_rules, parse_rule_spec
+
+
+# الحقول اللي ممكن تتغير في الـ what-if (نفس أسامي User)
+OVERRIDE_FIELDS = (*HLA_FIELDS, 'blood_type', 'bmi', 'PRA', 'CMV_status', 'EBV_status', 'birthdate', 'organ')
+
+
+# ==========================
+# Overrides
+# ==========================
+def apply_overrides(cohort, role, overrides, encoder):
+    """
+    Return (cohort, {user_id: index}) with `overrides` applied to a private
+    copy of the cohort; the cached cohort itself is never modified.
+    """
+    positions = {user_id: index for index, user_id in enumerate(cohort.ids.tolist()) if user_id in overrides}
+    if not positions:
+        return cohort, positions
+    cohort = cohort.subset(np.arange(len(cohort)))
+    for user_id, index in positions.items():
+        for field, value in overrides[user_id].items():
+            if field in HLA_FIELDS:
+                cohort.hla[index, HLA_FIELDS.index(field)] = encoder.encode(value)
+            elif field == 'blood_type':
+                if value not in BLOOD_TYPES:
+                    raise ValueError(f"Unknown blood type for user {user_id}: {value}")
+                cohort.blood_types[index] = value
+                cohort.blood_codes[index] = code_of(BLOOD_TYPES, value)
+            elif field == 'bmi':
+                cohort.bmi[index] = np.nan if value is None else float(value)
+                cohort.eligible[index] = cohort.is_eligible(role, value)
+            elif field == 'PRA':
+                cohort.pra[index] = np.nan if value is None else float(value)
+            elif field == 'CMV_status':
+                cohort.cmv[index] = bool(value)
+            elif field == 'EBV_status':
+                cohort.ebv[index] = bool(value)
+            elif field == 'birthdate':
+                birthdate = datetime.date.fromisoformat(value) if value else None
+                cohort.age[index] = ages_at(np.array([to_days(birthdate)], dtype=np.int32), today_days())[0]
+            elif field == 'organ':
+                cohort.organs[index] = value or 'N/A'
+            else:
+                raise ValueError(f"Unknown override field: {field}")
+    return cohort, positions
+
+
+def simulated_rule_set(organ, rule_overrides):
+    """
+    The rule set configured for `organ` with `rule_overrides` applied:
+    {name: {params}} changes or adds a rule, {name: None} drops it.
+    """
+    configured = matching_setting('SCORING_RULES')
+    spec = [parse_rule_spec(entry) for entry in configured.get(organ, configured.get('default', DEFAULT_RULES))]
+    names = [name for name, _ in spec]
+    spec += [(name, {}) for name in rule_overrides if name not in names and rule_overrides[name] is not None]
+    return compile_rules([
+        (name, {**params, **(rule_overrides.get(name) or {})})
+        for name, params in spec
+        if not (name in rule_overrides and rule_overrides[name] is None)
+    ])
+
+
+# ==========================
+# What-if run
+# ==========================
+def block_parts(patients, donors, patient_indices, donor_indices, scope, changed_patients, changed_donors):
+    """
+    (patient_indices, donor_indices, ranked) parts of one block to score:
+    the requested patients, else the rows of changed patients plus the
+    columns of changed donors, else the whole block.
+    """
+    if scope is not None:
+        return [(patient_indices[np.isin(patients.ids[patient_indices], scope)], donor_indices, True)]
+    if changed_patients or changed_donors:
+        rows = np.isin(patients.ids[patient_indices], list(changed_patients))
+        columns = np.isin(donors.ids[donor_indices], list(changed_donors))
+        return [
+            (patient_indices[rows], donor_indices, True),
+            (patient_indices[~rows], donor_indices[columns], False),
+        ]
+    return [(patient_indices, donor_indices, True)]
+
+
+def stored_scores(pairs):
+    if not pairs:
+        return {}
+    rows = OrganMatching.objects.filter(
+        patient_id__in={p for p, _, _ in pairs}, donor_id__in={d for _, d, _ in pairs},
+    ).values_list('patient_id', 'donor_id', 'organ_type', 'match_percentage')
+    return {row[:3]: row[3] for row in rows}
+
+
+def simulate(overrides=None, rules=None, patient_ids=None, k=None):
+    """
+    Run the matching and ranking pipeline on an in-memory copy of the cohort
+    with user `overrides` ({user_id: {field: value}}) and scoring `rules`
+    overrides, and diff the result against the stored matches. Nothing is
+    written: no OrganMatching rows, no alerts, no snapshot rebuild.
+    """
+    started = time.perf_counter()
+    overrides = {int(user_id): values for user_id, values in (overrides or {}).items()}
+    rule_overrides = rules or {}
+    unknown_fields = {f for values in overrides.values() for f in values} - set(OVERRIDE_FIELDS)
+    if unknown_fields:
+        raise ValueError(f"Unknown override fields: {', '.join(sorted(unknown_fields))}")
+
+    patients, donors, index = load_blocked_cohorts(read_only=True)
+    encoder = HLAEncoder(HLAAllele.code_map)
+    patients, changed_patients = apply_overrides(patients, 'patient', overrides, encoder)
+    donors, changed_donors = apply_overrides(donors, 'donor', overrides, encoder)
+    missing = set(overrides) - set(changed_patients) - set(changed_donors)
+    if missing:
+        raise ValueError(f"Not approved patients or donors: {', '.join(map(str, sorted(missing)))}")
+    if changed_patients or changed_donors:
+        index = BlockingIndex(patients, donors)
+
+    scope = np.asarray(patient_ids, dtype=np.int64) if patient_ids else None
+    rule_sets = {}
+    matches = {}
+    for organ, _, patient_indices, donor_indices in index:
+        if organ not in rule_sets:
+            rule_sets[organ] = simulated_rule_set(organ, rule_overrides)
+        parts = block_parts(
+            patients, donors, patient_indices, donor_indices, scope, changed_patients, changed_donors
+        )
+        for part_patients, part_donors, ranked in parts:
+            if not len(part_patients) or not len(part_donors):
+                continue
+            block_patients = patients.subset(part_patients)
+            block_donors = donors.subset(part_donors)
+            results = iter_results(block_patients, block_donors, k=k if ranked else None, rules=rule_sets[organ])
+            for i, j, result in results:
+                matches.setdefault((int(block_patients.ids[i]), block_patients.labels[i], organ), []).append({
+                    "donor_id": int(block_donors.ids[j]),
+                    "donor": block_donors.labels[j],
+                    "match_percentage": result['match_percentage'],
+                    "hla_mismatch_count": result['hla_mismatch_count'],
+                    "rules": result['ai_result']['rules'],
+                })
+
+    pairs = {(p, m['donor_id'], organ) for (p, _, organ), rows in matches.items() for m in rows}
+    stored = stored_scores(pairs)
+    results, diffs = [], []
+    for (patient_id, label, organ), rows in sorted(matches.items()):
+        rows.sort(key=lambda m: (-m['match_percentage'], m['donor_id']))
+        for rank, match in enumerate(rows[:k] if k else rows, start=1):
+            before = stored.get((patient_id, match['donor_id'], organ))
+            match['rank'] = rank
+            match['stored_percentage'] = before
+            if before != match['match_percentage']:
+                diffs.append({
+                    "patient_id": patient_id, "donor_id": match['donor_id'], "organ_type": organ,
+                    "stored": before, "simulated": match['match_percentage'],
+                    "delta": None if before is None else match['match_percentage'] - before,
+                    "change": "new" if before is None else "changed",
+                })
+        results.append({
+            "patient_id": patient_id, "patient": label, "organ_type": organ, "matches": rows[:k] if k else rows,
+        })
+
+    # pairs متخزنة للـ users اللي اتغيروا ومبقتش متوافقة (من غير k ولا scope، عشان دول بيقصوا النتيجة)
+    if (changed_patients or changed_donors) and not k and scope is None:
+        removed = OrganMatching.objects.filter(
+            patient_id__in=list(changed_patients)
+        ) | OrganMatching.objects.filter(donor_id__in=list(changed_donors))
+        for patient_id, donor_id, organ, before in removed.values_list(
+            'patient_id', 'donor_id', 'organ_type', 'match_percentage'
+        ):
+            if (patient_id, donor_id, organ) not in pairs:
+                diffs.append({
+                    "patient_id": patient_id, "donor_id": donor_id, "organ_type": organ,
+                    "stored": before, "simulated": None, "delta": None, "change": "removed",
+                })
+
+    return {
+        "results": results,
+        "diffs": diffs,
+        "summary": {
+            "patients": len(results),
+            "pairs": len(pairs),
+            "new": sum(1 for d in diffs if d['change'] == 'new'),
+            "changed": sum(1 for d in diffs if d['change'] == 'changed'),
+            "removed": sum(1 for d in diffs if d['change'] == 'removed'),
+            "rules": {organ: list(rule_set.names) for organ, rule_set in rule_sets.items()},
+            "elapsed": round(time.perf_counter() - started, 6),
+        },
+    }
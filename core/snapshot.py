@@ -0,0 +1,131 @@
+# Binary cohort snapshot: a header plus fixed-width records sorted by id, read through np.memmap.
+import os
+import shutil
+import struct
+import tempfile
+from contextlib import contextmanager
+
+import numpy as np
+
+
+SNAPSHOT_MAGIC = b'OMSNAP'
+SNAPSHOT_VERSION = 2
+
+# magic, version, record count, watermark (updated_at, epoch µs), source user count
+HEADER_FORMAT = '<6sHQqQ'
+HEADER_SIZE = 64
+
+SNAPSHOT_DTYPE = np.dtype([
+    ('id', '<i8'),
+    ('role', 'u1'),
+    ('status', 'u1'),
+    ('blood_type', 'u1'),
+    ('organ', 'u1'),
+    ('hla', '<u2', (6,)),
+    ('bmi', '<f8'),
+    ('pra', '<f4'),
+    ('cmv', '?'),
+    ('ebv', '?'),
+    # تاريخ الميلاد كأيام من 1970 (للـ age rule)
+    ('birth', '<i4'),
+])
+
+# قيمة مش معروفة في أي عمود من الـ code columns
+UNKNOWN = 255
+NO_BIRTHDATE = np.iinfo(np.int32).min
+ROLES = ('patient', 'donor')
+
+
+class SnapshotFile:
+    def __init__(self, path, records, count, watermark, source_count):
+        self.path = path
+        self.records = records
+        self.count = count
+        self.watermark = watermark
+        self.source_count = source_count
+
+    @property
+    def offset(self):
+        return HEADER_SIZE
+
+
+def read_header(path):
+    with open(path, 'rb') as handle:
+        header = handle.read(HEADER_SIZE)
+    if len(header) < HEADER_SIZE:
+        return None
+    magic, version, count, watermark, source_count = struct.unpack_from(HEADER_FORMAT, header)
+    if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+        return None
+    return count, watermark, source_count
+
+
+def open_snapshot(path):
+    """Open a snapshot read-only, or return None if it is missing or from another version."""
+    if not os.path.exists(path):
+        return None
+    header = read_header(path)
+    if header is None:
+        return None
+    count, watermark, source_count = header
+    if count:
+        records = np.memmap(path, dtype=SNAPSHOT_DTYPE, mode='r', offset=HEADER_SIZE, shape=(count,))
+    else:
+        records = np.zeros(0, dtype=SNAPSHOT_DTYPE)
+    return SnapshotFile(path, records, count, watermark, source_count)
+
+
+def write_snapshot(path, records, watermark, source_count):
+    """
+    Write records to a temporary file and atomically rename it over `path`.
+    Processes that still map the old file keep a valid view of it.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    header = struct.pack(HEADER_FORMAT, SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(records), watermark, source_count)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.snapshot-')
+    try:
+        with os.fdopen(fd, 'wb') as handle:
+            handle.write(header.ljust(HEADER_SIZE, b'\0'))
+            handle.write(np.ascontiguousarray(records, dtype=SNAPSHOT_DTYPE).tobytes())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+
+
+def merge_records(existing, changed, live_ids):
+    """
+    Replace/insert `changed` rows into `existing` and drop rows whose id is
+    no longer in `live_ids`. The result stays sorted by id.
+    """
+    keep = np.isin(existing['id'], changed['id'], invert=True) & np.isin(existing['id'], live_ids)
+    merged = np.concatenate([np.asarray(existing[keep]), changed])
+    return merged[np.argsort(merged['id'], kind='stable')]
+
+
+@contextmanager
+def pin_snapshot(path, watermark):
+    """
+    Yield a private hard link to the snapshot at `path`, or None if the file
+    no longer carries `watermark`. Workers open the link by name, so a
+    rebuild that replaces `path` mid-run cannot change the rows they read.
+    """
+    pinned = f"{path}.{os.getpid()}.pin"
+    try:
+        if os.path.exists(pinned):
+            os.unlink(pinned)
+        try:
+            os.link(path, pinned)
+        except OSError:
+            # filesystems من غير hard links
+            shutil.copyfile(path, pinned)
+    except OSError:
+        yield None
+        return
+    try:
+        header = read_header(pinned)
+        yield pinned if header and header[1] == watermark else None
+    finally:
+        os.unlink(pinned)
@@ -0,0 +1,131 @@
+import csv
+import json
+
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import BaseRenderer
+
+
+# صفوف الـ queryset اللي بتتقرا من الـ database في المرة الواحدة
+CHUNK_SIZE = 1000
+
+
+# ==========================
+# NDJSON streaming
+# ==========================
+def iter_ndjson(rows):
+    for row in rows:
+        yield json.dumps(row, ensure_ascii=False, default=str) + "\n"
+
+
+def ndjson_response(rows):
+    """Stream an iterable of dicts as newline-delimited JSON, one row at a time."""
+    return StreamingHttpResponse(iter_ndjson(rows), content_type='application/x-ndjson; charset=utf-8')
+
+
+# ==========================
+# CSV streaming
+# ==========================
+class EchoBuffer:
+    """File-like object for csv.writer that hands each line back instead of storing it."""
+
+    def write(self, value):
+        return value
+
+
+def csv_cell(value):
+    # الـ nested data (profiles, ai_result...) بتتكتب JSON جوه الخانة
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False, default=str)
+    return value
+
+
+def iter_csv(rows, fields=None):
+    """CSV lines for an iterable of dicts; the header comes from `fields` or the first row."""
+    writer = csv.writer(EchoBuffer())
+    rows = iter(rows)
+    if fields is None:
+        first = next(rows, None)
+        if first is None:
+            return
+        fields = list(first)
+        rows = _prepend(first, rows)
+    yield writer.writerow(fields)
+    for row in rows:
+        yield writer.writerow([csv_cell(row.get(field)) for field in fields])
+
+
+def _prepend(first, rows):
+    yield first
+    yield from rows
+
+
+def csv_response(rows, fields=None, filename=None):
+    response = StreamingHttpResponse(iter_csv(rows, fields), content_type='text/csv; charset=utf-8')
+    if filename:
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+# ==========================
+# ?format=ndjson / ?format=csv
+# ==========================
+class NDJSONRenderer(BaseRenderer):
+    # بيخلي الـ content negotiation يقبل ?format=ndjson؛ الـ streaming نفسه في stream_response
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        rows = data if isinstance(data, list) else [data]
+        return ''.join(iter_ndjson(rows)).encode(self.charset)
+
+
+class CSVRenderer(BaseRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        rows = data if isinstance(data, list) else [data]
+        return ''.join(iter_csv(rows)).encode(self.charset)
+
+
+STREAM_RENDERERS = [NDJSONRenderer, CSVRenderer]
+
+
+def stream_format(request):
+    """'ndjson' / 'csv' when the request asked for a streamed export, else None."""
+    fmt = request.query_params.get('format', '').lower()
+    return fmt if fmt in ('ndjson', 'csv') else None
+
+
+def serialize_rows(queryset, serializer_class, context=None, chunk_size=CHUNK_SIZE):
+    # row by row من الـ iterator عشان الـ memory متكبرش مع حجم النتيجة
+    for obj in queryset.iterator(chunk_size=chunk_size):
+        yield serializer_class(obj, context=context).data
+
+
+def stream_response(rows, fmt, fields=None, filename=None):
+    if fmt == 'csv':
+        return csv_response(rows, fields, filename)
+    return ndjson_response(rows)
+
+
+class StreamingListMixin:
+    """
+    `?format=ndjson` / `?format=csv` on list: the filtered queryset is
+    streamed unpaginated through the viewset's serializer, one row at a time.
+    """
+    streaming_chunk_size = CHUNK_SIZE
+
+    def get_renderers(self):
+        return super().get_renderers() + [renderer() for renderer in STREAM_RENDERERS]
+
+    def list(self, request, *args, **kwargs):
+        fmt = stream_format(request)
+        if fmt is None:
+            return super().list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset())
+        # get_serializer عشان الـ ?fields= / ?expand= تتطبق على الـ export كمان
+        rows = (self.get_serializer(obj).data for obj in queryset.iterator(chunk_size=self.streaming_chunk_size))
+        return stream_response(rows, fmt, filename=f"{self.basename}.csv")
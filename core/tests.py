@@ -1,3 +1,850 @@
-from django.test import TestCase
+import datetime
+import decimal
+import io
+import json
+import os
+import random
+import tempfile
+import threading
+import unittest
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models.signals import post_save
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from .jobs import JOB_HANDLERS, STALE_AFTER, claim_next_job, enqueue_job, run_job
+from .models import (
+    Alert, ChronicDisease, Doctor, DonorMedicalProfile, HLAAllele, Hospital, Job, OrganMatching, OrganType, OutboxEvent,
+    PatientMedicalProfile, PatientPriority, User, UserChronicDisease, UserReport,
+)
+from .allocation import AllocationProblem, allocate_organ, solve_greedy, solve_optimal
+from .exchange import CompatibilityGraph, find_cycles, plan_exchange
+from .fastpath import RowMapper
+from .matching import (
+    APPROVED_STATUS, BLOOD_TYPES, DEFAULT_MATCH_STATUS, ORGAN_TYPES, BlockingIndex, Cohort, HLAEncoder, MatchRun,
+    MatchWriter, blood_compatible, build_snapshot, cohort_fingerprint, iter_pair_results, load_blocked_cohorts,
+    refresh_snapshot, rematch_user, score_pair, snapshot_is_stale,
+)
+from .management.commands.bench_matching import rows_to_users, synthetic_rows
+from .management.commands.bench_serializers import ENDPOINTS, synthetic_data
+from .outbox import EVENT_HANDLERS, MAX_ATTEMPTS, dispatch_batch, publish
+from .priority import adjust_priority, calculate_priorities, priority_level
+from .renderers import FastJSONParser, FastJSONRenderer
+from .scoring import DEFAULT_RULES
+from .simulation import simulate
+from .serializers import (
+    DoctorSerializer, HospitalFullSerializer, OrganMatchingSerializer, SurgerySerializer, UserSerializer,
+)
+
+
+def make_user(index, role='patient', **fields):
+    """Create a user with every required field filled in; `fields` override the defaults."""
+    return User.objects.create_user(**{
+        'national_id': f'2990101{index:07d}', 'password': 'test', 'first_name': 'Test',
+        'last_name': f'{role} {index}', 'role': role, 'birthdate': datetime.date(1990, 1, 1),
+        'blood_type': 'O+', 'gender': 'ذكر', 'medical_record_number': f'MRN-{index}', **fields,
+    })
+
+
+@unittest.skipIf(connection.vendor == 'sqlite', "SQLite serializes writers; needs a row-locking database")
+class AdjustPriorityConcurrencyTests(TransactionTestCase):
+    THREADS = 8
+    INCREMENTS = 25
+
+    def setUp(self):
+        self.patient = make_user(1)
+
+    def test_parallel_increments_are_not_lost(self):
+        barrier = threading.Barrier(self.THREADS)
+        errors = []
+
+        def worker():
+            try:
+                barrier.wait()
+                for _ in range(self.INCREMENTS):
+                    adjust_priority(self.patient.pk, 1)
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        priority = PatientPriority.objects.get(patient=self.patient)
+        self.assertEqual(priority.score, self.THREADS * self.INCREMENTS)
+        self.assertEqual(priority.level, 'critical')
+
+
+class AdjustPriorityTests(TestCase):
+    def test_level_follows_new_score(self):
+        patient = make_user(1)
+        self.assertEqual(adjust_priority(patient, 15), (15, 'medium'))
+        self.assertEqual(adjust_priority(patient, 20), (35, 'high'))
+        self.assertEqual(adjust_priority(patient, -30), (5, 'low'))
+
+
+class UniqueMatchMigrationTests(TransactionTestCase):
+    def migrate(self, target):
+        executor = MigrationExecutor(connection)
+        executor.migrate([('core', target)])
+        executor.loader.build_graph()
+        return executor.loader.project_state([('core', target)]).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def add_duplicates(self, apps, count):
+        User = apps.get_model('core', 'User')
+        OrganMatching = apps.get_model('core', 'OrganMatching')
+        patient, donor = (
+            User.objects.create(
+                national_id=f'2990101000000{n}', first_name='Test', last_name=role, role=role,
+                birthdate=datetime.date(1990, 1, 1), blood_type='O+', gender='ذكر', medical_record_number=f'MRN-{n}',
+            )
+            for n, role in enumerate(['patient', 'donor'])
+        )
+        matches = [
+            OrganMatching.objects.create(patient=patient, donor=donor, organ_type=OrganType.KIDNEY)
+            for _ in range(count)
+        ]
+        other = OrganMatching.objects.create(patient=patient, donor=donor, organ_type=OrganType.LIVER)
+        return matches, other
+
+    def add_surgery(self, apps, match):
+        hospital, _ = apps.get_model('core', 'Hospital').objects.get_or_create(
+            name='Hospital', location='Cairo', phone='0100', working_hours='24h',
+        )
+        apps.get_model('core', 'Surgery').objects.create(
+            surgery_number=f'S-{match.pk}', surgery_name='Kidney', scheduled_date=datetime.date(2030, 1, 1),
+            hospital=hospital, organ_matching=match,
+        )
+
+    def test_duplicates_are_removed_keeping_the_one_with_a_surgery(self):
+        apps = self.migrate('0001_initial')
+        matches, other = self.add_duplicates(apps, 3)
+        self.add_surgery(apps, matches[1])
+
+        apps = self.migrate('0002_organmatching_unique_match')
+        OrganMatching = apps.get_model('core', 'OrganMatching')
+        self.assertQuerySetEqual(OrganMatching.objects.order_by('id').values_list('id', flat=True),
+                                 [matches[1].pk, other.pk])
+
+    def test_duplicates_with_several_surgeries_are_reported(self):
+        apps = self.migrate('0001_initial')
+        matches, _ = self.add_duplicates(apps, 3)
+        self.add_surgery(apps, matches[0])
+        self.add_surgery(apps, matches[2])
+
+        with self.assertRaisesMessage(RuntimeError, f'{matches[0].pk}, {matches[2].pk}'):
+            self.migrate('0002_organmatching_unique_match')
+        self.assertEqual(apps.get_model('core', 'OrganMatching').objects.count(), 4)
+        # عشان الـ tearDown يقدر يكمل الـ migrations
+        apps.get_model('core', 'Surgery').objects.all().delete()
+
+
+class MatchPersistenceTests(TestCase):
+    def setUp(self):
+        # الـ on_commit callbacks اللي بتتنفذ هنا بتملى HLAAllele._codes بـ alleles هتترجع مع الـ test
+        patcher = mock.patch.dict(HLAAllele._codes)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def add_user(self, index, role):
+        user = make_user(index, role, status=APPROVED_STATUS, HLA_A_1='A*01')
+        if role == 'patient':
+            PatientMedicalProfile.objects.create(patient=user, organ_needed=OrganType.KIDNEY)
+        else:
+            DonorMedicalProfile.objects.create(donor=user, organ_available=OrganType.KIDNEY)
+        return user
+
+    def test_rescore_keeps_reviewed_status_and_prunes_stale_rows(self):
+        patient = self.add_user(1, 'patient')
+        reviewed, pending = self.add_user(2, 'donor'), self.add_user(3, 'donor')
+        self.assertEqual(rematch_user(patient.pk), 2)
+        OrganMatching.objects.filter(donor=reviewed).update(status='مطابق')
+
+        patient.HLA_A_1 = 'A*02'
+        patient.save()
+        rematch_user(patient.pk)
+        self.assertEqual(OrganMatching.objects.get(donor=reviewed).status, 'مطابق')
+        self.assertEqual(OrganMatching.objects.get(donor=pending).status, DEFAULT_MATCH_STATUS)
+
+        User.objects.filter(pk__in=[reviewed.pk, pending.pk]).update(status='مرفوض')
+        rematch_user(patient.pk)
+        self.assertQuerySetEqual(OrganMatching.objects.values_list('donor_id', flat=True), [reviewed.pk])
+
+    def test_profiles_created_after_registration_are_matched(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            patient = make_user(1, status=APPROVED_STATUS)
+            donor = make_user(2, 'donor', status=APPROVED_STATUS)
+        self.assertFalse(OrganMatching.objects.exists())
+        with self.captureOnCommitCallbacks(execute=True):
+            PatientMedicalProfile.objects.create(patient=patient, organ_needed=OrganType.KIDNEY)
+            DonorMedicalProfile.objects.create(donor=donor, organ_available=OrganType.KIDNEY)
+        self.assertQuerySetEqual(OrganMatching.objects.values_list('patient', 'donor'), [(patient.pk, donor.pk)])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            donor.donor_profile.delete()
+        self.assertFalse(OrganMatching.objects.exists())
+
+    def test_failed_rematch_does_not_break_the_save(self):
+        with mock.patch('core.matching.rematch_user', side_effect=RuntimeError('boom')):
+            with self.assertLogs(level='ERROR'):
+                with self.captureOnCommitCallbacks(execute=True):
+                    make_user(1, status=APPROVED_STATUS)
+
+    def test_upsert_updates_in_place_and_skips_unchanged_rows(self):
+        patient, donor = self.add_user(1, 'patient'), self.add_user(2, 'donor')
+        result = {'match_percentage': 80, 'ai_result': {'hla_mismatches': 2}}
+        with MatchWriter() as writer:
+            writer.add(patient.pk, donor.pk, OrganType.KIDNEY, result)
+        with MatchWriter() as writer:
+            writer.add(patient.pk, donor.pk, OrganType.KIDNEY, result)
+        self.assertEqual((writer.written, writer.skipped), (0, 1))
+        with MatchWriter() as writer:
+            writer.add(patient.pk, donor.pk, OrganType.KIDNEY, {**result, 'match_percentage': 90})
+        self.assertEqual((writer.written, writer.skipped), (1, 0))
+        self.assertQuerySetEqual(OrganMatching.objects.values_list('match_percentage', flat=True), [90.0])
+
+    def test_run_alerts_each_user_once(self):
+        patient = self.add_user(1, 'patient')
+        donors = [self.add_user(index, 'donor') for index in range(2, 5)]
+        run = MatchRun(batch_size=2)
+        self.assertEqual(len(list(run)), 3)
+        self.assertEqual(run.batches, 2)
+        self.assertQuerySetEqual(
+            Alert.objects.filter(user=patient).values_list('message', flat=True),
+            [f"تم تعديل 3 Match للعضو: {OrganType.KIDNEY}"],
+        )
+        self.assertEqual(Alert.objects.filter(user__in=donors).count(), 3)
+
+    def test_top_k_run_prunes_untouched_matches_outside_k(self):
+        patient = self.add_user(1, 'patient')
+        donors = [self.add_user(index, 'donor') for index in range(2, 5)]
+        list(MatchRun())
+        OrganMatching.objects.filter(donor=donors[2]).update(status='مطابق')
+        run = MatchRun(k=1)
+        list(run)
+        self.assertEqual(run.pruned, 1)
+        self.assertEqual(OrganMatching.objects.filter(patient=patient).count(), 2)
+
+    def test_auto_match_rejects_bad_numbers(self):
+        for query in ('k=abc', 'workers=-1', 'batch_size=1.5'):
+            response = self.client.post(f'/api/organ-matching/auto_match/?{query}')
+            self.assertEqual(response.status_code, 400, query)
+
+    def test_auto_match_streams_ndjson(self):
+        self.add_user(1, 'patient')
+        self.add_user(2, 'donor')
+        response = self.client.post('/api/organ-matching/auto_match/?format=ndjson')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([row['match_percentage'] for row in rows], [100])
+
+    def test_exchange_rejects_bad_numbers(self):
+        for query in ('max_cycle=x', 'max_cycle=0', 'max_cycle=1', 'max_chain=-2'):
+            response = self.client.post(f'/api/organ-matching/exchange/?{query}')
+            self.assertEqual(response.status_code, 400, query)
+
+    def test_requested_workers_are_capped(self):
+        self.assertEqual(MatchRun(workers=10_000).workers, os.cpu_count())
+        self.assertEqual(MatchRun(workers=-3).workers, 1)
+
+    def test_in_place_ai_result_edit_is_saved(self):
+        patient, donor = self.add_user(1, 'patient'), self.add_user(2, 'donor')
+        OrganMatching.objects.create(patient=patient, donor=donor, organ_type=OrganType.KIDNEY, ai_result={})
+        match = OrganMatching.objects.get()
+        match.ai_result['note'] = 'reviewed'
+        match.save()
+        self.assertEqual(match._changed_fields, {'ai_result'})
+        self.assertEqual(OrganMatching.objects.get().ai_result, {'note': 'reviewed'})
+
+
+class ScoringRulesTests(TestCase):
+    @override_settings(ORGAN_MATCHING={**settings.ORGAN_MATCHING, 'SCORING_RULES': {
+        'default': DEFAULT_RULES,
+        OrganType.KIDNEY: (*DEFAULT_RULES, ('pra', {'threshold': 90, 'penalty': 15})),
+    }})
+    def test_organ_rule_set_changes_the_score(self):
+        scores = {}
+        for index, organ in enumerate((OrganType.KIDNEY, OrganType.LIVER)):
+            patient = make_user(2 * index, status=APPROVED_STATUS, HLA_A_1='A*01', PRA=95)
+            donor = make_user(2 * index + 1, 'donor', status=APPROVED_STATUS, HLA_A_1='A*01')
+            PatientMedicalProfile.objects.create(patient=patient, organ_needed=organ)
+            DonorMedicalProfile.objects.create(donor=donor, organ_available=organ)
+            rematch_user(patient.pk)
+            match = OrganMatching.objects.get(patient=patient)
+            self.assertEqual(score_pair(patient, donor, organ)['match_percentage'], match.match_percentage, organ)
+            scores[organ] = match.match_percentage
+        # الـ pra rule متفعلة للكلى بس
+        self.assertEqual(scores, {OrganType.KIDNEY: 85, OrganType.LIVER: 100})
+
+
+class BlockingTests(SimpleTestCase):
+    def random_cohort(self, rng, size):
+        organs = [*ORGAN_TYPES, 'N/A']
+        return Cohort(
+            np.arange(size), [''] * size,
+            [organs[i] for i in rng.integers(0, len(organs), size)],
+            [BLOOD_TYPES[i] for i in rng.integers(0, len(BLOOD_TYPES), size)],
+            np.zeros((size, 6), dtype=np.uint16), np.full(size, 22.0), np.ones(size, dtype=bool),
+        )
+
+    def test_blood_compatibility_rules(self):
+        self.assertTrue(all(blood_compatible('O-', patient) for patient in BLOOD_TYPES))
+        self.assertTrue(all(blood_compatible(donor, 'AB+') for donor in BLOOD_TYPES))
+        self.assertFalse(blood_compatible('A+', 'A-'))
+        self.assertFalse(blood_compatible('B-', 'A+'))
+
+    def test_blocks_hold_every_compatible_pair_once(self):
+        rng = np.random.default_rng(3)
+        patients, donors = self.random_cohort(rng, 120), self.random_cohort(rng, 150)
+        blocked = [
+            (int(i), int(j)) for _, _, patient_indices, donor_indices in BlockingIndex(patients, donors)
+            for i in patient_indices for j in donor_indices
+        ]
+        expected = {
+            (i, j) for i in range(len(patients)) for j in range(len(donors))
+            if patients.organs[i] != 'N/A' and patients.organs[i] == donors.organs[j]
+            and blood_compatible(donors.blood_types[j], patients.blood_types[i])
+        }
+        self.assertEqual(len(blocked), len(set(blocked)))
+        self.assertEqual(set(blocked), expected)
+
+
+class BlockingCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.patient = make_user(1, status=APPROVED_STATUS)
+        self.donor = make_user(2, 'donor', status=APPROVED_STATUS)
+        PatientMedicalProfile.objects.create(patient=self.patient, organ_needed=OrganType.KIDNEY)
+        DonorMedicalProfile.objects.create(donor=self.donor, organ_available=OrganType.KIDNEY)
+
+    def blocks(self):
+        _, _, index = load_blocked_cohorts()
+        return [(organ, blood_type, len(p), len(d)) for organ, blood_type, p, d in index]
+
+    def test_cached_partitions_are_reused_until_something_changes(self):
+        self.assertEqual(self.blocks(), [(OrganType.KIDNEY, 'O+', 1, 1)])
+        self.assertIsNotNone(cache.get(f'matching:blocks:{cohort_fingerprint()}'))
+        with mock.patch('core.matching.load_cohorts') as load_cohorts:
+            self.blocks()
+        load_cohorts.assert_not_called()
+
+        self.donor.blood_type = 'AB+'
+        self.donor.save()
+        self.assertEqual(self.blocks(), [])
+
+        self.donor.blood_type = 'O+'
+        self.donor.save()
+        self.assertEqual(self.blocks(), [(OrganType.KIDNEY, 'O+', 1, 1)])
+
+        profile = self.patient.patient_profile
+        profile.organ_needed = OrganType.LIVER
+        profile.save()
+        self.assertEqual(self.blocks(), [])
+
+
+class CohortSnapshotTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'cohort.snap')
+        self.patient = make_user(1, status=APPROVED_STATUS, HLA_A_1='A*01', blood_type='A+')
+        self.donor = make_user(2, 'donor', status=APPROVED_STATUS, HLA_A_1='A*02')
+        PatientMedicalProfile.objects.create(patient=self.patient, organ_needed=OrganType.KIDNEY)
+        DonorMedicalProfile.objects.create(donor=self.donor, organ_available=OrganType.KIDNEY)
+
+    def assertCohortsMatchDatabase(self, snapshot):
+        encoder = HLAEncoder(HLAAllele.code_map)
+        for role in ('patient', 'donor'):
+            expected, actual = Cohort.load(role, encoder), Cohort.from_snapshot(snapshot, role)
+            self.assertEqual(actual.ids.tolist(), expected.ids.tolist(), role)
+            self.assertEqual((actual.organs, actual.blood_types), (expected.organs, expected.blood_types), role)
+            self.assertEqual(actual.hla.tolist(), expected.hla.tolist(), role)
+
+    def test_full_build_matches_the_database(self):
+        snapshot, changed = build_snapshot(self.path, full=True)
+        self.assertIsNone(changed)
+        self.assertEqual(snapshot.count, 2)
+        self.assertFalse(snapshot_is_stale(snapshot))
+        self.assertCohortsMatchDatabase(snapshot)
+
+    def test_incremental_build_merges_changes_and_deletions(self):
+        build_snapshot(self.path, full=True)
+        self.patient.blood_type = 'B+'
+        self.patient.save()
+        other = make_user(3, 'donor', status=APPROVED_STATUS)
+        DonorMedicalProfile.objects.create(donor=other, organ_available=OrganType.LIVER)
+        self.donor.delete()
+
+        snapshot, changed = build_snapshot(self.path)
+        self.assertIsNotNone(changed)
+        self.assertEqual(snapshot.records['id'].tolist(), [self.patient.pk, other.pk])
+        self.assertCohortsMatchDatabase(snapshot)
+
+    def test_stale_snapshot_is_rebuilt(self):
+        snapshot, _ = build_snapshot(self.path, full=True)
+        self.assertEqual(refresh_snapshot(self.path)[1], 0)
+        self.patient.HLA_A_1 = 'A*03'
+        self.patient.save()
+        self.assertTrue(snapshot_is_stale(snapshot))
+        snapshot, changed = refresh_snapshot(self.path)
+        self.assertGreaterEqual(changed, 1)
+        self.assertFalse(snapshot_is_stale(snapshot))
+        self.assertCohortsMatchDatabase(snapshot)
+
+
+class SimulationTests(TestCase):
+    def setUp(self):
+        self.patient = make_user(1, status=APPROVED_STATUS, HLA_A_1='A*01')
+        self.donors = [
+            make_user(index, 'donor', status=APPROVED_STATUS, HLA_A_1=allele)
+            for index, allele in ((2, 'A*01'), (3, 'A*02'))
+        ]
+        PatientMedicalProfile.objects.create(patient=self.patient, organ_needed=OrganType.KIDNEY)
+        for donor in self.donors:
+            DonorMedicalProfile.objects.create(donor=donor, organ_available=OrganType.KIDNEY)
+        list(MatchRun(notify=False))
+
+    def row_counts(self):
+        return [model.objects.count() for model in (User, OrganMatching, Alert, OutboxEvent, HLAAllele)]
+
+    def test_simulate_writes_nothing(self):
+        before = self.row_counts()
+        with CaptureQueriesContext(connection) as queries:
+            simulate(overrides={self.donors[1].pk: {'HLA_A_1': 'A*99', 'bmi': 24}}, rules={'bmi': None})
+        writes = [q['sql'] for q in queries if q['sql'].split(None, 1)[0].upper() in ('INSERT', 'UPDATE', 'DELETE')]
+        self.assertEqual(writes, [])
+        self.assertEqual(self.row_counts(), before)
+
+    def test_diff_reflects_the_override(self):
+        stored = OrganMatching.objects.get(donor=self.donors[1]).match_percentage
+        result = simulate(overrides={self.donors[1].pk: {'HLA_A_1': 'A*01'}})
+        self.assertEqual(
+            [(d['donor_id'], d['change'], d['stored']) for d in result['diffs']],
+            [(self.donors[1].pk, 'changed', stored)],
+        )
+        self.assertGreater(result['diffs'][0]['simulated'], stored)
+        # الـ simulate مش بيلمس الـ match المتخزن
+        self.assertEqual(OrganMatching.objects.get(donor=self.donors[1]).match_percentage, stored)
+
+    def test_unknown_user_or_field_is_rejected(self):
+        for overrides in ({'999999': {'bmi': 25}}, {str(self.patient.pk): {'password': 'x'}}):
+            response = self.client.post('/api/organ-matching/simulate/', {'overrides': overrides},
+                                        content_type='application/json')
+            self.assertEqual(response.status_code, 400, overrides)
+
+
+class VectorizedScoringParityTests(SimpleTestCase):
+    def test_engine_matches_per_pair_calculate_match(self):
+        rng = random.Random(7)
+        patient_rows = synthetic_rows(40, 'patient', 1, rng)
+        donor_rows = synthetic_rows(60, 'donor', 41, rng)
+        encoder = HLAEncoder()
+        patients, donors = Cohort.from_rows(patient_rows, encoder), Cohort.from_rows(donor_rows, encoder)
+        engine = list(iter_pair_results(patients, donors, rules=DEFAULT_RULES))
+        donor_users = rows_to_users(donor_rows)
+        reference = [
+            OrganMatching.calculate_match(patient, donor)
+            for patient in rows_to_users(patient_rows) for donor in donor_users
+        ]
+        self.assertEqual(len(engine), len(reference))
+        self.assertEqual([result for _, _, result in engine], reference)
+
+
+def allocation_problem(edges):
+    """AllocationProblem from (patient index, donor index, weight) triples."""
+    rows, cols, weights = (np.array(column) for column in zip(*edges))
+    return AllocationProblem(
+        OrganType.KIDNEY, np.arange(rows.max() + 1), np.arange(cols.max() + 1),
+        rows, cols, weights.astype(np.float64), weights.astype(np.float64),
+    )
+
+
+class AllocationSolverTests(SimpleTestCase):
+    def assertOneToOne(self, problem, chosen):
+        self.assertEqual(len(set(problem.rows[chosen].tolist())), len(chosen))
+        self.assertEqual(len(set(problem.cols[chosen].tolist())), len(chosen))
+
+    def test_optimal_is_never_below_greedy(self):
+        # greedy بياخد الـ 10 ويسيب 9 + 9
+        problem = allocation_problem([(0, 0, 10), (0, 1, 9), (1, 0, 9)])
+        self.assertEqual(problem.weights[solve_greedy(problem)].sum(), 10)
+        self.assertEqual(problem.weights[solve_optimal(problem)].sum(), 18)
+
+        rng = np.random.default_rng(7)
+        for _ in range(20):
+            pairs = {(int(r), int(c)) for r, c in rng.integers(0, 12, size=(40, 2))}
+            problem = allocation_problem([(r, c, float(rng.integers(1, 100))) for r, c in sorted(pairs)])
+            optimal, greedy = solve_optimal(problem), solve_greedy(problem)
+            self.assertOneToOne(problem, optimal)
+            self.assertOneToOne(problem, greedy)
+            self.assertGreaterEqual(problem.weights[optimal].sum(), problem.weights[greedy].sum())
+
+    def test_dummy_donors_leave_extra_patients_unassigned(self):
+        # 3 مرضى على متبرع واحد: الـ full matching محتاج الـ dummy columns
+        problem = allocation_problem([(0, 0, 50), (1, 0, 70), (2, 0, 60)])
+        chosen = solve_optimal(problem)
+        self.assertEqual(problem.rows[chosen].tolist(), [1])
+        self.assertOneToOne(problem, chosen)
+
+
+class AllocationRunTests(TestCase):
+    @override_settings(ORGAN_MATCHING={**settings.ORGAN_MATCHING, 'ALLOCATION_GREEDY_MIN_EDGES': 0})
+    def test_auto_falls_back_to_greedy_with_a_valid_assignment(self):
+        patients = [make_user(index) for index in range(3)]
+        donors = [make_user(index, 'donor') for index in range(3, 5)]
+        for patient, donor, score in zip(patients * 2, donors * 3, [90, 80, 70, 60, 50, 40]):
+            OrganMatching.objects.create(patient=patient, donor=donor, organ_type=OrganType.KIDNEY,
+                                         match_percentage=score)
+        result = allocate_organ(OrganType.KIDNEY)
+        self.assertEqual((result['method'], result['assigned']), ('greedy', 2))
+        pairs = [(a['patient_id'], a['donor_id']) for a in result['assignments']]
+        self.assertEqual(len({p for p, _ in pairs}), 2)
+        self.assertEqual(len({d for _, d in pairs}), 2)
+        self.assertTrue(all(
+            OrganMatching.objects.filter(patient_id=p, donor_id=d).exists() for p, d in pairs
+        ))
+
+
+class ExchangeSelectionTests(SimpleTestCase):
+    def test_patient_with_two_pairs_receives_once(self):
+        # pairs 0 و 2 لنفس المريض: الـ cycle (0,1) والـ cycle (2,3) مينفعش يتختاروا مع بعض
+        graph = CompatibilityGraph(
+            [10, 11, 12, 13], [False] * 4, [0, 1, 2, 3], [1, 0, 3, 2], [50.0, 50.0, 40.0, 40.0],
+            patients=[0, 1, 0, 2],
+        )
+        for method in ('optimal', 'greedy'):
+            plan = plan_exchange(max_chain=0, method=method, graph=graph)
+            self.assertEqual([s['pairs'] for s in plan['selected']], [[10, 11]], method)
+
+    def test_cycle_length_boundary(self):
+        # 0 ↔ 1 cycle بطول 2، و 1 → 2 → 3 → 1 cycle بطول 3
+        graph = CompatibilityGraph(
+            [10, 11, 12, 13], [False] * 4, [0, 1, 1, 2, 3], [1, 0, 2, 3, 1], [50.0] * 5,
+        )
+        for max_length, expected in ((0, []), (1, []), (2, [(0, 1)]), (3, [(0, 1), (1, 2, 3)])):
+            self.assertEqual([cycle for cycle, _ in find_cycles(graph, max_length)], expected, max_length)
+
+
+class OutboxTests(TestCase):
+    def setUp(self):
+        self.patient = make_user(1)
+
+    def test_publish_rejects_unknown_kind(self):
+        with self.assertRaises(ValueError):
+            publish('no_such_event')
+
+    def test_dispatch_creates_alerts_and_marks_done(self):
+        publish('vital_sign_breach', patient_id=self.patient.pk, alerts=['ضغط مرتفع'], critical=True)
+        self.assertEqual(dispatch_batch(), (1, 0))
+        self.assertEqual(dispatch_batch(), (0, 0))
+        event = OutboxEvent.objects.get()
+        self.assertEqual((event.status, event.attempts), ('done', 1))
+        self.assertEqual(Alert.objects.get().alert_type, 'critical')
+
+    def test_failed_publish_rolls_back_the_match_change(self):
+        donor = make_user(2, 'donor')
+        match = OrganMatching.objects.create(patient=self.patient, donor=donor, organ_type=OrganType.KIDNEY)
+
+        def failing_publish(sender, instance, **kwargs):
+            publish('no_such_event')
+
+        post_save.connect(failing_publish, sender=OrganMatching)
+        self.addCleanup(post_save.disconnect, failing_publish, sender=OrganMatching)
+        match = OrganMatching.objects.get(pk=match.pk)
+        match.status = 'مطابق'
+        with self.assertRaises(ValueError):
+            match.save()
+        self.assertEqual(OrganMatching.objects.get(pk=match.pk).status, 'pending')
+
+    def test_poison_event_uses_up_attempts_without_blocking_the_batch(self):
+        # الـ handler ده بيرجع Alert من غير user ← الـ insert بيفشل
+        handlers = {'broken': lambda payload: [Alert(message_title='x', message='x', alert_type='info')]}
+        with mock.patch.dict(EVENT_HANDLERS, handlers):
+            broken = publish('broken')
+            publish('vital_sign_breach', patient_id=self.patient.pk, alerts=['حرارة'])
+            self.assertEqual(dispatch_batch(), (1, 1))
+            for _ in range(MAX_ATTEMPTS - 1):
+                dispatch_batch()
+        broken.refresh_from_db()
+        self.assertEqual((broken.status, broken.attempts), ('failed', MAX_ATTEMPTS))
+        self.assertIn('IntegrityError', broken.error)
+        self.assertEqual(Alert.objects.count(), 1)
+
+
+class JobTests(TestCase):
+    def test_enqueue_claim_and_run(self):
+        with mock.patch.dict(JOB_HANDLERS, {'echo': lambda job, value=None: {'value': value}}):
+            job = enqueue_job('echo', {'value': 7})
+            self.assertEqual(claim_next_job('w1').pk, job.pk)
+            self.assertIsNone(claim_next_job('w2'))
+            run_job(Job.objects.get(pk=job.pk))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.worker, job.result), ('done', 'w1', {'value': 7}))
+
+    def test_failing_handler_marks_job_failed(self):
+        def fail(job):
+            raise RuntimeError('boom')
+
+        with mock.patch.dict(JOB_HANDLERS, {'fail': fail}):
+            enqueue_job('fail')
+            job = run_job(claim_next_job())
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+        self.assertIn('boom', job.error)
+
+    def test_stale_running_job_is_claimed_again(self):
+        job = enqueue_job('calculate_priority')
+        claim_next_job('dead worker')
+        self.assertIsNone(claim_next_job('w2'))
+        Job.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - STALE_AFTER - datetime.timedelta(seconds=1))
+        claimed = claim_next_job('w2')
+        self.assertEqual((claimed.pk, claimed.worker), (job.pk, 'w2'))
+
+    def test_params_are_checked_against_the_handler(self):
+        with self.assertRaises(ValueError):
+            enqueue_job('allocate', {'organ_type': 'كلية'})
+        for params, expected in (({'size': 10}, 400), ([10], 400), ({'k': 10}, 201)):
+            response = self.client.post('/api/jobs/', {'kind': 'auto_match', 'params': params},
+                                        content_type='application/json')
+            self.assertEqual(response.status_code, expected, params)
+
+    def test_background_endpoints_return_202(self):
+        for url in ('/api/organ-matching/auto_match/', '/api/organ-matching/allocate/',
+                    '/api/organ-matching/exchange/', '/api/patient-priority/calculate_priority/'):
+            response = self.client.post(f'{url}?background=1')
+            self.assertEqual(response.status_code, 202, url)
+            self.assertEqual(response.json()['status'], 'queued', url)
+        self.assertEqual(Job.objects.count(), 4)
+        self.assertFalse(OrganMatching.objects.exists())
+
+
+class HLAAlleleCacheTests(TestCase):
+    def test_new_code_is_cached_only_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            code = HLAAllele.code_for('A*99')
+            # التاني بيلاقي الـ row موجود، بس لسه مش committed
+            self.assertEqual(HLAAllele.code_for('A*99'), code)
+            self.assertNotIn('A*99', HLAAllele._codes)
+        self.assertEqual(HLAAllele._codes.pop('A*99'), code)
+
+
+class CalculatePrioritiesTests(TestCase):
+    @staticmethod
+    def per_patient(patient):
+        # الحساب القديم patient بـ patient (المرجع)
+        score = 0
+        if patient.chronic_diseases.exists():
+            score += patient.chronic_diseases.count() * 10
+        if hasattr(patient, 'patient_profile') and patient.patient_profile.organ_needed:
+            score += 20
+        return score, priority_level(score)
+
+    def test_set_based_recompute_matches_per_patient_and_skips_unchanged_rows(self):
+        diseases = [ChronicDisease.objects.create(name=f'Disease {n}') for n in range(3)]
+        for index in range(6):
+            patient = make_user(index)
+            for disease in diseases[:index % 4]:
+                UserChronicDisease.objects.create(user=patient, disease=disease, severity='متوسط')
+            if index % 2:
+                PatientMedicalProfile.objects.create(patient=patient, organ_needed=OrganType.KIDNEY)
+            if index == 5:
+                PatientPriority.objects.create(patient=patient, score=0, level='low')
+
+        summary = calculate_priorities()
+        self.assertEqual((summary['created'], summary['updated']), (5, 1))
+        expected = {p.pk: self.per_patient(p) for p in User.objects.filter(role='patient')}
+        self.assertEqual(
+            {p.patient_id: (p.score, p.level) for p in PatientPriority.objects.all()}, expected,
+        )
+
+        with CaptureQueriesContext(connection) as queries:
+            summary = calculate_priorities()
+        self.assertEqual(summary['unchanged'], 6)
+        self.assertFalse([q for q in queries if q['sql'].startswith(('INSERT', 'UPDATE'))])
+
+
+class UserSerializerQueryCountTests(TestCase):
+    def add_patient(self, index):
+        patient = make_user(index)
+        PatientMedicalProfile.objects.create(patient=patient, organ_needed=OrganType.KIDNEY)
+        PatientPriority.objects.create(patient=patient, score=10, level='اولوليه منخفضه')
+        UserChronicDisease.objects.create(user=patient, disease=self.disease, severity='متوسط')
+        Alert.objects.create(user=patient, message_title='Alert', alert_type='معلومة')
+        UserReport.objects.create(patient=patient, report_type='MRI', state='مكتمل')
+        return patient
+
+    def serialize_all(self):
+        with CaptureQueriesContext(connection) as queries:
+            data = UserSerializer(UserSerializer.setup_eager_loading(User.objects.order_by('id')), many=True).data
+        return data, len(queries)
+
+    def test_query_count_does_not_grow_with_users(self):
+        self.disease = ChronicDisease.objects.create(name='Diabetes')
+        self.add_patient(1)
+        _, one_user = self.serialize_all()
+        for index in range(2, 6):
+            self.add_patient(index)
+        data, five_users = self.serialize_all()
+
+        self.assertEqual(one_user, five_users)
+        self.assertEqual(len(data), 5)
+        self.assertEqual(data[0]['chronic_diseases'], [{"name": "Diabetes", "severity": "متوسط"}])
+        self.assertEqual(len(data[0]['alerts']), 1)
+        self.assertEqual(data[0]['priority']['score'], 10)
+
+
+class HospitalDashboardTests(TestCase):
+    def add_hospital(self, index, patients, donors):
+        hospital = Hospital.objects.create(
+            name=f'Hospital {index}', location='Cairo', phone='0100', working_hours='24h',
+            email=f'hospital{index}@example.com',
+        )
+        for offset, role in enumerate(['patient'] * patients + ['donor'] * donors):
+            make_user(index * 1000 + offset, role, hospital=hospital)
+        return hospital
+
+    def serialize_all(self):
+        with CaptureQueriesContext(connection) as queries:
+            queryset = HospitalFullSerializer.setup_eager_loading(Hospital.objects.order_by('id'))
+            data = HospitalFullSerializer(queryset, many=True).data
+        return data, len(queries)
+
+    def test_counts_and_constant_query_count(self):
+        self.add_hospital(1, patients=2, donors=1)
+        _, one_hospital = self.serialize_all()
+        self.add_hospital(2, patients=3, donors=2)
+        data, two_hospitals = self.serialize_all()
+
+        self.assertEqual(one_hospital, two_hospitals)
+        self.assertEqual([(h['patients_count'], h['donors_count']) for h in data], [(2, 1), (3, 2)])
+        self.assertEqual([len(h['patients']) for h in data], [2, 3])
+        self.assertEqual(data[0]['total_surgeries'], 0)
+        self.assertEqual(data[0]['total_matches'], 0)
+
+    def test_matches_without_percentage_sort_last(self):
+        hospital = self.add_hospital(1, patients=1, donors=2)
+        patient = hospital.users.get(role='patient')
+        first, second = hospital.users.filter(role='donor')
+        OrganMatching.objects.create(patient=patient, donor=first, organ_type=OrganType.KIDNEY)
+        OrganMatching.objects.create(patient=patient, donor=second, organ_type=OrganType.KIDNEY, match_percentage=70)
+        data, _ = self.serialize_all()
+        self.assertEqual([m['match_percentage'] for m in data[0]['matches']], [70.0, None])
+
+
+class SparseFieldsetTests(SimpleTestCase):
+    def test_full_shape_selects_every_nested_relation(self):
+        self.assertEqual(SurgerySerializer.related_paths(), [
+            'organ_matching', 'organ_matching__patient', 'organ_matching__donor',
+            'doctor', 'doctor__hospital', 'hospital',
+        ])
+        self.assertIsNone(SurgerySerializer.only_fields())
+
+    def test_expand_selects_only_requested_relations(self):
+        self.assertEqual(SurgerySerializer.related_paths(None, ['organ_matching_detail.patient_detail']), [
+            'organ_matching', 'organ_matching__patient',
+        ])
+        self.assertEqual(SurgerySerializer.related_paths(['id', 'status'], None), [])
+        self.assertEqual(SurgerySerializer.only_fields(['id', 'status', 'doctor_detail']), ['doctor', 'id', 'status'])
+
+    def test_serializer_drops_unrequested_fields(self):
+        hospital = Hospital(id=1, name='Hospital', location='Cairo', phone='0100', working_hours='24h')
+        doctor = Doctor(id=2, name='Doctor', specialty='Nephrology', phone='0101', hospital=hospital)
+        self.assertEqual(DoctorSerializer(doctor, fields=['id', 'name']).data, {'id': 2, 'name': 'Doctor'})
+        self.assertEqual(set(DoctorSerializer(doctor, expand=[]).data), {'id', 'name', 'specialty', 'phone', 'hospital'})
+        self.assertEqual(DoctorSerializer(doctor, expand=['hospital_detail']).data['hospital_detail']['name'], 'Hospital')
+
+
+class FastListParityTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        synthetic_data(20, random.Random(1))
+
+    def test_row_mappers_match_serializers(self):
+        for name, (serializer_class, queryset, aliases) in ENDPOINTS.items():
+            with self.subTest(endpoint=name):
+                base = queryset().order_by('pk')
+                mapper = RowMapper(serializer_class(), aliases)
+                fast = [mapper.map(row) for row in mapper.values(base)]
+                slow = serializer_class(base, many=True).data
+                self.assertTrue(fast)
+                self.assertEqual(json.dumps(fast, ensure_ascii=False), json.dumps(slow, ensure_ascii=False))
+
+    def test_sparse_shape_matches_serializer(self):
+        base = Doctor.objects.order_by('pk')
+        mapper = RowMapper(DoctorSerializer(fields=['id', 'name'], expand=['hospital_detail']))
+        self.assertEqual(mapper.lookups[:4], ['id', 'name', 'hospital', 'hospital__id'])
+        slow = DoctorSerializer(base, many=True, fields=['id', 'name'], expand=['hospital_detail']).data
+        self.assertEqual([mapper.map(row) for row in mapper.values(base)], slow)
+
+    def test_ndjson_export_streams_through_the_mapper(self):
+        response = self.client.get('/api/doctors/?format=ndjson&fields=id,name')
+        self.assertEqual(response.status_code, 200)
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(rows, list(Doctor.objects.order_by('pk').values('id', 'name')))
+
+
+class OrganMatchingListQueryTests(TestCase):
+    def page_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/organ-matching/')
+        return response.json()['results'], len(queries)
+
+    def test_page_query_count_does_not_grow_with_rows(self):
+        synthetic_data(60, random.Random(3))
+        rows, full_page = self.page_queries()
+        self.assertEqual(len(rows), 30)
+        self.assertIsNotNone(rows[0]['patient_detail'])
+        OrganMatching.objects.exclude(pk=OrganMatching.objects.order_by('pk')[0].pk).delete()
+        rows, one_row = self.page_queries()
+        self.assertEqual((len(rows), one_row), (1, full_page))
+
+    def test_serializer_reads_annotations_and_mini_users(self):
+        synthetic_data(60, random.Random(3))
+        queryset = OrganMatching.objects.with_user_mini().with_hla_mismatch_count()[:30]
+        with CaptureQueriesContext(connection) as queries:
+            data = OrganMatchingSerializer(queryset, many=True).data
+        self.assertEqual((len(data), len(queries)), (30, 1))
+
+
+class FastJSONTests(SimpleTestCase):
+    payload = {
+        "message": "تم تأكيد المطابقة\u2028", "created_at": timezone.now(), "birthdate": datetime.date(1990, 1, 1),
+        "time": datetime.time(10, 30), "bmi": decimal.Decimal("24.50"), "label": gettext_lazy("Patient"),
+        1: [None, True, 1.5],
+    }
+
+    def test_renderer_matches_drf(self):
+        self.assertEqual(FastJSONRenderer().render(self.payload), JSONRenderer().render(self.payload))
+
+    def test_indent_falls_back_to_drf(self):
+        self.assertEqual(
+            FastJSONRenderer().render(self.payload, renderer_context={'indent': 4}),
+            JSONRenderer().render(self.payload, renderer_context={'indent': 4}),
+        )
+
+    def test_parser_matches_drf(self):
+        body = JSONRenderer().render(self.payload)
+        self.assertEqual(FastJSONParser().parse(io.BytesIO(body)), JSONParser().parse(io.BytesIO(body)))
+        with self.assertRaises(ParseError):
+            FastJSONParser().parse(io.BytesIO(b'{"score": NaN}'))
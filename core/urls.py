@@ -36,12 +36,14 @@ router.register(r'patient-profiles', PatientMedicalProfileViewSet, basename='pat
 router.register(r'donor-profiles', DonorMedicalProfileViewSet, basename='donor-profile')
 router.register(r'appointments', AppointmentViewSet, basename='appointment')
 router.register(r'organ-matching', OrganMatchingViewSet, basename='organ-matching')
+router.register(r'exchange-pairs', ExchangePairViewSet, basename='exchange-pair')
 router.register(r'surgeries', SurgeryViewSet, basename='surgery')
 router.register(r'mri-reports', MRIReportViewSet, basename='mri-report')
 router.register(r'UserReport', UserReportViewSet, basename='UserReport')
 router.register(r'surgery-reports', SurgeryReportViewSet, basename='surgery-reports')
 router.register(r'patient-priority', PatientPriorityViewSet, basename='patient-priority')
 router.register(r'alerts', AlertViewSet, basename='alert')
+router.register(r'jobs', JobViewSet, basename='job')
 # router.register(r'vital-signs', VitalSignViewSet, basename='vital-signs')
 
 
@@ -1,6 +1,8 @@
-from rest_framework import viewsets, status ,generics
+from itertools import chain
+from rest_framework import viewsets, status ,generics, mixins
 from rest_framework.views import APIView
 from rest_framework.decorators import action
+from rest_framework.exceptions import ParseError
 from rest_framework.response import Response
 from django.core.exceptions import ValidationError
 from .models import *
@@ -8,9 +10,30 @@ from .serializers import *
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.authtoken.models import Token
 from django.contrib.auth import authenticate
+from django.db import transaction
 from django.db.models import Count, Q
-
-
+from .matching import MatchRun
+from .allocation import ALLOCATION_METHODS, allocate
+from .exchange import EXCHANGE_METHODS, plan_exchange
+from .simulation import simulate
+from .priority import SURGERY_REPORT_LEVELS, adjust_priority, calculate_priorities
+from .jobs import enqueue_job, wants_background
+from .outbox import publish
+from .fastpath import FastListMixin
+from .fieldsets import DynamicFieldsViewMixin
+from .streaming import StreamingListMixin, serialize_rows, stream_format, stream_response
+
+
+def int_param(request, name, default=0):
+    # query param رقمي؛ قيمة غلط ← 400 بدل 500
+    value = request.query_params.get(name, default)
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise ParseError(f"{name} must be a non-negative integer")
+    if value < 0:
+        raise ParseError(f"{name} must be a non-negative integer")
+    return value
 
 
 class PatientMedicalProfileListView(generics.ListAPIView):
@@ -237,11 +260,15 @@ class HospitalRegisterView(generics.GenericAPIView):
 #         return Response(data)
 
 
-class HospitalViewSet(viewsets.ModelViewSet):
+class HospitalViewSet(DynamicFieldsViewMixin, viewsets.ModelViewSet):
     queryset = Hospital.objects.all()
     serializer_class = HospitalFullSerializer  # استخدمنا FullSerializer
 
-class DoctorViewSet(viewsets.ModelViewSet):
+    def get_queryset(self):
+        # الـ counts في نفس query الـ hospitals، والـ nested data المطلوبة مرة واحدة للـ page
+        return HospitalFullSerializer.setup_eager_loading(super().get_queryset(), *(self.requested_shape() or ()))
+
+class DoctorViewSet(FastListMixin, DynamicFieldsViewMixin, viewsets.ModelViewSet):
     queryset = Doctor.objects.all()
     serializer_class = DoctorSerializer
     def get_queryset(self):
@@ -260,7 +287,7 @@ class ChronicDiseaseViewSet(viewsets.ModelViewSet):
     serializer_class = ChronicDiseaseSerializer
 
 
-class UserChronicDiseaseViewSet(viewsets.ModelViewSet):
+class UserChronicDiseaseViewSet(DynamicFieldsViewMixin, viewsets.ModelViewSet):
     queryset = UserChronicDisease.objects.all()
     serializer_class = UserChronicDiseaseSerializer
 
@@ -281,7 +308,7 @@ class DonorMedicalProfileViewSet(viewsets.ModelViewSet):
 # ==========================
 # Appointments
 # ==========================
-class AppointmentViewSet(viewsets.ModelViewSet):
+class AppointmentViewSet(FastListMixin, DynamicFieldsViewMixin, viewsets.ModelViewSet):
     queryset = Appointment.objects.all()
     serializer_class = AppointmentSerializer
 
@@ -298,42 +325,102 @@ class AppointmentViewSet(viewsets.ModelViewSet):
 # ==========================
 # Organ & Matching
 # ==========================
-class OrganMatchingViewSet(viewsets.ModelViewSet):
+class OrganMatchingViewSet(FastListMixin, DynamicFieldsViewMixin, viewsets.ModelViewSet):
     queryset = OrganMatching.objects.all()
     serializer_class = OrganMatchingSerializer
+    # الـ list بيقرا الـ mismatch count من الـ annotation (with_hla_mismatch_count)
+    fast_list_aliases = {'hla_mismatch_count': 'db_hla_mismatch_count'}
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        # الـ list/retrieve: عدد الـ queries ثابت مهما كان حجم الصفحة
+        if self.action in ('list', 'retrieve'):
+            if self.requested_shape() is None:
+                queryset = queryset.with_user_mini()
+            if self.renders_field('hla_mismatch_count'):
+                queryset = queryset.with_hla_mismatch_count()
+        return queryset
 
     @action(detail=False, methods=['post'])
     def auto_match(self, request):
-        patients = User.objects.filter(role='patient', status='approved')
-        all_matches = []
-        for patient in patients:
-            donors = User.objects.filter(role='donor', status='approved')
-            for donor in donors:
-                result = OrganMatching.calculate_match(patient, donor)
-                # تخزين الـ match
-                match, created = OrganMatching.objects.update_or_create(
-                    patient=patient,
-                    donor=donor,
-                    defaults={
-                        "organ_type": getattr(patient.patient_profile, 'organ_needed', 'N/A'),
-                        "match_percentage": result['match_percentage'],
-                        "ai_result": result['ai_result'],
-                        "status": 'في الانتظار'  # الحالة الافتراضية
-                    }
-                )
-                all_matches.append({
-                    "patient": str(patient),
-                    "donor": str(donor),
-                    "organ_type": getattr(patient.patient_profile, 'organ_needed', 'N/A'),
-                    "match_percentage": result['match_percentage']
-                })
-        return Response(all_matches)
+        batch_size = int_param(request, 'batch_size') or None
+        # ?k=10 ← أفضل K متبرعين لكل مريض بس (تخزين ورد)؛ الـ matches اللي برة الـ K بتتمسح
+        k = int_param(request, 'k') or None
+        workers = int_param(request, 'workers') or None
+        # الـ runs الكبيرة بتتنفذ في الـ worker (manage.py run_jobs)
+        if wants_background(request):
+            job = enqueue_job('auto_match', {"batch_size": batch_size, "k": k, "workers": workers})
+            return Response(JobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+        # المرضى والمتبرعين بيتحملوا مرة واحدة والـ scores بتتحسب كـ matrix
+        # وبيتقسموا حسب العضو وتوافق فصيلة الدم، والتخزين على دفعات
+        run = MatchRun(batch_size=batch_size, k=k, workers=workers)
+        fmt = stream_format(request)
+        if fmt:
+            return stream_response(run, fmt, filename="auto_match.csv")
+        all_matches = list(run)
+        return Response(all_matches, headers={
+            "X-Rows-Written": str(run.written), "X-Rows-Skipped": str(run.skipped),
+        })
+
+    @action(detail=False, methods=['post'])
+    def allocate(self, request):
+        # توزيع واحد-لواحد لكل عضو على الـ matches المتخزنة (?organ_type=كلية&method=auto|optimal|greedy)
+        organ_types = request.query_params.getlist('organ_type') or None
+        method = request.query_params.get('method', 'auto')
+        if method not in ALLOCATION_METHODS:
+            return Response({"detail": f"method must be one of {', '.join(ALLOCATION_METHODS)}"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if wants_background(request):
+            job = enqueue_job('allocate', {"organ_types": organ_types, "method": method})
+            return Response(JobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+        return Response(allocate(organ_types, method))
+
+    @action(detail=False, methods=['post'])
+    def simulate(self, request):
+        # what-if: {"overrides": {user_id: {field: value}}, "rules": {"bmi": null, "pra": {"threshold": 90}},
+        #           "patients": [ids], "k": 10} ← نتايج مترتبة + diff مع الـ matches المتخزنة، من غير أي كتابة
+        data = request.data
+        try:
+            result = simulate(
+                overrides=data.get('overrides'),
+                rules=data.get('rules'),
+                patient_ids=data.get('patients'),
+                k=int(data.get('k') or request.query_params.get('k', 0)) or None,
+            )
+        except (AttributeError, TypeError, ValueError) as exc:
+            return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(result)
+
+    @action(detail=False, methods=['post'])
+    def exchange(self, request):
+        # paired exchange: cycles (2/3) وchains من المتبرعين الـ altruistic على ExchangePair
+        params = {
+            "organ_type": request.query_params.get('organ_type', OrganType.KIDNEY),
+            "max_cycle": min(int_param(request, 'max_cycle', 3), 3),
+            "max_chain": int_param(request, 'max_chain', 3),
+            "method": request.query_params.get('method', 'auto'),
+        }
+        if params['max_cycle'] < 2:
+            return Response({"detail": "max_cycle must be 2 or 3"}, status=status.HTTP_400_BAD_REQUEST)
+        if params['method'] not in EXCHANGE_METHODS:
+            return Response({"detail": f"method must be one of {', '.join(EXCHANGE_METHODS)}"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if wants_background(request):
+            job = enqueue_job('exchange', params)
+            return Response(JobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+        return Response(plan_exchange(**params))
+
+
+class ExchangePairViewSet(DynamicFieldsViewMixin, viewsets.ModelViewSet):
+    queryset = ExchangePair.objects.all()
+    serializer_class = ExchangePairSerializer
 
 
 # ==========================
 # Surgery
 # ==========================
-class SurgeryViewSet(viewsets.ModelViewSet):
+class SurgeryViewSet(DynamicFieldsViewMixin, viewsets.ModelViewSet):
     queryset = Surgery.objects.all()
     serializer_class = SurgerySerializer
 
@@ -341,7 +428,7 @@ class SurgeryViewSet(viewsets.ModelViewSet):
 # ==========================
 # MRI Reports
 # ==========================
-class MRIReportViewSet(viewsets.ModelViewSet):
+class MRIReportViewSet(DynamicFieldsViewMixin, viewsets.ModelViewSet):
     queryset = MRIReport.objects.all()
     serializer_class = MRIReportSerializer
 
@@ -349,52 +436,45 @@ class MRIReportViewSet(viewsets.ModelViewSet):
 # ==========================
 # Patient Priority
 # ==========================
-class PatientPriorityViewSet(viewsets.ModelViewSet):
+class PatientPriorityViewSet(DynamicFieldsViewMixin, viewsets.ModelViewSet):
     queryset = PatientPriority.objects.all()
     serializer_class = PatientPrioritySerializer
 
     @action(detail=False, methods=['post'])
     def calculate_priority(self, request):
-        patients = User.objects.filter(role='patient')
-        results = []
-        for patient in patients:
-            score = 0
-            if patient.chronic_diseases.exists():
-                score += patient.chronic_diseases.count() * 10
-            if hasattr(patient, 'patient_profile') and patient.patient_profile.organ_needed:
-                score += 20
-
-            # تحديد المستوى
-            level = 'low'
-            if score >= 50:
-                level = 'critical'
-            elif score >= 30:
-                level = 'high'
-            elif score >= 10:
-                level = 'medium'
-
-            # حفظ أو تحديث
-            priority, _ = PatientPriority.objects.update_or_create(
-                patient=patient,
-                defaults={'score': score, 'level': level}
-            )
+        if wants_background(request):
+            job = enqueue_job('calculate_priority')
+            return Response(JobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+        # ?details=0 ← العدد والوقت بس من غير نتيجة كل مريض
+        details = request.query_params.get('details', '1').lower() not in ('0', 'false', 'no')
+        return Response(calculate_priorities(details=details))
+
+
+# ==========================
+# Background Jobs
+# ==========================
+class JobViewSet(mixins.CreateModelMixin, viewsets.ReadOnlyModelViewSet):
+    queryset = Job.objects.all()
+    serializer_class = JobSerializer
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        job_status = self.request.query_params.get("status")
+        if job_status:
+            queryset = queryset.filter(status=job_status)
+        return queryset
 
-            results.append({
-                "patient": str(patient),
-                "score": score,
-                "level": level
-            })
 
-        return Response(results)
 # ==========================
 # Alerts
 # ==========================
-class AlertViewSet(viewsets.ModelViewSet):
+class AlertViewSet(FastListMixin, DynamicFieldsViewMixin, viewsets.ModelViewSet):
     queryset = Alert.objects.all()
     serializer_class = AlertSerializer
 
     def get_queryset(self):
-            return Alert.objects.all().order_by('-created_at')  # مؤقتًا بدون auth
+            return super().get_queryset().order_by('-created_at')  # مؤقتًا بدون auth
 
     @action(detail=True, methods=['post'])
     def mark_read(self, request, pk=None):
@@ -421,10 +501,14 @@ class HospitalAlertViewSet(viewsets.ModelViewSet):
 
 
 
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(DynamicFieldsViewMixin, StreamingListMixin, viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
 
+    def get_queryset(self):
+        # الـ nested collections المطلوبة بتتحمل مرة واحدة للـ page بدل queries لكل user
+        return UserSerializer.setup_eager_loading(super().get_queryset(), *(self.requested_shape() or ()))
+
     # 🔹 إحصائيات عامة لكل users
     @action(detail=False, methods=['get'])
     def stats(self, request):
@@ -452,8 +536,18 @@ class UserViewSet(viewsets.ModelViewSet):
     # 🔹 كل المستخدمين مع التفاصيل الكاملة (patients + donors)
     @action(detail=False, methods=['get'])
     def stats_all(self, request):
-        patients_qs = User.objects.filter(role='patient')
-        donors_qs = User.objects.filter(role='donor')
+        patients_qs = UserSerializer.setup_eager_loading(User.objects.filter(role='patient'))
+        donors_qs = UserSerializer.setup_eager_loading(User.objects.filter(role='donor'))
+
+        # ?format=ndjson|csv ← المرضى وبعدهم المتبرعين صف صف من غير ما نبني الـ lists
+        fmt = stream_format(request)
+        if fmt:
+            context = self.get_serializer_context()
+            rows = chain(
+                serialize_rows(patients_qs.order_by('id'), UserSerializer, context),
+                serialize_rows(donors_qs.order_by('id'), UserSerializer, context),
+            )
+            return stream_response(rows, fmt, filename="users.csv")
 
         # استخدام UserSerializer اللي فيه كل بيانات profile
         patients_data = UserSerializer(patients_qs, many=True).data
@@ -466,7 +560,7 @@ class UserViewSet(viewsets.ModelViewSet):
             "donors": donors_data
         })
 
-class UserReportViewSet(viewsets.ModelViewSet):
+class UserReportViewSet(DynamicFieldsViewMixin, viewsets.ModelViewSet):
     queryset = UserReport.objects.all()
     serializer_class = UserReportSerializer
 
@@ -474,7 +568,7 @@ class UserReportViewSet(viewsets.ModelViewSet):
         user = getattr(self.request, 'user', None)
         if user and not user.is_anonymous:
             # لو في مستخدم مسجل، جِب تقاريره فقط
-            return UserReport.objects.filter(patient=user).order_by('-report_date', '-created_at')
+            return self.shape_queryset(UserReport.objects.filter(patient=user).order_by('-report_date', '-created_at'))
         # لو مفيش مستخدم مسجل، رجع فاضي
         return UserReport.objects.none()
 
@@ -497,37 +591,21 @@ class SurgeryReportViewSet(viewsets.ModelViewSet):
     )
     serializer_class = SurgeryReportSerializer
     def perform_create(self, serializer):
-        report = serializer.save()
-
-        # 🔔 Alert للمريض
-        patient = report.surgery.organ_matching.patient
-        Alert.objects.create(
-            user=patient,
-            message=f"تم إضافة تقرير العملية الجراحية الخاصة بك: {report.surgery.surgery_number}",
-            alert_type='medical'
-        )
-
-        # 🔔 Alert للمستشفى
-        hospital = report.surgery.hospital
-        if hospital:
-            Alert.objects.create(
-                hospital=hospital,
-                message=f"تم إضافة تقرير عملية {report.surgery.surgery_number}.",
-                alert_type='hospital'
+        with transaction.atomic():
+            report = serializer.save()
+            patient = report.surgery.organ_matching.patient
+
+            # 🔔 Alerts للمريض والمستشفى بتتعمل من الـ outbox (manage.py dispatch_outbox)
+            hospital = report.surgery.hospital
+            publish(
+                'surgery_report_added',
+                patient_id=patient.pk,
+                hospital_id=hospital.pk if hospital else None,
+                surgery_number=report.surgery.surgery_number,
             )
 
-        # 📊 تحديث أولوية المريض
-        priority, created = PatientPriority.objects.get_or_create(patient=patient)
-        priority.score += 10
-        if priority.score >= 80:
-            priority.level = 'critical'
-        elif priority.score >= 50:
-            priority.level = 'high'
-        elif priority.score >= 20:
-            priority.level = 'medium'
-        else:
-            priority.level = 'low'
-        priority.save()
+            # 📊 تحديث أولوية المريض
+            adjust_priority(patient, 10, SURGERY_REPORT_LEVELS)
 
 
 
@@ -94,6 +94,30 @@ REST_FRAMEWORK = {
     ],
      'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 30,
+    # JSON بـ orjson (core/renderers.py)، والـ stdlib لو مش متسطب
+    'DEFAULT_RENDERER_CLASSES': [
+        'core.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'core.renderers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+}
+
+# إعدادات الـ matching engine (core/matching.py)
+ORGAN_MATCHING = {
+    # عدد صفوف OrganMatching في كل bulk upsert
+    'BATCH_SIZE': int(os.environ.get('MATCH_BATCH_SIZE', 500)),
+    # عدد الـ processes لتقسيم المرضى في الـ matching runs
+    'WORKERS': int(os.environ.get('MATCH_WORKERS', 1)),
+    # ملف الـ cohort snapshot (manage.py build_match_snapshot)؛ فاضي = من غير snapshot
+    'SNAPSHOT_PATH': os.environ.get('MATCH_SNAPSHOT_PATH') or None,
+    # الـ scoring rules لكل عضو (core/scoring.py)؛ abo / pra / cmv / ebv / age بتتضاف لعضو معين بس لو اتطلبت
+    'SCORING_RULES': {
+        'default': ('hla', 'bmi'),
+    },
 }
 
 WSGI_APPLICATION = 'organ_match.wsgi.application'